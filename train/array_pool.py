@@ -0,0 +1,65 @@
+"""Process pools whose workers share training arrays as read-only memmaps.
+
+train.py's model fits and tuning.py's trials read their arrays from
+WORKER_ARRAYS. In the parent, or when jobs <= 1, that holds the in-memory
+arrays. Pool workers instead np.load(mmap_mode="r") .npy files, which the
+parent writes once per pool (or which already exist, e.g. --shards), so
+nothing large is pickled per task.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+
+WORKER_ARRAYS: Dict[str, np.ndarray] = {}
+
+
+def _init_worker(paths: Dict[str, str], threads: int) -> None:
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(limits=threads)
+    WORKER_ARRAYS.clear()
+    for name, path in paths.items():
+        WORKER_ARRAYS[name] = np.load(path, mmap_mode="r")
+
+
+@contextmanager
+def array_pool(
+    arrays: Dict[str, np.ndarray],
+    jobs: int,
+    array_paths: Optional[Dict[str, str]] = None,
+) -> Iterator[Optional[ProcessPoolExecutor]]:
+    """A pool of `jobs` workers with WORKER_ARRAYS mapped, or None for jobs <= 1.
+
+    With None the caller runs its tasks in this process, where WORKER_ARRAYS
+    holds `arrays` until the block exits. array_paths lists arrays that
+    already exist as .npy files; workers map those directly. The spilled
+    files live until the pool has shut down.
+    """
+
+    if jobs <= 1:
+        WORKER_ARRAYS.clear()
+        WORKER_ARRAYS.update(arrays)
+        try:
+            yield None
+        finally:
+            WORKER_ARRAYS.clear()
+        return
+
+    # Split the cores between the workers' BLAS/OpenMP thread pools.
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    with tempfile.TemporaryDirectory(prefix="worker-arrays-") as array_dir:
+        paths: Dict[str, str] = {}
+        for name, arr in arrays.items():
+            if array_paths and name in array_paths:
+                paths[name] = array_paths[name]
+                continue
+            paths[name] = os.path.join(array_dir, f"{name}.npy")
+            np.save(paths[name], np.ascontiguousarray(arr))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(paths, threads)) as pool:
+            yield pool
@@ -0,0 +1,194 @@
+"""Rolling-origin backtest of the training pipeline.
+
+The ts range is cut into folds + 1 equal blocks. Fold k fits on everything
+before block k + 1 and tests on block k + 1 (expanding window). Training rows
+whose label reaches into the test block are purged: a model for horizon h only
+sees rows with ts + h < test start, so the purge gap equals the horizon. The
+multi-output family fits every horizon at once and is purged by the longest.
+
+Besides out-of-sample metrics per fold, horizon and target, the report has
+wall time and peak RSS for every pipeline stage (see profiling.StageRecorder).
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.metrics import mean_absolute_error
+
+from common import GROUP_TARGET_COLS, HORIZONS_MS
+from predict import predict_groups
+from profiling import StageRecorder
+from train import _safe_auc, build_training_arrays, collect_fit_results, plan_fit_tasks, run_fit_tasks
+
+
+def _is_station_key(name: str) -> bool:
+    return name.startswith("station_") or name.startswith("y_station_")
+
+
+def _take_rows(arrays: Dict[str, np.ndarray], station_rows: np.ndarray, group_rows: np.ndarray) -> Dict[str, np.ndarray]:
+    return {name: arr[station_rows if _is_station_key(name) else group_rows] for name, arr in arrays.items()}
+
+
+def fold_bounds(ts_min: int, ts_max: int, folds: int) -> List[Tuple[int, int]]:
+    """[test_start, test_end) of each fold."""
+
+    block = (ts_max - ts_min + 1) / float(folds + 1)
+    return [
+        (ts_min + int(round((k + 1) * block)), ts_min + int(round((k + 2) * block)) if k + 1 < folds else ts_max + 1)
+        for k in range(folds)
+    ]
+
+
+def _fit_fold(
+    arrays: Dict[str, np.ndarray],
+    test_start: int,
+    model_family: str,
+    jobs: int,
+) -> Dict[str, Any]:
+    artifacts: Dict[str, Any] = {
+        "models": {"station": {}, "group": {}, "fault": {}, "warning": {}},
+        "metrics": {"station": {}, "group": {}, "fault": {}, "warning": {}},
+    }
+    if model_family == "multi-output":
+        purges: List[Tuple[Optional[str], int]] = [(None, max(HORIZONS_MS.values()))]
+    else:
+        purges = list(HORIZONS_MS.items())
+
+    for h_key, purge_ms in purges:
+        station_rows = arrays["station_ts"] + purge_ms < test_start
+        group_rows = arrays["group_ts"] + purge_ms < test_start
+        train_arrays = _take_rows(arrays, station_rows, group_rows)
+        tasks = plan_fit_tasks(train_arrays, GROUP_TARGET_COLS, model_family)
+        if h_key is not None:
+            tasks = [t for t in tasks if t[1] == h_key]
+        results = run_fit_tasks(tasks, train_arrays, jobs=jobs)
+        collect_fit_results(artifacts, tasks, results)
+    return artifacts
+
+
+def _evaluate_fold(
+    artifacts: Dict[str, Any],
+    arrays: Dict[str, np.ndarray],
+    test_start: int,
+    test_end: int,
+) -> Dict[str, Any]:
+    station_rows = (arrays["station_ts"] >= test_start) & (arrays["station_ts"] < test_end)
+    group_rows = (arrays["group_ts"] >= test_start) & (arrays["group_ts"] < test_end)
+    test = _take_rows(arrays, station_rows, group_rows)
+    models = artifacts["models"]
+    x_group = np.asarray(test["group_x"], dtype=float)
+    x_station = np.asarray(test["station_x"], dtype=float)
+
+    metrics: Dict[str, Any] = {"station": {}, "group": {}, "fault": {}, "warning": {}}
+    if len(x_group):
+        group_preds_by_h, fault_probs_by_h, warn_probs_by_h = predict_groups(artifacts, x_group)
+    else:
+        group_preds_by_h, fault_probs_by_h, warn_probs_by_h = {}, {}, {}
+
+    mask_all = np.asarray(test["group_mask_all"])
+    for h_key in HORIZONS_MS.keys():
+        model = models["station"].get(h_key)
+        y = np.asarray(test[f"y_station_{h_key}"])
+        mask = np.isfinite(y)
+        if model is not None and mask.any():
+            pred = model.predict(x_station[mask])
+            metrics["station"][h_key] = {"mae": float(mean_absolute_error(y[mask], pred)), "n": int(mask.sum())}
+
+        metrics["group"][h_key] = {}
+        for col in GROUP_TARGET_COLS:
+            preds = group_preds_by_h.get(h_key, {}).get(col)
+            y = np.asarray(test[f"y_{col}_{h_key}"])
+            mask = np.isfinite(y)
+            if preds is not None and mask.any():
+                metrics["group"][h_key][col] = {
+                    "mae": float(mean_absolute_error(y[mask], preds[mask])),
+                    "n": int(mask.sum()),
+                }
+
+        for kind, probs_by_h in (("fault", fault_probs_by_h), ("warning", warn_probs_by_h)):
+            if models[kind].get(h_key) is None or not mask_all.any():
+                continue
+            y = np.asarray(test[f"y_{kind}_{h_key}"])[mask_all]
+            metrics[kind][h_key] = {"auc": _safe_auc(y, probs_by_h[h_key][mask_all]), "n": int(mask_all.sum())}
+    return metrics
+
+
+def _summarize(fold_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # n-weighted MAE and mean AUC (ignoring folds where AUC is undefined).
+    summary: Dict[str, Any] = {"station": {}, "group": {}, "fault": {}, "warning": {}}
+    for h_key in HORIZONS_MS.keys():
+        parts = [m["station"][h_key] for m in fold_metrics if h_key in m["station"]]
+        if parts:
+            n = sum(p["n"] for p in parts)
+            summary["station"][h_key] = {"mae": sum(p["mae"] * p["n"] for p in parts) / n, "n": n}
+        summary["group"][h_key] = {}
+        for col in GROUP_TARGET_COLS:
+            parts = [m["group"][h_key][col] for m in fold_metrics if col in m["group"].get(h_key, {})]
+            if parts:
+                n = sum(p["n"] for p in parts)
+                summary["group"][h_key][col] = {"mae": sum(p["mae"] * p["n"] for p in parts) / n, "n": n}
+        for kind in ("fault", "warning"):
+            aucs = [m[kind][h_key]["auc"] for m in fold_metrics if h_key in m[kind]]
+            aucs = [a for a in aucs if a == a]
+            if aucs:
+                summary[kind][h_key] = {"auc": float(np.mean(aucs)), "folds": len(aucs)}
+    return summary
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
+    ap.add_argument("--window-hours", type=float, default=12.0)
+    ap.add_argument("--folds", type=int, default=3)
+    ap.add_argument("--model-family", choices=["per-target", "multi-output"], default="per-target")
+    ap.add_argument("--jobs", type=int, default=1)
+    ap.add_argument("--feature-engine", choices=["pandas", "numpy"], default="pandas")
+    ap.add_argument("--compact", action="store_true")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for the per-group rolling features")
+    ap.add_argument("--target-cache", default=None, help="SQLite file caching stationTargetPowerKw per ts; filled incrementally from the coordination snapshots")
+    ap.add_argument("--group-ring", default=None, help="Ring file kept warm by ingest_sink.py (SQLite when cold)")
+    ap.add_argument("--out", default=None, help="Also write the report to this JSON file")
+    args = ap.parse_args()
+
+    start_ts = None
+    if args.window_hours and args.window_hours > 0:
+        start_ts = int(time.time() * 1000) - int(args.window_hours * 60 * 60 * 1000)
+
+    recorder = StageRecorder()
+    _station_cols, _group_cols, arrays = build_training_arrays(args, recorder, start_ts, None, list(GROUP_TARGET_COLS))
+    if len(arrays["group_ts"]) == 0:
+        raise SystemExit("no group rows in the window")
+
+    folds: List[Dict[str, Any]] = []
+    bounds = fold_bounds(int(arrays["group_ts"].min()), int(arrays["group_ts"].max()), max(1, args.folds))
+    for k, (test_start, test_end) in enumerate(bounds):
+        with recorder.stage("fit") as rec:
+            rec["fold"] = k
+            artifacts = _fit_fold(arrays, test_start, args.model_family, args.jobs)
+        with recorder.stage("predict") as rec:
+            rec["fold"] = k
+            metrics = _evaluate_fold(artifacts, arrays, test_start, test_end)
+        folds.append({"fold": k, "test_start_ts": test_start, "test_end_ts": test_end - 1, "metrics": metrics})
+
+    report = {
+        "ok": True,
+        "db_path": args.db,
+        "model_family": args.model_family,
+        "folds": folds,
+        "summary": _summarize([f["metrics"] for f in folds]),
+        "stages": recorder.report(),
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from common import (
+    GROUP_TARGET_COLS,
+    HORIZONS_MS,
+    _decode_battery_groups_python,
+    _read_battery_groups_json,
+    _read_battery_groups_sql,
+    build_group_features,
+    build_labels,
+    build_station_features,
+    latest_features_for_inference,
+    load_data,
+)
+from label_reference import (
+    add_fault_labels_by_horizon,
+    add_future_targets_by_horizon,
+    add_warning_labels_by_horizon,
+    merge_risk_labels_from_future_counts,
+)
+from predict import GROUP_TARGET_KEYS, _ensure_columns, predict_groups
+from profiling import StageRecorder
+from synth_db import generate_db
+
+
+def _best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_decode(args: argparse.Namespace) -> Dict[str, Any]:
+    conn = sqlite3.connect(args.db)
+    try:
+        def run_python() -> pd.DataFrame:
+            return _decode_battery_groups_python(_read_battery_groups_json(conn, "", []))
+
+        def run_sql() -> pd.DataFrame:
+            return _read_battery_groups_sql(conn, None, None)
+
+        a = run_python().sort_values(["groupId", "ts"])
+        b = run_sql().sort_values(["groupId", "ts"])
+        pd.testing.assert_frame_equal(a, b)
+
+        t_python = _best_of(run_python, args.repeat)
+        t_sql = _best_of(run_sql, args.repeat)
+    finally:
+        conn.close()
+
+    return {
+        "rows": int(len(a)),
+        "groups": int(a["groupId"].nunique()) if len(a) else 0,
+        "python_loop_s": t_python,
+        "sql_columnar_s": t_sql,
+        "speedup": t_python / t_sql if t_sql > 0 else None,
+    }
+
+
+def bench_load(args: argparse.Namespace) -> Dict[str, Any]:
+    conn = sqlite3.connect(args.db)
+    try:
+        end_ts = conn.execute("SELECT MAX(ts) FROM telemetry").fetchone()[0]
+        start_ts = None
+        if end_ts is not None and args.window_hours > 0:
+            start_ts = int(end_ts) - int(args.window_hours * 60 * 60 * 1000)
+
+        def run_alarms_full() -> pd.DataFrame:
+            # What load_data read before the alarm window was pushed down.
+            return pd.read_sql_query("SELECT ts, groupId, type, level FROM alarm_occurrences ORDER BY ts ASC", conn)
+
+        alarm_rows_full = len(run_alarms_full())
+        t_alarms_full = _best_of(run_alarms_full, args.repeat)
+    finally:
+        conn.close()
+
+    loaded = load_data(args.db, start_ts=start_ts, read_threads=1)
+    t_sequential = _best_of(lambda: load_data(args.db, start_ts=start_ts, read_threads=1), args.repeat)
+    t_threaded = _best_of(lambda: load_data(args.db, start_ts=start_ts, read_threads=args.threads), args.repeat)
+    return {
+        "window_hours": args.window_hours,
+        "group_rows": int(len(loaded.group_df)),
+        "alarm_rows_full": int(alarm_rows_full),
+        "alarm_rows_window": int(len(loaded.alarm_occurrences)),
+        "alarm_full_read_s": t_alarms_full,
+        "load_sequential_s": t_sequential,
+        "load_threaded_s": t_threaded,
+        "threads": args.threads,
+        "speedup": t_sequential / t_threaded if t_threaded > 0 else None,
+    }
+
+
+def _predict_groups_per_row(artifacts: Dict[str, Any], x_group: np.ndarray) -> int:
+    # The pre-batching predict.py layout: one regressor call per group, target
+    # and horizon; classifiers were already batched.
+    models = artifacts.get("models") or {}
+    calls = 0
+    for i in range(len(x_group)):
+        for h_key in HORIZONS_MS.keys():
+            models_group = models.get("group", {}).get(h_key, {})
+            for col, _out_key in GROUP_TARGET_KEYS:
+                m = models_group.get(col)
+                if m is not None:
+                    m.predict(x_group[i : i + 1])
+                    calls += 1
+    for h_key in HORIZONS_MS.keys():
+        for kind in ("fault", "warning"):
+            clf = models.get(kind, {}).get(h_key)
+            if clf is not None:
+                clf.predict_proba(x_group)
+                calls += 1
+    return calls
+
+
+def bench_predict(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    artifacts = joblib.load(args.model)
+    group_feature_cols = list(artifacts.get("group_feature_cols") or [])
+    station_feature_cols = list(artifacts.get("station_feature_cols") or [])
+
+    loaded = load_data(args.db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    group_feat_df, _ = build_group_features(station_feat_df, loaded.group_df)
+    group_feat_df = _ensure_columns(group_feat_df, group_feature_cols)
+    _station_x, group_x_df, _ts = latest_features_for_inference(
+        station_feat_df, group_feat_df, station_feature_cols, group_feature_cols
+    )
+    base_x = group_x_df[group_feature_cols].to_numpy(dtype=float)
+    if len(base_x) == 0:
+        raise SystemExit("no group rows at the latest ts")
+
+    models = artifacts.get("models") or {}
+    n_classifiers = sum(
+        1 for h_key in HORIZONS_MS.keys() for kind in ("fault", "warning") if models.get(kind, {}).get(h_key) is not None
+    )
+
+    rows: List[Dict[str, Any]] = []
+    for n in [int(v) for v in args.groups.split(",") if v.strip()]:
+        # Tile the real latest rows up to n groups.
+        x_group = base_x[np.arange(n) % len(base_x)]
+        calls_batched = sum(len(v) for v in predict_groups(artifacts, x_group)[0].values()) + n_classifiers
+        calls_per_row = _predict_groups_per_row(artifacts, x_group)
+        t_per_row = _best_of(lambda: _predict_groups_per_row(artifacts, x_group), args.repeat)
+        t_batched = _best_of(lambda: predict_groups(artifacts, x_group), args.repeat)
+        rows.append(
+            {
+                "groups": n,
+                "per_row_calls": calls_per_row,
+                "per_row_s": t_per_row,
+                "per_row_ms_per_call": 1000.0 * t_per_row / max(1, calls_per_row),
+                "batched_calls": calls_batched,
+                "batched_s": t_batched,
+                "batched_ms_per_group": 1000.0 * t_batched / n,
+                "speedup": t_per_row / t_batched if t_batched > 0 else None,
+            }
+        )
+    return rows
+
+
+def bench_features(args: argparse.Namespace) -> Dict[str, Any]:
+    loaded = load_data(args.db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+
+    a, cols = build_group_features(station_feat_df, loaded.group_df, engine="pandas")
+    b, cols_np = build_group_features(station_feat_df, loaded.group_df, engine="numpy")
+    if cols != cols_np or list(a.columns) != list(b.columns):
+        raise SystemExit("engines produced different columns")
+    max_abs_diff = 0.0
+    for c in cols:
+        x = a[c].to_numpy(dtype=float)
+        y = b[c].to_numpy(dtype=float)
+        if not np.array_equal(np.isnan(x), np.isnan(y)):
+            raise SystemExit(f"NaN layout differs in {c}")
+        if np.isfinite(x).any():
+            max_abs_diff = max(max_abs_diff, float(np.nanmax(np.abs(x - y))))
+
+    t_pandas = _best_of(lambda: build_group_features(station_feat_df, loaded.group_df, engine="pandas"), args.repeat)
+    t_numpy = _best_of(lambda: build_group_features(station_feat_df, loaded.group_df, engine="numpy"), args.repeat)
+    return {
+        "rows": int(len(a)),
+        "groups": int(a["groupId"].nunique()) if len(a) else 0,
+        "feature_cols": len(cols),
+        "pandas_s": t_pandas,
+        "numpy_s": t_numpy,
+        "speedup": t_pandas / t_numpy if t_numpy > 0 else None,
+        "max_abs_diff": max_abs_diff,
+    }
+
+
+def bench_workers(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """build_group_features (pandas engine) with the rolling features split over N processes."""
+
+    loaded = load_data(args.db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    serial, serial_cols = build_group_features(station_feat_df, loaded.group_df)
+
+    rows: List[Dict[str, Any]] = []
+    t_serial = None
+    for workers in [int(v) for v in args.workers.split(",") if v.strip()]:
+        out, cols = build_group_features(station_feat_df, loaded.group_df, workers=workers)
+        identical = cols == serial_cols and out.equals(serial)
+        t = _best_of(lambda: build_group_features(station_feat_df, loaded.group_df, workers=workers), args.repeat)
+        if t_serial is None:
+            t_serial = t
+        rows.append(
+            {
+                "workers": workers,
+                "rows": int(len(out)),
+                "groups": int(out["groupId"].nunique()) if len(out) else 0,
+                "seconds": t,
+                "speedup": t_serial / t if t > 0 else None,
+                "identical": identical,
+            }
+        )
+    return rows
+
+
+def bench_labels(args: argparse.Namespace) -> Dict[str, Any]:
+    loaded = load_data(args.db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    group_feat_df, _ = build_group_features(station_feat_df, loaded.group_df, engine="numpy")
+    occ = loaded.alarm_occurrences
+
+    def run_per_group() -> pd.DataFrame:
+        out = add_future_targets_by_horizon(group_feat_df, HORIZONS_MS, GROUP_TARGET_COLS)
+        out = add_fault_labels_by_horizon(out, occ, HORIZONS_MS)
+        out = add_warning_labels_by_horizon(out, occ, HORIZONS_MS)
+        return merge_risk_labels_from_future_counts(out, HORIZONS_MS)
+
+    def run_vectorized() -> pd.DataFrame:
+        return build_labels(group_feat_df, occ, HORIZONS_MS, GROUP_TARGET_COLS)
+
+    pd.testing.assert_frame_equal(run_per_group(), run_vectorized(), check_dtype=False)
+    t_per_group = _best_of(run_per_group, args.repeat)
+    t_vectorized = _best_of(run_vectorized, args.repeat)
+    return {
+        "rows": int(len(group_feat_df)),
+        "groups": int(group_feat_df["groupId"].nunique()) if len(group_feat_df) else 0,
+        "alarm_rows": int(len(occ)),
+        "per_group_s": t_per_group,
+        "vectorized_s": t_vectorized,
+        "speedup": t_per_group / t_vectorized if t_vectorized > 0 else None,
+    }
+
+
+def _run_script(name: str, argv: List[str]) -> float:
+    t0 = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), name)] + argv,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - t0
+
+
+def bench_scaling(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="scaling-")
+    rows: List[Dict[str, Any]] = []
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        groups_s, hours_s = size.lower().split("x")
+        groups, hours = int(groups_s), float(hours_s)
+        db_path = os.path.join(work_dir, f"synth-{groups}x{hours_s}h.db")
+        t0 = time.perf_counter()
+        counts = generate_db(db_path, groups=groups, hours=hours, step_ms=args.step_ms, seed=args.seed)
+        row: Dict[str, Any] = {
+            "groups": groups,
+            "hours": hours,
+            "group_rows": counts["group_rows"],
+            "alarm_rows": counts["alarm_occurrences"],
+            "db_mb": counts["bytes"] / 1e6,
+            "generate_s": time.perf_counter() - t0,
+        }
+
+        recorder = StageRecorder()
+        with recorder.stage("load"):
+            loaded = load_data(db_path)
+        with recorder.stage("features"):
+            station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+            group_feat_df, _ = build_group_features(station_feat_df, loaded.group_df, engine=args.feature_engine)
+        with recorder.stage("labels"):
+            build_labels(group_feat_df, loaded.alarm_occurrences, HORIZONS_MS, GROUP_TARGET_COLS)
+        for rec in recorder.report():
+            row[f"{rec['stage']}_s"] = rec["wall_s"]
+        row["peak_rss_mb"] = max((rec["peak_rss_mb"] or 0.0) for rec in recorder.report())
+        del loaded, station_feat_df, group_feat_df
+
+        if not args.skip_fit:
+            model_dir = os.path.join(work_dir, f"model-{groups}x{hours_s}h")
+            common_args = ["--db", db_path, "--window-hours", "0", "--feature-engine", args.feature_engine]
+            row["train_s"] = _run_script("train.py", common_args + ["--out", model_dir, "--jobs", str(args.jobs)])
+            row["predict_s"] = _run_script(
+                "predict.py",
+                common_args
+                + ["--model", os.path.join(model_dir, "model.joblib"), "--out", os.path.join(model_dir, "pred.json")],
+            )
+        rows.append(row)
+    return rows
+
+
+_LOAD_MODEL_SNIPPET = """
+import sys, time
+t0 = time.perf_counter()
+from predict import load_artifacts
+load_artifacts(sys.argv[1])
+print(time.perf_counter() - t0, 'sklearn' in sys.modules)
+"""
+
+
+def bench_coldstart(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Fresh-process model load and full predict.py run: model.joblib vs compiled model.npz."""
+
+    model_dir = os.path.dirname(os.path.abspath(args.model))
+    base = os.path.splitext(os.path.abspath(args.model))[0]
+    out_path = os.path.join(tempfile.mkdtemp(prefix="coldstart-"), "pred.json")
+    here = os.path.dirname(os.path.abspath(__file__))
+    rows: List[Dict[str, Any]] = []
+    for path in (f"{base}.joblib", f"{base}.npz"):
+        if not os.path.exists(path):
+            raise SystemExit(f"missing {path}; train.py writes both into {model_dir}")
+        load_s: List[float] = []
+        for _ in range(args.repeat):
+            proc = subprocess.run(
+                [sys.executable, "-c", _LOAD_MODEL_SNIPPET, path],
+                check=True,
+                capture_output=True,
+                text=True,
+                cwd=here,
+            )
+            seconds, sklearn_loaded = proc.stdout.split()
+            load_s.append(float(seconds))
+        predict_argv = ["--db", args.db, "--model", path, "--out", out_path, "--window-hours", str(args.window_hours)]
+        predict_argv += ["--feature-path", args.feature_path]
+        predict_s = min(_run_script("predict.py", predict_argv) for _ in range(args.repeat))
+        rows.append(
+            {
+                "model": os.path.basename(path),
+                "bytes": os.path.getsize(path),
+                "load_s": min(load_s),
+                "predict_run_s": predict_s,
+                "sklearn_imported": sklearn_loaded == "True",
+            }
+        )
+    return rows
+
+
+def _format_table(rows: List[Dict[str, Any]]) -> str:
+    cols: List[str] = []
+    for row in rows:
+        cols.extend(c for c in row if c not in cols)
+    cells = [[f"{row.get(c):.3f}" if isinstance(row.get(c), float) else str(row.get(c, "")) for c in cols] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(cols)]
+    lines = ["  ".join(c.rjust(w) for c, w in zip(cols, widths))]
+    lines.extend("  ".join(v.rjust(w) for v, w in zip(r, widths)) for r in cells)
+    return "\n".join(lines)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
+    ap.add_argument("--repeat", type=int, default=3)
+    sub = ap.add_subparsers(dest="bench", required=True)
+    sub.add_parser("decode", help="battery_groups_snapshots: Python loop vs SQL columnar decode")
+    sub.add_parser("features", help="build_group_features: pandas per-group rolling vs NumPy engine")
+    p_workers = sub.add_parser("workers", help="build_group_features: per-group rolling over a process pool")
+    p_workers.add_argument("--workers", default="1,4,16", help="Comma-separated worker counts; the first is the baseline")
+    sub.add_parser("labels", help="group labels: four per-group passes vs one build_labels pass")
+    p_load = sub.add_parser("load", help="load_data: sequential vs concurrent table reads, windowed alarms")
+    p_load.add_argument("--window-hours", type=float, default=12.0, help="Window ending at the newest telemetry ts")
+    p_load.add_argument("--threads", type=int, default=4)
+    p_predict = sub.add_parser("predict", help="group inference: per-row model calls vs one batched call per model")
+    p_predict.add_argument("--model", default=os.path.join("train", "artifacts", "model.joblib"))
+    p_predict.add_argument("--groups", default="10,50,100,200,500")
+    p_scaling = sub.add_parser("scaling", help="end-to-end stage timings on synthetic DBs of growing size")
+    p_scaling.add_argument("--sizes", default="10x1,50x1,100x1,100x4", help="Comma-separated GROUPSxHOURS")
+    p_scaling.add_argument("--step-ms", type=int, default=1000)
+    p_scaling.add_argument("--seed", type=int, default=0)
+    p_scaling.add_argument("--work-dir", default=None, help="Where the DBs and models go (default: a temp dir)")
+    p_scaling.add_argument("--feature-engine", choices=["pandas", "numpy"], default="numpy")
+    p_scaling.add_argument("--jobs", type=int, default=1)
+    p_scaling.add_argument("--skip-fit", action="store_true", help="Only time load, features and labels")
+    p_coldstart = sub.add_parser("coldstart", help="fresh-process startup: model.joblib vs compiled model.npz")
+    p_coldstart.add_argument("--model", default=os.path.join("train", "artifacts", "model.joblib"))
+    p_coldstart.add_argument("--window-hours", type=float, default=12.0)
+    p_coldstart.add_argument("--feature-path", choices=["full", "latest"], default="latest")
+    args = ap.parse_args()
+
+    benches: Dict[str, Callable[[argparse.Namespace], Any]] = {
+        "decode": bench_decode,
+        "features": bench_features,
+        "labels": bench_labels,
+        "load": bench_load,
+        "predict": bench_predict,
+        "scaling": bench_scaling,
+        "workers": bench_workers,
+        "coldstart": bench_coldstart,
+    }
+    result = benches[args.bench](args)
+    if args.bench in ("scaling", "coldstart", "workers"):
+        # Human-readable table on stderr; stdout stays one JSON document.
+        print(_format_table(result), file=sys.stderr)
+    print(json.dumps({"ok": True, "bench": args.bench, "result": result}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
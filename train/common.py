@@ -1,11 +1,19 @@
 import json
+import os
 import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
+from group_ring import GroupRing
+from profiling import stage
+
 
 HORIZONS_MS: Dict[str, int] = {
     "60s": 60_000,
@@ -13,6 +21,35 @@ HORIZONS_MS: Dict[str, int] = {
     "1h": 60 * 60_000,
 }
 
+# (group_df column, JSON path inside one battery_groups_snapshots element)
+GROUP_VALUE_FIELDS: List[Tuple[str, str]] = [
+    ("bms_socPct", "$.bms.socPct"),
+    ("bms_temperatureC", "$.bms.temperatureC"),
+    ("bms_insulationResistanceKohm", "$.bms.insulationResistanceKohm"),
+    ("bms_deltaCellVoltageMv", "$.bms.deltaCellVoltageMv"),
+    ("bms_maxCellTempC", "$.bms.maxCellTempC"),
+    ("bms_warningCount", "$.bms.warningCount"),
+    ("bms_faultCount", "$.bms.faultCount"),
+    ("pcs_setpointKw", "$.pcs.setpointKw"),
+    ("pcs_actualKw", "$.pcs.actualKw"),
+    ("pcs_temperature", "$.pcs.temperature"),
+    ("pcs_dcVoltageV", "$.pcs.dcVoltageV"),
+    ("pcs_dcCurrentA", "$.pcs.dcCurrentA"),
+    ("pcs_efficiencyPct", "$.pcs.efficiencyPct"),
+]
+
+GROUP_DF_COLUMNS: List[str] = ["ts", "groupId"] + [c for c, _path in GROUP_VALUE_FIELDS]
+
+# Regression targets, predicted at every horizon in HORIZONS_MS.
+GROUP_TARGET_COLS: List[str] = [
+    "bms_socPct",
+    "bms_temperatureC",
+    "bms_insulationResistanceKohm",
+    "bms_deltaCellVoltageMv",
+    "pcs_actualKw",
+]
+STATION_TARGET_COLS: List[str] = ["stationTargetPowerKw"]
+
 
 @dataclass(frozen=True)
 class LoadedData:
@@ -25,149 +62,176 @@ def _read_sql(conn: sqlite3.Connection, query: str, params: Sequence[Any] = ())
     return pd.read_sql_query(query, conn, params=params)
 
 
+# Read-side tuning for load_data; the server keeps writing the DB in WAL mode.
+READ_CACHE_KIB = 64 * 1024
+READ_MMAP_BYTES = 256 * 1024 * 1024
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Read-only URI connection that never takes a write lock on the live DB."""
+
+    uri = f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {READ_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _run_reads(
+    db_path: str,
+    reads: Dict[str, Callable[[sqlite3.Connection], Any]],
+    threads: int,
+) -> Dict[str, Any]:
+    # sqlite3 releases the GIL while stepping a statement, so independent
+    # tables can be read on separate connections at the same time.
+    if threads <= 1:
+        conn = connect_readonly(db_path)
+        try:
+            return {name: fn(conn) for name, fn in reads.items()}
+        finally:
+            conn.close()
+
+    local = threading.local()
+    conns: List[sqlite3.Connection] = []
+    conns_lock = threading.Lock()
+
+    def run(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = connect_readonly(db_path)
+            local.conn = conn
+            with conns_lock:
+                conns.append(conn)
+        return fn(conn)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(threads, len(reads))) as pool:
+            futures = {name: pool.submit(run, fn) for name, fn in reads.items()}
+            return {name: f.result() for name, f in futures.items()}
+    finally:
+        for conn in conns:
+            conn.close()
+
+
 def load_data(
     db_path: str,
     start_ts: Optional[int] = None,
     end_ts: Optional[int] = None,
+    group_decoder: str = "sql",
+    compact: bool = False,
+    read_threads: Optional[int] = None,
+    target_cache: Optional[str] = None,
+    group_ring: Optional[str] = None,
 ) -> LoadedData:
-    conn = sqlite3.connect(db_path)
-    try:
-        where = []
-        args: List[Any] = []
-        if isinstance(start_ts, int):
-            where.append("ts >= ?")
-            args.append(start_ts)
-        if isinstance(end_ts, int):
-            where.append("ts <= ?")
-            args.append(end_ts)
-        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
-
-        telemetry = _read_sql(
+    """Read one ts window of every table the features and labels need.
+
+    With target_cache (a separate SQLite file), stationTargetPowerKw comes
+    from the cached (ts, value) table, which is first topped up with the
+    coordination snapshots newer than its last ts; see read_station_targets.
+    With group_ring (written by ingest_sink.py), group rows come from that
+    already-decoded ring file when it covers the window and from SQLite
+    otherwise; see read_group_ring.
+
+    alarm_occurrences is limited to [start_ts, end_ts + longest horizon], which
+    is all the fault/warning labels of rows in the window can look at. Tables
+    are read on up to read_threads read-only connections (default: one per
+    CPU); as before, each table is its own read, so the newest snapshot may be
+    in some frames only.
+    """
+
+    where = []
+    args: List[Any] = []
+    if isinstance(start_ts, int):
+        where.append("ts >= ?")
+        args.append(start_ts)
+    if isinstance(end_ts, int):
+        where.append("ts <= ?")
+        args.append(end_ts)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    alarm_where = []
+    alarm_args: List[Any] = []
+    if isinstance(start_ts, int):
+        alarm_where.append("ts >= ?")
+        alarm_args.append(start_ts)
+    if isinstance(end_ts, int):
+        alarm_where.append("ts <= ?")
+        alarm_args.append(end_ts + max(HORIZONS_MS.values()))
+    alarm_where_sql = f"WHERE {' AND '.join(alarm_where)}" if alarm_where else ""
+
+    group_source = "sqlite"
+
+    def read_groups(conn: sqlite3.Connection) -> pd.DataFrame:
+        nonlocal group_source
+        if group_ring:
+            ring_df = read_group_ring(conn, group_ring, start_ts, end_ts, compact=compact)
+            if ring_df is not None:
+                group_source = "ring"
+                return ring_df
+        if group_decoder == "sql":
+            try:
+                return _read_battery_groups_sql(conn, start_ts, end_ts, compact=compact)
+            except sqlite3.OperationalError:
+                # SQLite built without JSON1: fall back to decoding in Python.
+                pass
+        return _decode_battery_groups_python(_read_battery_groups_json(conn, where_sql, args))
+
+    reads: Dict[str, Callable[[sqlite3.Connection], Any]] = {
+        # The group decode is by far the longest read; submit it first.
+        "battery_groups": read_groups,
+        "telemetry": lambda conn: _read_sql(
             conn,
             f"SELECT ts, averageVoltage, totalCurrent, averageTemperature, systemSOC, systemSOH FROM telemetry {where_sql} ORDER BY ts ASC",
             args,
-        )
-        system_status = _read_sql(
+        ),
+        "system_status": lambda conn: _read_sql(
             conn,
             f"SELECT ts, load, totalPower FROM system_status {where_sql} ORDER BY ts ASC",
             args,
-        )
-        alarm_snapshots = _read_sql(
+        ),
+        "alarm_snapshots": lambda conn: _read_sql(
             conn,
             f"SELECT ts, totalAlarms, criticalAlarms, warningAlarms, infoAlarms FROM alarm_snapshots {where_sql} ORDER BY ts ASC",
             args,
-        )
-        battery_groups = _read_sql(
+        ),
+        "station_targets": lambda conn: read_station_targets(conn, start_ts, end_ts, target_cache),
+        "alarm_occurrences": lambda conn: _read_sql(
             conn,
-            f"SELECT ts, json FROM battery_groups_snapshots {where_sql} ORDER BY ts ASC",
-            args,
-        )
-        coordination_units = _read_sql(
-            conn,
-            f"SELECT ts, json FROM coordination_units_snapshots {where_sql} ORDER BY ts ASC",
-            args,
-        )
-        alarm_occurrences = _read_sql(
-            conn,
-            "SELECT ts, groupId, type, level FROM alarm_occurrences ORDER BY ts ASC",
-        )
+            f"SELECT ts, groupId, type, level FROM alarm_occurrences {alarm_where_sql} ORDER BY ts ASC",
+            alarm_args,
+        ),
+    }
+    if read_threads is None:
+        read_threads = os.cpu_count() or 1
+    with stage("read") as rec:
+        frames = _run_reads(db_path, reads, read_threads)
+        rec["rows"] = int(sum(len(f) for f in frames.values()))
+        rec["group_source"] = group_source
+    telemetry = frames["telemetry"]
+    system_status = frames["system_status"]
+    alarm_snapshots = frames["alarm_snapshots"]
+    station_target_df = frames["station_targets"]
+    alarm_occurrences = frames["alarm_occurrences"]
+    group_df = frames["battery_groups"]
+
+    station = (
+        telemetry.merge(system_status, on="ts", how="outer")
+        .merge(alarm_snapshots, on="ts", how="outer")
+        .sort_values("ts")
+        .reset_index(drop=True)
+    )
 
-        station = (
-            telemetry.merge(system_status, on="ts", how="outer")
-            .merge(alarm_snapshots, on="ts", how="outer")
-            .sort_values("ts")
-            .reset_index(drop=True)
-        )
+    station = station.merge(station_target_df, on="ts", how="outer").sort_values("ts")
 
-        station_target = []
-        for r in coordination_units.itertuples(index=False):
-            try:
-                units = json.loads(getattr(r, "json"))
-                if isinstance(units, list) and units:
-                    u0 = units[0] if isinstance(units[0], dict) else None
-                    target = None
-                    if isinstance(u0, dict):
-                        target = (
-                            ((u0.get("inputs") or {}).get("upper") or {}).get("targetPowerKw")
-                        )
-                    station_target.append(
-                        {
-                            "ts": int(getattr(r, "ts")),
-                            "stationTargetPowerKw": _to_float(target),
-                        }
-                    )
-                else:
-                    station_target.append({"ts": int(getattr(r, "ts")), "stationTargetPowerKw": np.nan})
-            except Exception:
-                station_target.append({"ts": int(getattr(r, "ts")), "stationTargetPowerKw": np.nan})
-        station_target_df = pd.DataFrame.from_records(station_target)
-        station = station.merge(station_target_df, on="ts", how="outer").sort_values("ts")
-
-        group_records: List[Dict[str, Any]] = []
-        for r in battery_groups.itertuples(index=False):
-            ts = int(getattr(r, "ts"))
-            try:
-                groups = json.loads(getattr(r, "json"))
-            except Exception:
-                continue
-            if not isinstance(groups, list):
-                continue
-            for g in groups:
-                if not isinstance(g, dict):
-                    continue
-                gid = g.get("id")
-                if not isinstance(gid, int):
-                    continue
-                bms = g.get("bms") or {}
-                pcs = g.get("pcs") or {}
-                group_records.append(
-                    {
-                        "ts": ts,
-                        "groupId": gid,
-                        "bms_socPct": _to_float(bms.get("socPct")),
-                        "bms_temperatureC": _to_float(bms.get("temperatureC")),
-                        "bms_insulationResistanceKohm": _to_float(bms.get("insulationResistanceKohm")),
-                        "bms_deltaCellVoltageMv": _to_float(bms.get("deltaCellVoltageMv")),
-                        "bms_maxCellTempC": _to_float(bms.get("maxCellTempC")),
-                        "bms_warningCount": _to_float(bms.get("warningCount")),
-                        "bms_faultCount": _to_float(bms.get("faultCount")),
-                        "pcs_setpointKw": _to_float(pcs.get("setpointKw")),
-                        "pcs_actualKw": _to_float(pcs.get("actualKw")),
-                        "pcs_temperature": _to_float(pcs.get("temperature")),
-                        "pcs_dcVoltageV": _to_float(pcs.get("dcVoltageV")),
-                        "pcs_dcCurrentA": _to_float(pcs.get("dcCurrentA")),
-                        "pcs_efficiencyPct": _to_float(pcs.get("efficiencyPct")),
-                    }
-                )
+    station = station.sort_values("ts")
+    group_df = group_df.sort_values(["groupId", "ts"])
+    if compact:
+        station = compact_frame(station)
+        group_df = compact_frame(group_df)
 
-        group_df = pd.DataFrame.from_records(group_records)
-        if group_df.empty:
-            group_df = pd.DataFrame(
-                columns=[
-                    "ts",
-                    "groupId",
-                    "bms_socPct",
-                    "bms_temperatureC",
-                    "bms_insulationResistanceKohm",
-                    "bms_deltaCellVoltageMv",
-                    "bms_maxCellTempC",
-                    "bms_warningCount",
-                    "bms_faultCount",
-                    "pcs_setpointKw",
-                    "pcs_actualKw",
-                    "pcs_temperature",
-                    "pcs_dcVoltageV",
-                    "pcs_dcCurrentA",
-                    "pcs_efficiencyPct",
-                ]
-            )
-
-        station = station.sort_values("ts")
-        group_df = group_df.sort_values(["groupId", "ts"])
-
-        return LoadedData(station_df=station, group_df=group_df, alarm_occurrences=alarm_occurrences)
-    finally:
-        conn.close()
+    return LoadedData(station_df=station, group_df=group_df, alarm_occurrences=alarm_occurrences)
 
 
 def _to_float(v: Any) -> float:
@@ -180,11 +244,369 @@ def _to_float(v: Any) -> float:
         return float("nan")
 
 
-def build_station_features(station_df: pd.DataFrame, group_df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+def _decode_station_targets_python(coordination_units: pd.DataFrame) -> pd.DataFrame:
+    station_target = []
+    for r in coordination_units.itertuples(index=False):
+        try:
+            units = json.loads(getattr(r, "json"))
+            if isinstance(units, list) and units:
+                u0 = units[0] if isinstance(units[0], dict) else None
+                target = None
+                if isinstance(u0, dict):
+                    target = (
+                        ((u0.get("inputs") or {}).get("upper") or {}).get("targetPowerKw")
+                    )
+                station_target.append(
+                    {
+                        "ts": int(getattr(r, "ts")),
+                        "stationTargetPowerKw": _to_float(target),
+                    }
+                )
+            else:
+                station_target.append({"ts": int(getattr(r, "ts")), "stationTargetPowerKw": np.nan})
+        except Exception:
+            station_target.append({"ts": int(getattr(r, "ts")), "stationTargetPowerKw": np.nan})
+    return pd.DataFrame.from_records(station_target, columns=["ts", "stationTargetPowerKw"])
+
+
+def _ts_where(start_ts: Optional[int], end_ts: Optional[int], after_ts: Optional[int] = None) -> Tuple[str, List[Any]]:
+    where = []
+    args: List[Any] = []
+    if isinstance(start_ts, int):
+        where.append("ts >= ?")
+        args.append(start_ts)
+    if isinstance(end_ts, int):
+        where.append("ts <= ?")
+        args.append(end_ts)
+    if isinstance(after_ts, int):
+        where.append("ts > ?")
+        args.append(after_ts)
+    return (f"WHERE {' AND '.join(where)}" if where else ""), args
+
+
+def _decode_station_targets(conn: sqlite3.Connection, where_sql: str, args: Sequence[Any]) -> pd.DataFrame:
+    """stationTargetPowerKw of coordination_units_snapshots rows.
+
+    units[0].inputs.upper.targetPowerKw is extracted inside SQLite, so the large
+    blobs are never copied into Python; the Python decoder is the fallback for
+    SQLite builds without JSON1. Both give NaN for the same malformed rows.
+    """
+
+    try:
+        rows = conn.execute(
+            "SELECT ts, CASE WHEN json_valid(json) THEN json_extract(json, '$[0].inputs.upper.targetPowerKw') END "
+            f"FROM coordination_units_snapshots {where_sql} ORDER BY ts ASC",
+            args,
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return _decode_station_targets_python(
+            _read_sql(conn, f"SELECT ts, json FROM coordination_units_snapshots {where_sql} ORDER BY ts ASC", args)
+        )
+    return pd.DataFrame(
+        {
+            "ts": np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            "stationTargetPowerKw": np.fromiter((_to_float(r[1]) for r in rows), dtype=float, count=len(rows)),
+        }
+    )
+
+
+_TARGET_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS station_target_cache (
+    ts INTEGER PRIMARY KEY,
+    stationTargetPowerKw REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS station_target_cache_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def refresh_target_cache(cache_path: str, conn: sqlite3.Connection) -> Optional[int]:
+    """Bring the cache in cache_path up to date with the DB behind conn.
+
+    Only coordination snapshots newer than the last cached ts are decoded.
+    Rows the server has since deleted (retention) are dropped, and a cache
+    built from another DB, or whose last ts no longer exists, is rebuilt.
+    Returns the last cached ts (None when the cache is empty).
+    """
+
+    db_key = conn.execute("PRAGMA database_list").fetchone()[2]
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    cache = sqlite3.connect(cache_path, timeout=30.0)
+    try:
+        cache.execute("PRAGMA journal_mode = WAL")
+        cache.executescript(_TARGET_CACHE_SCHEMA)
+        with cache:
+            row = cache.execute("SELECT value FROM station_target_cache_meta WHERE key = 'db_path'").fetchone()
+            last_ts = cache.execute("SELECT MAX(ts) FROM station_target_cache").fetchone()[0]
+            stale = row is None or row[0] != db_key
+            if not stale and last_ts is not None:
+                stale = conn.execute("SELECT 1 FROM coordination_units_snapshots WHERE ts = ?", [last_ts]).fetchone() is None
+            if stale:
+                cache.execute("DELETE FROM station_target_cache")
+                cache.execute("INSERT OR REPLACE INTO station_target_cache_meta(key, value) VALUES ('db_path', ?)", [db_key])
+                last_ts = None
+
+            where_sql, args = _ts_where(None, None, last_ts)
+            new = _decode_station_targets(conn, where_sql, args)
+            cache.executemany(
+                "INSERT OR REPLACE INTO station_target_cache(ts, stationTargetPowerKw) VALUES (?, ?)",
+                zip(new["ts"].tolist(), [None if v != v else v for v in new["stationTargetPowerKw"].tolist()]),
+            )
+            first_ts = conn.execute("SELECT MIN(ts) FROM coordination_units_snapshots").fetchone()[0]
+            if first_ts is not None:
+                cache.execute("DELETE FROM station_target_cache WHERE ts < ?", [first_ts])
+            return cache.execute("SELECT MAX(ts) FROM station_target_cache").fetchone()[0]
+    finally:
+        cache.close()
+
+
+def read_station_targets(
+    conn: sqlite3.Connection,
+    start_ts: Optional[int],
+    end_ts: Optional[int],
+    cache_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """(ts, stationTargetPowerKw) of every coordination snapshot in [start_ts, end_ts].
+
+    Without cache_path the values are decoded from the DB. With it, the cache
+    is refreshed and read; snapshots past its last ts (committed after the
+    refresh, or all of them when the cache file cannot be written) are
+    decoded from the DB as before.
+    """
+
+    if not cache_path:
+        where_sql, args = _ts_where(start_ts, end_ts)
+        return _decode_station_targets(conn, where_sql, args)
+
+    try:
+        cached_upto = refresh_target_cache(cache_path, conn)
+    except (OSError, sqlite3.Error):
+        cached_upto = None
+    parts = []
+    if cached_upto is not None:
+        where_sql, args = _ts_where(start_ts, end_ts)
+        cache = connect_readonly(cache_path)
+        try:
+            rows = cache.execute(
+                f"SELECT ts, stationTargetPowerKw FROM station_target_cache {where_sql} ORDER BY ts ASC", args
+            ).fetchall()
+        finally:
+            cache.close()
+        parts.append(
+            pd.DataFrame(
+                {
+                    "ts": np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+                    "stationTargetPowerKw": np.fromiter(
+                        (np.nan if r[1] is None else r[1] for r in rows), dtype=float, count=len(rows)
+                    ),
+                }
+            )
+        )
+    where_sql, args = _ts_where(start_ts, end_ts, cached_upto)
+    parts.append(_decode_station_targets(conn, where_sql, args))
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+
+def _read_battery_groups_json(conn: sqlite3.Connection, where_sql: str, args: Sequence[Any]) -> pd.DataFrame:
+    return _read_sql(
+        conn,
+        f"SELECT ts, json FROM battery_groups_snapshots {where_sql} ORDER BY ts ASC",
+        args,
+    )
+
+
+def _decode_battery_groups_python(battery_groups: pd.DataFrame) -> pd.DataFrame:
+    group_records: List[Dict[str, Any]] = []
+    for r in battery_groups.itertuples(index=False):
+        ts = int(getattr(r, "ts"))
+        try:
+            groups = json.loads(getattr(r, "json"))
+        except Exception:
+            continue
+        if not isinstance(groups, list):
+            continue
+        for g in groups:
+            if not isinstance(g, dict):
+                continue
+            gid = g.get("id")
+            # JSON true/false are bools, which isinstance(_, int) would accept.
+            if type(gid) is not int:
+                continue
+            bms = g.get("bms")
+            pcs = g.get("pcs")
+            bms = bms if isinstance(bms, dict) else {}
+            pcs = pcs if isinstance(pcs, dict) else {}
+            group_records.append(
+                {
+                    "ts": ts,
+                    "groupId": gid,
+                    "bms_socPct": _to_float(bms.get("socPct")),
+                    "bms_temperatureC": _to_float(bms.get("temperatureC")),
+                    "bms_insulationResistanceKohm": _to_float(bms.get("insulationResistanceKohm")),
+                    "bms_deltaCellVoltageMv": _to_float(bms.get("deltaCellVoltageMv")),
+                    "bms_maxCellTempC": _to_float(bms.get("maxCellTempC")),
+                    "bms_warningCount": _to_float(bms.get("warningCount")),
+                    "bms_faultCount": _to_float(bms.get("faultCount")),
+                    "pcs_setpointKw": _to_float(pcs.get("setpointKw")),
+                    "pcs_actualKw": _to_float(pcs.get("actualKw")),
+                    "pcs_temperature": _to_float(pcs.get("temperature")),
+                    "pcs_dcVoltageV": _to_float(pcs.get("dcVoltageV")),
+                    "pcs_dcCurrentA": _to_float(pcs.get("dcCurrentA")),
+                    "pcs_efficiencyPct": _to_float(pcs.get("efficiencyPct")),
+                }
+            )
+
+    group_df = pd.DataFrame.from_records(group_records)
+    if group_df.empty:
+        group_df = pd.DataFrame(columns=GROUP_DF_COLUMNS)
+    return group_df
+
+
+def _read_battery_groups_sql(
+    conn: sqlite3.Connection,
+    start_ts: Optional[int],
+    end_ts: Optional[int],
+    compact: bool = False,
+) -> pd.DataFrame:
+    """Columnar decode of battery_groups_snapshots pushed down into SQLite.
+
+    json_each flattens every snapshot to one row per group and a multi-path
+    json_extract returns that group's fields as one small JSON array. All arrays
+    are parsed with a single json.loads call and turned into a float matrix, so
+    no per-group dicts or per-field _to_float calls are made. Rows the Python
+    decoder skips (invalid JSON, non-list payloads, non-object elements,
+    non-integer or boolean ids) are skipped here as well, and bms/pcs sections
+    that are not objects read as missing in both.
+    """
+
+    where = ["g.type = 'object'"]
+    args: List[Any] = []
+    if isinstance(start_ts, int):
+        where.append("b.ts >= ?")
+        args.append(start_ts)
+    if isinstance(end_ts, int):
+        where.append("b.ts <= ?")
+        args.append(end_ts)
+
+    paths_sql = ", ".join(["'$.id'"] + [f"'{path}'" for _col, path in GROUP_VALUE_FIELDS])
+    query = (
+        f"SELECT b.ts, json_extract(g.value, {paths_sql}) "
+        f"FROM battery_groups_snapshots AS b, "
+        f"json_each(CASE WHEN json_valid(b.json) AND json_type(b.json) = 'array' THEN b.json ELSE '[]' END) AS g "
+        f"WHERE {' AND '.join(where)} "
+        f"ORDER BY b.ts ASC, g.key ASC"
+    )
+    rows = conn.execute(query, args).fetchall()
+
+    values = json.loads("[" + ",".join(r[1] for r in rows) + "]")
+    keep = np.fromiter((type(v[0]) is int for v in values), dtype=bool, count=len(values))
+    if not keep.any():
+        return pd.DataFrame(columns=GROUP_DF_COLUMNS)
+    if not keep.all():
+        values = [v for v, k in zip(values, keep) if k]
+
+    ts = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))[keep]
+    gids = np.fromiter((v[0] for v in values), dtype=np.int64, count=len(values))
+    try:
+        # Fast path: every field is a number, numeric string, bool or null.
+        mat = np.array(values, dtype=float)[:, 1:]
+    except (TypeError, ValueError):
+        mat = np.array([[_to_float(x) for x in v[1:]] for v in values], dtype=float)
+    mat[~np.isfinite(mat)] = np.nan
+
+    value_dtype = np.float32 if compact else np.float64
+    data: Dict[str, np.ndarray] = {"ts": ts, "groupId": gids.astype(np.int32) if compact else gids}
+    for i, (col, _path) in enumerate(GROUP_VALUE_FIELDS):
+        data[col] = np.ascontiguousarray(mat[:, i], dtype=value_dtype)
+    return pd.DataFrame(data, columns=GROUP_DF_COLUMNS)
+
+
+def read_group_ring(
+    conn: sqlite3.Connection,
+    ring_path: str,
+    start_ts: Optional[int],
+    end_ts: Optional[int],
+    compact: bool = False,
+) -> Optional[pd.DataFrame]:
+    """group_df rows for [start_ts, end_ts] from an ingest_sink.py ring file.
+
+    The window is clipped to the ts range battery_groups_snapshots has (two
+    index lookups), so the frame equals what _read_battery_groups_sql would
+    return. None when the ring is missing or cold, i.e. not covering that
+    whole range yet, or when its snapshot ts differ from the table's in that
+    range (a snapshot the sink never got); load_data then reads SQLite.
+    """
+
+    ring = GroupRing.open(ring_path)
+    if ring is None or ring.n_values != len(GROUP_VALUE_FIELDS):
+        return None
+    lo, hi = conn.execute(
+        "SELECT (SELECT MIN(ts) FROM battery_groups_snapshots), (SELECT MAX(ts) FROM battery_groups_snapshots)"
+    ).fetchone()
+    if hi is None:
+        return None
+    want_start = max(lo, start_ts) if isinstance(start_ts, int) else lo
+    want_end = min(hi, end_ts) if isinstance(end_ts, int) else hi
+    if want_start > want_end:
+        return None
+    window = ring.window(want_start, want_end)
+    if window is None:
+        return None
+    ts, gids, mat, snapshot_ts = window
+    # Count and ts sum over the unique ts index; the offset keeps the sum small.
+    n_db, ts_sum_db = conn.execute(
+        "SELECT COUNT(*), SUM(ts - ?) FROM battery_groups_snapshots WHERE ts >= ? AND ts <= ?",
+        (want_start, want_start, want_end),
+    ).fetchone()
+    if n_db != len(snapshot_ts) or (ts_sum_db or 0) != int((snapshot_ts - want_start).sum()):
+        return None
+    if len(ts) == 0:
+        # Only empty snapshots in the window; same frame as the SQL path.
+        return pd.DataFrame(columns=GROUP_DF_COLUMNS)
+    value_dtype = np.float32 if compact else np.float64
+    data: Dict[str, np.ndarray] = {"ts": ts, "groupId": gids.astype(np.int32) if compact else gids}
+    for i, (col, _path) in enumerate(GROUP_VALUE_FIELDS):
+        data[col] = np.ascontiguousarray(mat[:, i], dtype=value_dtype)
+    return pd.DataFrame(data, columns=GROUP_DF_COLUMNS)
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """float64 columns to float32 and groupId to int32; ts stays int64."""
+
+    dtypes: Dict[str, Any] = {c: np.float32 for c in df.columns if df[c].dtype == np.float64}
+    if "groupId" in df.columns and df["groupId"].dtype != np.int32 and pd.api.types.is_integer_dtype(df["groupId"]):
+        dtypes["groupId"] = np.int32
+    return df.astype(dtypes, copy=False) if dtypes else df
+
+
+STATION_BASE_COLS: List[str] = [
+    "stationTargetPowerKw",
+    "systemSOC",
+    "systemSOH",
+    "averageVoltage",
+    "totalCurrent",
+    "averageTemperature",
+    "load",
+    "totalPower",
+    "totalAlarms",
+    "criticalAlarms",
+    "warningAlarms",
+    "infoAlarms",
+    "groupSocAvg",
+    "groupTempMax",
+    "groupInsuMin",
+    "groupDeltaMax",
+    "groupPcsActualKwSum",
+]
+
+
+def _station_base_frame(station_df: pd.DataFrame, group_df: pd.DataFrame) -> pd.DataFrame:
+    # Station rows sorted by ts, joined with the per-ts group aggregates, with
+    # STATION_BASE_COLS forward/back filled.
     df = station_df.copy()
     df = df.sort_values("ts").reset_index(drop=True)
-    df["dt"] = pd.to_datetime(df["ts"], unit="ms")
-    df = df.set_index("dt")
 
     agg = (
         group_df.groupby("ts")
@@ -197,52 +619,246 @@ def build_station_features(station_df: pd.DataFrame, group_df: pd.DataFrame) ->
         )
         .reset_index()
     )
-    df = df.reset_index().merge(agg, on="ts", how="left").sort_values("ts")
-    df["dt"] = pd.to_datetime(df["ts"], unit="ms")
-    df = df.set_index("dt")
+    df = df.merge(agg, on="ts", how="left").sort_values("ts")
 
-    base_cols = [
-        "stationTargetPowerKw",
-        "systemSOC",
-        "systemSOH",
-        "averageVoltage",
-        "totalCurrent",
-        "averageTemperature",
-        "load",
-        "totalPower",
-        "totalAlarms",
-        "criticalAlarms",
-        "warningAlarms",
-        "infoAlarms",
-        "groupSocAvg",
-        "groupTempMax",
-        "groupInsuMin",
-        "groupDeltaMax",
-        "groupPcsActualKwSum",
-    ]
-
-    for c in base_cols:
+    for c in STATION_BASE_COLS:
         if c not in df.columns:
             df[c] = np.nan
 
-    df[base_cols] = df[base_cols].ffill().bfill()
+    df[STATION_BASE_COLS] = df[STATION_BASE_COLS].ffill().bfill()
+    return df
+
+
+# Features derived from every rolling base column, in column order.
+ROLLING_FEATURE_KINDS: List[str] = ["diff1", "mean60s", "std60s", "mean5m", "std5m"]
+
+_PANDAS_ROLLING: Dict[str, Callable[[pd.Series], pd.Series]] = {
+    "diff1": lambda s: s.diff(),
+    "mean60s": lambda s: s.rolling("60s").mean(),
+    "std60s": lambda s: s.rolling("60s").std(),
+    "mean5m": lambda s: s.rolling("5min").mean(),
+    "std5m": lambda s: s.rolling("5min").std(),
+}
 
-    feature_cols: List[str] = []
-    for c in base_cols:
-        df[f"{c}_diff1"] = df[c].diff()
-        df[f"{c}_mean60s"] = df[c].rolling("60s").mean()
-        df[f"{c}_std60s"] = df[c].rolling("60s").std()
-        df[f"{c}_mean5m"] = df[c].rolling("5min").mean()
-        df[f"{c}_std5m"] = df[c].rolling("5min").std()
-        feature_cols.extend([f"{c}_diff1", f"{c}_mean60s", f"{c}_std60s", f"{c}_mean5m", f"{c}_std5m"])
+
+def rolling_feature_plan(base_cols: List[str], wanted: Optional[List[str]]) -> Tuple[List[str], List[str]]:
+    """(base columns to roll, feature names) for the wanted features; all of them when wanted is None."""
+
+    names = [f"{c}_{kind}" for c in base_cols for kind in ROLLING_FEATURE_KINDS]
+    if wanted is None:
+        return list(base_cols), names
+    keep = set(wanted)
+    names = [n for n in names if n in keep]
+    cols = [c for c in base_cols if any(f"{c}_{kind}" in keep for kind in ROLLING_FEATURE_KINDS)]
+    return cols, names
+
+
+def build_station_features(
+    station_df: pd.DataFrame,
+    group_df: pd.DataFrame,
+    compact: bool = False,
+    feature_cols: Optional[List[str]] = None,
+) -> Tuple[pd.DataFrame, List[str]]:
+    """Station rows with the base columns and rolling features, sorted by ts.
+
+    feature_cols limits the rolling features to those names (e.g. a model's
+    station_feature_cols); the base columns are always kept.
+    """
+
+    df = _station_base_frame(station_df, group_df)
+    df["dt"] = pd.to_datetime(df["ts"], unit="ms")
+    df = df.set_index("dt")
+    _cols, names = rolling_feature_plan(STATION_BASE_COLS, feature_cols)
+
+    feature_cols = []
+    with stage("rolling") as rec:
+        rec["rows"] = int(len(df))
+        for name in names:
+            c, kind = name.rsplit("_", 1)
+            df[name] = _PANDAS_ROLLING[kind](df[c])
+            feature_cols.append(name)
 
     out = df.reset_index(drop=True)
     out = out.sort_values("ts").reset_index(drop=True)
+    if compact:
+        out = compact_frame(out)
     feature_cols = [c for c in feature_cols if c in out.columns]
     return out, feature_cols
 
 
-def build_group_features(station_features_df: pd.DataFrame, group_df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+GROUP_ROLLING_COLS: List[str] = [
+    "bms_socPct",
+    "bms_temperatureC",
+    "bms_insulationResistanceKohm",
+    "bms_deltaCellVoltageMv",
+    "bms_maxCellTempC",
+    "pcs_actualKw",
+    "pcs_setpointKw",
+    "stationTargetPowerKw",
+    "systemSOC",
+    "load",
+    "groupInsuMin",
+    "groupDeltaMax",
+    "groupTempMax",
+    "groupSocAvg",
+]
+
+# (feature suffix, time window in ms) for the rolling mean/std features
+ROLLING_WINDOWS_MS: List[Tuple[str, int]] = [("60s", 60_000), ("5m", 5 * 60_000)]
+
+
+def _block_scans(
+    x: np.ndarray, block_code: np.ndarray, block_first: np.ndarray, block_last: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Inclusive prefix and suffix sums of x's rows within each block of
+    # consecutive rows. Every sum only adds rows of its own block: the scan
+    # steps through positions in the block, all blocks at once.
+    n = len(x)
+    rows = np.arange(n)
+    prefix = x.copy()
+    suffix = x.copy()
+    for pos, out, step in ((rows - block_first[block_code], prefix, -1), (block_last[block_code] - rows, suffix, 1)):
+        order = np.argsort(pos, kind="stable")
+        bounds = np.searchsorted(pos[order], np.arange(int(pos.max()) + 2))
+        for j in range(1, len(bounds) - 1):
+            idx = order[bounds[j] : bounds[j + 1]]
+            out[idx] += out[idx + step]
+    return prefix, suffix
+
+
+def _rolling_features_numpy(
+    group_ids: np.ndarray,
+    ts: np.ndarray,
+    values: np.ndarray,
+    cols: List[str],
+    out_dtype: Any = np.float64,
+) -> Dict[str, np.ndarray]:
+    """diff1 and time-window mean/std for every column and group in one pass.
+
+    Rows must be sorted by (groupId, ts). Windows are (t - w, t] like pandas'
+    rolling("60s"/"5min") and never cross a group boundary: window starts come
+    from one searchsorted on a (group, ts) composite key. Each group's time
+    axis is cut into blocks [k*w, (k+1)*w), so the window of a row in block k
+    is the head of block k up to the row plus a tail of block k - 1. Counts,
+    sums and sums of squares of both parts come from scans that stay inside a
+    block, over values centred on the block's first finite value, and the two
+    parts are merged with the pairwise variance update. No sum is a difference
+    of long-running totals. As in pandas, a window whose finite values are all
+    equal has std exactly 0. Sums are always accumulated in float64; out_dtype
+    only applies to the returned columns. Returns the columns in the same
+    order as the pandas engine.
+    """
+
+    n, k = values.shape
+    rows = np.arange(n)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = group_ids[1:] != group_ids[:-1]
+    group_code = np.cumsum(new_group) - 1
+    group_first = np.flatnonzero(new_group)[group_code]
+
+    finite = np.isfinite(values)
+    c0 = np.zeros((n + 1, k), dtype=np.int64)
+    np.cumsum(finite, axis=0, out=c0[1:])
+
+    # Start count (finite values before it) of the run of equal finite values
+    # that holds the last finite value at or before each row.
+    last_finite = np.maximum.accumulate(np.where(finite, rows[:, None], -1), axis=0)
+    prev_finite = np.full((n, k), -1)
+    prev_finite[1:] = last_finite[:-1]
+    prev_ok = prev_finite >= group_first[:, None]
+    prev_val = values[np.maximum(prev_finite, 0), np.arange(k)]
+    run_start = finite & ~(prev_ok & (prev_val == values))
+    run_from = np.maximum.accumulate(np.where(run_start, c0[:-1], -1), axis=0)
+
+    ts_rel = ts - ts.min()
+    span = int(ts_rel.max()) + max(w for _s, w in ROLLING_WINDOWS_MS) + 1
+    key = group_code.astype(np.int64) * span + ts_rel
+    end = rows + 1
+
+    diff = np.full(values.shape, np.nan)
+    diff[1:] = values[1:] - values[:-1]
+    diff[new_group] = np.nan
+
+    stats: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for suffix, w_ms in ROLLING_WINDOWS_MS:
+        start = np.searchsorted(key, key - w_ms, side="right")
+        cnt = (c0[end] - c0[start]).astype(float)
+
+        block_key = group_code.astype(np.int64) * (span // w_ms + 1) + ts_rel // w_ms
+        new_block = np.ones(n, dtype=bool)
+        new_block[1:] = block_key[1:] != block_key[:-1]
+        block_code = np.cumsum(new_block) - 1
+        block_first = np.flatnonzero(new_block)
+        block_last = np.append(block_first[1:], n) - 1
+        first_idx = np.minimum.reduceat(np.where(finite, rows[:, None], n), block_first, axis=0)
+        ref = np.where(first_idx < n, values[np.minimum(first_idx, n - 1), np.arange(k)], 0.0)
+        centred = np.where(finite, values - ref[block_code], 0.0)
+        prefix, tail = _block_scans(
+            np.hstack([finite.astype(float), centred, centred * centred]), block_code, block_first, block_last
+        )
+
+        # Head: block of the row, from its first row. Tail: the rest of the
+        # window, a suffix of the previous block (empty when start is in the
+        # row's block).
+        has_tail = (start < block_first[block_code])[:, None]
+        t_rows = np.minimum(start, n - 1)
+        tail = np.where(has_tail, tail[t_rows], 0.0)
+        n_a, s1_a, s2_a = prefix[:, :k], prefix[:, k : 2 * k], prefix[:, 2 * k :]
+        n_b, s1_b, s2_b = tail[:, :k], tail[:, k : 2 * k], tail[:, 2 * k :]
+        ref_a = ref[block_code]
+        ref_b = ref[block_code[t_rows]]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_a = np.where(n_a > 0, s1_a / n_a, 0.0)
+            mean_b = np.where(n_b > 0, s1_b / n_b, 0.0)
+            m2 = (s2_a - s1_a * mean_a) + (s2_b - s1_b * mean_b)
+            m2 = m2 + np.where((n_a > 0) & (n_b > 0), (ref_b - ref_a + mean_b - mean_a) ** 2 * n_a * n_b / cnt, 0.0)
+            var = np.maximum(m2, 0.0) / (cnt - 1)
+            mean = ref_a + (s1_a + s1_b + n_b * (ref_b - ref_a)) / cnt
+        constant = run_from[rows] <= c0[start]
+        var = np.where(constant, 0.0, var)
+        mean = np.where(cnt >= 1, mean, np.nan)
+        std = np.where(cnt >= 2, np.sqrt(var), np.nan)
+        stats[suffix] = (mean, std)
+
+    out: Dict[str, np.ndarray] = {}
+    for j, c in enumerate(cols):
+        out[f"{c}_diff1"] = diff[:, j].astype(out_dtype)
+        for suffix, _w in ROLLING_WINDOWS_MS:
+            out[f"{c}_mean{suffix}"] = stats[suffix][0][:, j].astype(out_dtype)
+            out[f"{c}_std{suffix}"] = stats[suffix][1][:, j].astype(out_dtype)
+    return out
+
+
+GROUP_BASE_COLS: List[str] = [
+    "groupId",
+    "bms_socPct",
+    "bms_temperatureC",
+    "bms_insulationResistanceKohm",
+    "bms_deltaCellVoltageMv",
+    "bms_maxCellTempC",
+    "bms_warningCount",
+    "bms_faultCount",
+    "pcs_setpointKw",
+    "pcs_actualKw",
+    "pcs_temperature",
+    "pcs_dcVoltageV",
+    "pcs_dcCurrentA",
+    "pcs_efficiencyPct",
+    "stationTargetPowerKw",
+    "systemSOC",
+    "systemSOH",
+    "load",
+    "totalPower",
+    "groupInsuMin",
+    "groupDeltaMax",
+    "groupTempMax",
+    "groupSocAvg",
+]
+
+
+def _group_base_frame(station_features_df: pd.DataFrame, group_df: pd.DataFrame) -> pd.DataFrame:
+    # Group rows sorted by (groupId, ts), joined with the station base columns
+    # at the same ts, with GROUP_BASE_COLS forward filled per group.
     df = group_df.copy()
     df = df.sort_values(["groupId", "ts"]).reset_index(drop=True)
     df = df.merge(
@@ -251,69 +867,172 @@ def build_group_features(station_features_df: pd.DataFrame, group_df: pd.DataFra
         how="left",
     )
 
-    df["dt"] = pd.to_datetime(df["ts"], unit="ms")
-    df = df.set_index("dt")
-
-    base_cols = [
-        "groupId",
-        "bms_socPct",
-        "bms_temperatureC",
-        "bms_insulationResistanceKohm",
-        "bms_deltaCellVoltageMv",
-        "bms_maxCellTempC",
-        "bms_warningCount",
-        "bms_faultCount",
-        "pcs_setpointKw",
-        "pcs_actualKw",
-        "pcs_temperature",
-        "pcs_dcVoltageV",
-        "pcs_dcCurrentA",
-        "pcs_efficiencyPct",
-        "stationTargetPowerKw",
-        "systemSOC",
-        "systemSOH",
-        "load",
-        "totalPower",
-        "groupInsuMin",
-        "groupDeltaMax",
-        "groupTempMax",
-        "groupSocAvg",
-    ]
-
-    for c in base_cols:
+    for c in GROUP_BASE_COLS:
         if c not in df.columns:
             df[c] = np.nan
 
-    df[base_cols] = df.groupby("groupId")[base_cols].ffill().bfill()
+    with stage("fill") as rec:
+        rec["rows"] = int(len(df))
+        df[GROUP_BASE_COLS] = df.groupby("groupId")[GROUP_BASE_COLS].ffill().bfill()
+    return df
+
+
+def _add_group_rolling(g: pd.DataFrame, names: List[str]) -> List[str]:
+    # Rolling features named like rolling_feature_plan's, added to g (one
+    # group, DatetimeIndex in ts order); returns the new column names.
+    for name in names:
+        c, kind = name.rsplit("_", 1)
+        g[name] = _PANDAS_ROLLING[kind](g[c])
+    return list(names)
+
+
+def _group_rolling_worker(
+    task: Tuple[str, str, int, List[str], List[str], List[str], List[Tuple[int, int]]]
+) -> int:
+    in_name, out_name, n, cols, dtypes, names, row_ranges = task
+    k = len(cols)
+    # Attach only; the parent unlinks both blocks.
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        ts = np.ndarray((n,), dtype=np.int64, buffer=shm_in.buf)
+        values = np.ndarray((n, k), dtype=np.float64, buffer=shm_in.buf, offset=8 * n)
+        out = np.ndarray((n, len(names)), dtype=np.float64, buffer=shm_out.buf)
+        for a, b in row_ranges:
+            # Rows of a group are already in ts order (the base frame is
+            # sorted by (groupId, ts)), so no sort_index() here.
+            g = pd.DataFrame(
+                {c: values[a:b, j].astype(dtypes[j]) for j, c in enumerate(cols)},
+                index=pd.to_datetime(ts[a:b], unit="ms"),
+            )
+            _add_group_rolling(g, names)
+            out[a:b] = g[names].to_numpy(dtype=np.float64)
+        del ts, values, out
+    finally:
+        shm_in.close()
+        shm_out.close()
+    return sum(b - a for a, b in row_ranges)
+
 
-    feature_cols: List[str] = ["groupId"]
+def _group_rolling_parallel(
+    df: pd.DataFrame, cols: List[str], names: List[str], workers: int
+) -> Tuple[pd.DataFrame, List[str]]:
+    """The pandas engine's per-group rolling features, split by group over a process pool.
+
+    df is the base frame sorted by (groupId, ts) with a RangeIndex; cols and
+    names come from rolling_feature_plan. ts and the rolling columns go to the
+    workers in one shared-memory block and each worker writes its groups' rows
+    of a shared float64 result, so the rows come back in df order. Values are
+    identical to the serial loop.
+    """
+
+    n, k = len(df), len(cols)
+    gids = df["groupId"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, gids[1:] != gids[:-1]])
+    ends = np.r_[starts[1:], n]
+    # Contiguous runs of whole groups with about n / workers rows each.
+    chunk_of = np.minimum((starts * workers) // n, workers - 1)
+    chunks = [
+        [(int(a), int(b)) for a, b in zip(starts[chunk_of == i], ends[chunk_of == i])] for i in range(workers)
+    ]
+    chunks = [c for c in chunks if c]
+    dtypes = [str(df[c].dtype) for c in cols]
+
+    shm_in = shared_memory.SharedMemory(create=True, size=max(1, 8 * n * (k + 1)))
+    shm_out = shared_memory.SharedMemory(create=True, size=max(1, 8 * n * len(names)))
+    try:
+        ts = np.ndarray((n,), dtype=np.int64, buffer=shm_in.buf)
+        ts[:] = df["ts"].to_numpy(dtype=np.int64)
+        values = np.ndarray((n, k), dtype=np.float64, buffer=shm_in.buf, offset=8 * n)
+        values[:] = df[cols].to_numpy(dtype=np.float64)
+        tasks = [(shm_in.name, shm_out.name, n, cols, dtypes, names, c) for c in chunks]
+        with ProcessPoolExecutor(max_workers=len(tasks)) as ex:
+            done = sum(ex.map(_group_rolling_worker, tasks))
+        if done != n:
+            raise RuntimeError(f"rolling workers returned {done} of {n} rows")
+        result = np.array(np.ndarray((n, len(names)), dtype=np.float64, buffer=shm_out.buf))
+        del ts, values
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+
+    feats: Dict[str, np.ndarray] = {}
+    for i, name in enumerate(names):
+        c, kind = name.rsplit("_", 1)
+        # diff() keeps a float32 column float32; rolling stats are float64.
+        diff_dtype = pd.Series(np.zeros(2, dtype=df[c].dtype)).diff().dtype
+        feats[name] = result[:, i].astype(diff_dtype) if kind == "diff1" else result[:, i]
+    out = pd.concat([df, pd.DataFrame(feats, index=df.index)], axis=1)
+    return out, list(names)
+
+
+def build_group_features(
+    station_features_df: pd.DataFrame,
+    group_df: pd.DataFrame,
+    engine: str = "pandas",
+    compact: bool = False,
+    workers: int = 1,
+    feature_cols: Optional[List[str]] = None,
+) -> Tuple[pd.DataFrame, List[str]]:
+    """Group rows with the base columns and rolling features, sorted by (groupId, ts).
+
+    workers > 1 splits the pandas engine's per-group rolling features over
+    that many processes with identical results; the NumPy engine is already
+    vectorized across groups and ignores it. feature_cols limits the rolling
+    features to those names (e.g. a model's group_feature_cols); the NumPy
+    engine still rolls every statistic of a column it needs and drops the rest.
+    """
+
+    df = _group_base_frame(station_features_df, group_df)
+    df["dt"] = pd.to_datetime(df["ts"], unit="ms")
+    df = df.set_index("dt")
+    cols, names = rolling_feature_plan(GROUP_ROLLING_COLS, feature_cols)
+
+    wanted_id = feature_cols is None or "groupId" in feature_cols
+    feature_cols = ["groupId"] if wanted_id else []
+
+    if engine == "numpy" and not df.empty:
+        out = df.reset_index(drop=True)
+        with stage("rolling") as rec:
+            rec["rows"] = int(len(out))
+            feats = (
+                _rolling_features_numpy(
+                    out["groupId"].to_numpy(),
+                    out["ts"].to_numpy(dtype=np.int64),
+                    out[cols].to_numpy(dtype=float),
+                    cols,
+                    out_dtype=np.float32 if compact else np.float64,
+                )
+                if cols
+                else {}
+            )
+        out = pd.concat([out, pd.DataFrame({name: feats[name] for name in names}, index=out.index)], axis=1)
+        if compact:
+            out = compact_frame(out)
+        feature_cols.extend(names)
+        return out, feature_cols
+
+    if workers > 1 and df["groupId"].nunique() > 1 and names:
+        with stage("rolling") as rec:
+            rec["rows"] = int(len(df))
+            rec["workers"] = int(workers)
+            out, names = _group_rolling_parallel(df.reset_index(drop=True), cols, names, workers)
+        if compact:
+            out = compact_frame(out)
+        feature_cols.extend(names)
+        out = out.sort_values(["groupId", "ts"]).reset_index(drop=True)
+        return out, feature_cols
 
     ts_groups = []
-    for gid, g in df.groupby("groupId", sort=False):
-        g = g.sort_index()
-        for c in [
-            "bms_socPct",
-            "bms_temperatureC",
-            "bms_insulationResistanceKohm",
-            "bms_deltaCellVoltageMv",
-            "bms_maxCellTempC",
-            "pcs_actualKw",
-            "pcs_setpointKw",
-            "stationTargetPowerKw",
-            "systemSOC",
-            "load",
-            "groupInsuMin",
-            "groupDeltaMax",
-            "groupTempMax",
-            "groupSocAvg",
-        ]:
-            g[f"{c}_diff1"] = g[c].diff()
-            g[f"{c}_mean60s"] = g[c].rolling("60s").mean()
-            g[f"{c}_std60s"] = g[c].rolling("60s").std()
-            g[f"{c}_mean5m"] = g[c].rolling("5min").mean()
-            g[f"{c}_std5m"] = g[c].rolling("5min").std()
-            feature_cols.extend([f"{c}_diff1", f"{c}_mean60s", f"{c}_std60s", f"{c}_mean5m", f"{c}_std5m"])
-        ts_groups.append(g)
+    with stage("rolling") as rec:
+        rec["rows"] = int(len(df))
+        for gid, g in df.groupby("groupId", sort=False):
+            g = g.sort_index()
+            feature_cols.extend(_add_group_rolling(g, names))
+            # Downcast group by group so the float64 copy never exists for all groups at once.
+            ts_groups.append(compact_frame(g) if compact else g)
 
     if ts_groups:
         out = pd.concat(ts_groups, axis=0)
@@ -325,166 +1044,114 @@ def build_group_features(station_features_df: pd.DataFrame, group_df: pd.DataFra
     return out, feature_cols
 
 
-def add_future_targets_by_horizon(
+def add_station_targets_by_horizon(
     df: pd.DataFrame,
     horizons_ms: Dict[str, int],
     target_cols: List[str],
 ) -> pd.DataFrame:
-    out = df.copy()
-    out = out.sort_values(["groupId", "ts"]).reset_index(drop=True)
-
+    out = df.copy().sort_values("ts").reset_index(drop=True)
+    ts = out["ts"].to_numpy(dtype=np.int64)
     for h_key, h_ms in horizons_ms.items():
+        idx = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
+        valid = idx < len(ts)
         for col in target_cols:
-            out[f"y_{col}_{h_key}"] = np.nan
-
-        for gid, g in out.groupby("groupId", sort=False):
-            ts = g["ts"].to_numpy(dtype=np.int64)
-            idx = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
-            valid = idx < len(ts)
-            for col in target_cols:
-                vals = g[col].to_numpy(dtype=float)
-                y = np.full(len(ts), np.nan)
-                y[valid] = vals[idx[valid]]
-                out.loc[g.index, f"y_{col}_{h_key}"] = y
-
-    return out
-
-
-def merge_risk_labels_from_future_counts(
-    df: pd.DataFrame,
-    horizons_ms: Dict[str, int],
-) -> pd.DataFrame:
-    """Merge risk labels derived from future BMS counters.
-
-    This is a robust fallback when alarm_occurrences is sparse.
-    - warning: future bms_warningCount > 0
-    - fault: future bms_faultCount > 0
-
-    The result is merged into existing y_warning_{h} / y_fault_{h} columns if present.
-    """
-
-    out = df.copy()
-    out = out.sort_values(["groupId", "ts"]).reset_index(drop=True)
-
-    for h_key, _h_ms in horizons_ms.items():
-        if f"y_warning_{h_key}" not in out.columns:
-            out[f"y_warning_{h_key}"] = 0
-        if f"y_fault_{h_key}" not in out.columns:
-            out[f"y_fault_{h_key}"] = 0
-
-    for gid, g in out.groupby("groupId", sort=False):
-        ts = g["ts"].to_numpy(dtype=np.int64)
-        idx = {}
-        for h_key, h_ms in horizons_ms.items():
-            idx[h_key] = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
-
-        warn_cnt = g.get("bms_warningCount")
-        fault_cnt = g.get("bms_faultCount")
-
-        warn_vals = warn_cnt.to_numpy(dtype=float) if warn_cnt is not None else np.full(len(ts), np.nan)
-        fault_vals = (
-            fault_cnt.to_numpy(dtype=float) if fault_cnt is not None else np.full(len(ts), np.nan)
-        )
-
-        for h_key in horizons_ms.keys():
-            j = idx[h_key]
-            valid = j < len(ts)
-
-            y_warn = np.zeros(len(ts), dtype=np.int32)
-            y_fault = np.zeros(len(ts), dtype=np.int32)
-
-            if valid.any():
-                fut_warn = warn_vals[j[valid]]
-                fut_fault = fault_vals[j[valid]]
-                y_warn[valid] = (np.nan_to_num(fut_warn, nan=0.0) > 0).astype(np.int32)
-                y_fault[valid] = (np.nan_to_num(fut_fault, nan=0.0) > 0).astype(np.int32)
-
-            out.loc[g.index, f"y_warning_{h_key}"] = np.maximum(
-                out.loc[g.index, f"y_warning_{h_key}"].to_numpy(dtype=np.int32),
-                y_warn,
-            )
-            out.loc[g.index, f"y_fault_{h_key}"] = np.maximum(
-                out.loc[g.index, f"y_fault_{h_key}"].to_numpy(dtype=np.int32),
-                y_fault,
-            )
-
+            y = np.full(len(out), np.nan)
+            vals = out[col].to_numpy(dtype=float)
+            y[valid] = vals[idx[valid]]
+            out[f"y_{col}_{h_key}"] = y
     return out
 
 
-def add_warning_labels_by_horizon(
-    df: pd.DataFrame,
-    alarm_occurrences: pd.DataFrame,
-    horizons_ms: Dict[str, int],
-) -> pd.DataFrame:
-    out = df.copy()
-    occ = alarm_occurrences.copy()
-    if not occ.empty:
-        occ = occ[(occ["groupId"].notna())]
-        occ["groupId"] = occ["groupId"].astype(int)
-        occ["ts"] = occ["ts"].astype(int)
+def _alarm_event_masks(occ: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, np.ndarray]]:
+    occ = occ[occ["groupId"].notna()]
+    is_fault = (occ["level"].isin(["critical"])) | (occ["type"].astype(str) == "锁存")
+    is_warning = occ["level"].isin(["warning"])
+    return occ, {"fault": is_fault.to_numpy(), "warning": is_warning.to_numpy()}
 
-    event_ts_by_group: Dict[int, np.ndarray] = {}
-    if not occ.empty:
-        is_warning = occ["level"].isin(["warning"])
-        warn_occ = occ[is_warning]
-        for gid, g in warn_occ.groupby("groupId"):
-            arr = np.sort(g["ts"].to_numpy(dtype=np.int64))
-            event_ts_by_group[int(gid)] = arr
-
-    for h_key, _h_ms in horizons_ms.items():
-        out[f"y_warning_{h_key}"] = 0
-
-    for gid, g in out.groupby("groupId", sort=False):
-        ts = g["ts"].to_numpy(dtype=np.int64)
-        events = event_ts_by_group.get(int(gid), np.array([], dtype=np.int64))
-        if events.size == 0:
-            continue
-        for h_key, h_ms in horizons_ms.items():
-            idx = np.searchsorted(events, ts, side="right")
-            has = np.zeros(len(ts), dtype=np.int32)
-            mask = idx < len(events)
-            has[mask] = (events[idx[mask]] <= (ts[mask] + np.int64(h_ms))).astype(np.int32)
-            out.loc[g.index, f"y_warning_{h_key}"] = has
-
-    return out
 
-
-def add_fault_labels_by_horizon(
+def build_labels(
     df: pd.DataFrame,
     alarm_occurrences: pd.DataFrame,
     horizons_ms: Dict[str, int],
+    target_cols: List[str],
 ) -> pd.DataFrame:
-    out = df.copy()
-    occ = alarm_occurrences.copy()
-    if not occ.empty:
-        occ = occ[(occ["groupId"].notna())]
-        occ["groupId"] = occ["groupId"].astype(int)
-        occ["ts"] = occ["ts"].astype(int)
+    """All group labels in one pass; same values and columns as running
+    add_future_targets_by_horizon, add_fault_labels_by_horizon,
+    add_warning_labels_by_horizon and merge_risk_labels_from_future_counts
+    (label_reference.py).
+
+    Rows are keyed by (groupId, ts) as group_code * span + ts, with span larger
+    than any ts offset plus horizon, so one searchsorted per horizon finds the
+    future row of every group and never lands in the next group. Alarm events
+    use the same key. Labels go into preallocated arrays joined to the frame
+    once at the end.
+    """
 
-    event_ts_by_group: Dict[int, np.ndarray] = {}
+    gid = df["groupId"].to_numpy(dtype=np.int64)
+    ts = df["ts"].to_numpy(dtype=np.int64)
+    order = np.lexsort((ts, gid))
+    if not np.array_equal(order, np.arange(len(order))):
+        df = df.iloc[order]
+        gid, ts = gid[order], ts[order]
+    out = df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)
+    n = len(out)
+
+    occ = alarm_occurrences
+    masks: Dict[str, np.ndarray] = {}
     if not occ.empty:
-        is_fault = (occ["level"].isin(["critical"])) | (occ["type"].astype(str) == "锁存")
-        fault_occ = occ[is_fault]
-        for gid, g in fault_occ.groupby("groupId"):
-            arr = np.sort(g["ts"].to_numpy(dtype=np.int64))
-            event_ts_by_group[int(gid)] = arr
-
+        occ, masks = _alarm_event_masks(occ)
+    ev_gid = occ["groupId"].to_numpy(dtype=np.int64) if not occ.empty else np.zeros(0, dtype=np.int64)
+    ev_ts = occ["ts"].to_numpy(dtype=np.int64) if not occ.empty else np.zeros(0, dtype=np.int64)
+
+    group_ids, group_code = np.unique(gid, return_inverse=True)
+    ts0 = min(int(ts.min()) if n else 0, int(ev_ts.min()) if len(ev_ts) else 0)
+    ts_max = max(int(ts.max()) if n else 0, int(ev_ts.max()) if len(ev_ts) else 0)
+    max_h = max(horizons_ms.values()) if horizons_ms else 0
+    span = ts_max - ts0 + max_h + 1
+    key = group_code.astype(np.int64) * span + (ts - ts0)
+
+    # Events of groups without rows can never match.
+    ev_pos = np.searchsorted(group_ids, ev_gid)
+    ev_known = ev_pos < len(group_ids)
+    ev_known[ev_known] = group_ids[ev_pos[ev_known]] == ev_gid[ev_known]
+    ev_key = ev_pos.astype(np.int64) * span + (ev_ts - ts0)
+    events: Dict[str, np.ndarray] = {
+        kind: np.sort(ev_key[ev_known & masks[kind]]) if masks else np.zeros(0, dtype=np.int64)
+        for kind in ("fault", "warning")
+    }
+
+    warn_counts = out["bms_warningCount"].to_numpy(dtype=float) if "bms_warningCount" in out.columns else None
+    fault_counts = out["bms_faultCount"].to_numpy(dtype=float) if "bms_faultCount" in out.columns else None
+    target_vals = {col: out[col].to_numpy(dtype=float) for col in target_cols}
+
+    labels: Dict[str, np.ndarray] = {}
+    risk: Dict[str, np.ndarray] = {}
     for h_key, h_ms in horizons_ms.items():
-        out[f"y_fault_{h_key}"] = 0
-
-    for gid, g in out.groupby("groupId", sort=False):
-        ts = g["ts"].to_numpy(dtype=np.int64)
-        events = event_ts_by_group.get(int(gid), np.array([], dtype=np.int64))
-        if events.size == 0:
-            continue
-        for h_key, h_ms in horizons_ms.items():
-            idx = np.searchsorted(events, ts, side="right")
-            has = np.zeros(len(ts), dtype=np.int32)
-            mask = idx < len(events)
-            has[mask] = (events[idx[mask]] <= (ts[mask] + np.int64(h_ms))).astype(np.int32)
-            out.loc[g.index, f"y_fault_{h_key}"] = has
-
-    return out
+        idx = np.searchsorted(key, key + np.int64(h_ms), side="left")
+        valid = idx < n
+        valid[valid] = group_code[idx[valid]] == group_code[valid]
+        fut = idx[valid]
+        for col in target_cols:
+            y = np.full(n, np.nan)
+            y[valid] = target_vals[col][fut]
+            labels[f"y_{col}_{h_key}"] = y
+        for kind, counts in (("fault", fault_counts), ("warning", warn_counts)):
+            y_risk = np.zeros(n, dtype=np.int32)
+            ev = events[kind]
+            if len(ev):
+                j = np.searchsorted(ev, key, side="right")
+                hit = j < len(ev)
+                hit[hit] = ev[j[hit]] <= key[hit] + np.int64(h_ms)
+                y_risk[hit] = 1
+            if counts is not None:
+                y_risk[valid] |= (np.nan_to_num(counts[fut], nan=0.0) > 0).astype(np.int32)
+            risk[f"y_{kind}_{h_key}"] = y_risk
+
+    for kind in ("fault", "warning"):
+        for h_key in horizons_ms.keys():
+            labels[f"y_{kind}_{h_key}"] = risk[f"y_{kind}_{h_key}"]
+    out = out.drop(columns=[c for c in labels if c in out.columns])
+    return pd.concat([out, pd.DataFrame(labels)], axis=1)
 
 
 def latest_features_for_inference(
@@ -517,3 +1184,153 @@ def latest_features_for_inference(
     group_cols = list(dict.fromkeys(group_cols))
     group_x = g[group_cols].copy()
     return station_x, group_x, latest_ts
+
+
+# History the latest-row feature path needs before the newest ts: the longest
+# rolling window (diff1 additionally needs one sample before it).
+LATEST_LOOKBACK_MS = max(w for _s, w in ROLLING_WINDOWS_MS)
+
+_LATEST_TABLES = (
+    "telemetry",
+    "system_status",
+    "alarm_snapshots",
+    "coordination_units_snapshots",
+    "battery_groups_snapshots",
+)
+
+
+def latest_window_start(db_path: str, end_ts: Optional[int] = None) -> Optional[int]:
+    """Smallest start_ts for load_data that still gives exact latest-row features.
+
+    That is the last snapshot at or before (newest ts - LOOKBACK), taken over
+    every table load_data reads, so each table keeps its full window plus the
+    previous sample. None when the DB is empty.
+    """
+
+    conn = connect_readonly(db_path)
+    try:
+        end_sql = " WHERE ts <= ?" if isinstance(end_ts, int) else ""
+        end_args: List[Any] = [end_ts] if isinstance(end_ts, int) else []
+        newest = [conn.execute(f"SELECT MAX(ts) FROM {t}{end_sql}", end_args).fetchone()[0] for t in _LATEST_TABLES]
+        newest = [int(v) for v in newest if v is not None]
+        if not newest:
+            return None
+        cutoff = min(newest) - LATEST_LOOKBACK_MS
+        starts = [conn.execute(f"SELECT MAX(ts) FROM {t} WHERE ts <= ?", [cutoff]).fetchone()[0] for t in _LATEST_TABLES]
+    finally:
+        conn.close()
+    return min([int(v) for v in starts if v is not None] + [cutoff])
+
+
+def _point_window_features(
+    codes: np.ndarray,
+    ts: np.ndarray,
+    values: np.ndarray,
+    point_idx: np.ndarray,
+    cols: List[str],
+) -> Dict[str, np.ndarray]:
+    """diff1 and time-window mean/std of every column at one row per code.
+
+    Rows are sorted by (code, ts); point_idx[k] is the row evaluated for code
+    k. Matches the full-series engines at that row: windows are (t - w, t]
+    over the rows of the same code up to the point, NaNs are skipped and std
+    needs two values. Values are centred on the point's own value, so a
+    constant window has a std of exactly 0 like pandas.
+    """
+
+    n_codes = len(point_idx)
+    row = np.arange(len(ts))
+    ref = values[point_idx]
+    t_point = ts[point_idx]
+
+    prev = point_idx - 1
+    has_prev = prev >= 0
+    has_prev[has_prev] = codes[prev[has_prev]] == np.arange(n_codes)[has_prev]
+    diff = np.full(ref.shape, np.nan)
+    diff[has_prev] = ref[has_prev] - values[prev[has_prev]]
+
+    stats: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for suffix, w_ms in ROLLING_WINDOWS_MS:
+        in_window = (ts > t_point[codes] - w_ms) & (row <= point_idx[codes])
+        mean = np.full(ref.shape, np.nan)
+        std = np.full(ref.shape, np.nan)
+        for j in range(values.shape[1]):
+            ok = in_window & np.isfinite(values[:, j])
+            k = codes[ok]
+            centred = values[ok, j] - np.nan_to_num(ref[k, j])
+            cnt = np.bincount(k, minlength=n_codes)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_c = np.bincount(k, weights=centred, minlength=n_codes) / cnt
+                dev = centred - mean_c[k]
+                var = np.bincount(k, weights=dev * dev, minlength=n_codes) / (cnt - 1)
+            mean[:, j] = np.where(cnt >= 1, mean_c + np.nan_to_num(ref[:, j]), np.nan)
+            std[:, j] = np.where(cnt >= 2, np.sqrt(np.maximum(var, 0.0)), np.nan)
+        stats[suffix] = (mean, std)
+
+    out: Dict[str, np.ndarray] = {}
+    for j, c in enumerate(cols):
+        out[f"{c}_diff1"] = diff[:, j]
+        for suffix, _w in ROLLING_WINDOWS_MS:
+            out[f"{c}_mean{suffix}"] = stats[suffix][0][:, j]
+            out[f"{c}_std{suffix}"] = stats[suffix][1][:, j]
+    return out
+
+
+def latest_features_direct(
+    station_df: pd.DataFrame,
+    group_df: pd.DataFrame,
+    station_feature_cols: Optional[List[str]] = None,
+    group_feature_cols: Optional[List[str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, int]:
+    """Same rows as latest_features_for_inference over the full feature frames,
+    without computing features for any other timestamp.
+
+    Only the latest station row and the latest row of each group are
+    evaluated, so the cost depends on the rows inside LATEST_LOOKBACK_MS, not
+    on how much history is passed in. With frames loaded from
+    latest_window_start() the values equal the full pipeline's as long as the
+    forward fill does not have to reach back past that start (the server
+    writes every column of every snapshot). The station frame also carries
+    the STATION_BASE_COLS of its row. The feature_cols arguments limit the
+    rolling features like in build_station_features/build_group_features.
+    """
+
+    station_roll, station_cols = rolling_feature_plan(STATION_BASE_COLS, station_feature_cols)
+    group_roll, group_cols = rolling_feature_plan(GROUP_ROLLING_COLS, group_feature_cols)
+    group_cols = ["groupId"] + group_cols
+    if station_df.empty:
+        return pd.DataFrame(columns=["ts"] + station_cols), pd.DataFrame(columns=["ts"] + group_cols), 0
+
+    station = _station_base_frame(station_df, group_df).reset_index(drop=True)
+    station_ts = station["ts"].to_numpy(dtype=np.int64)
+    latest_ts = int(station_ts.max())
+
+    group = _group_base_frame(station, group_df) if not group_df.empty else pd.DataFrame(columns=GROUP_BASE_COLS + ["ts"])
+    group_ts = group["ts"].to_numpy(dtype=np.int64)
+    if not (group_ts == latest_ts).any() and len(group_ts):
+        latest_ts = int(group_ts.max())
+
+    # Station row: the last one at or before latest_ts.
+    station_point = int(np.searchsorted(station_ts, latest_ts, side="right")) - 1
+    station_x = station.iloc[[station_point]][["ts"] + STATION_BASE_COLS].reset_index(drop=True)
+    feats = _point_window_features(
+        np.zeros(len(station_ts), dtype=np.int64),
+        station_ts,
+        station[station_roll].to_numpy(dtype=float),
+        np.array([station_point]),
+        station_roll,
+    )
+    station_x = pd.concat([station_x, pd.DataFrame({name: feats[name] for name in station_cols})], axis=1)
+
+    # Group rows: the last row of each group, kept when it is at latest_ts.
+    group = group[group_ts <= latest_ts]
+    group_ts = group["ts"].to_numpy(dtype=np.int64)
+    gids = group["groupId"].to_numpy()
+    group_ids, codes = np.unique(gids, return_inverse=True)
+    point_idx = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True]) if len(codes) else np.zeros(0, dtype=np.int64)
+    feats = _point_window_features(codes, group_ts, group[group_roll].to_numpy(dtype=float), point_idx, group_roll)
+    at_latest = group_ts[point_idx] == latest_ts
+    group_x = pd.DataFrame({"ts": group_ts[point_idx], "groupId": gids[point_idx]})
+    group_x = pd.concat([group_x, pd.DataFrame({name: feats[name] for name in group_cols[1:]})], axis=1)
+    group_x = group_x[at_latest].reset_index(drop=True)
+    return station_x, group_x, latest_ts
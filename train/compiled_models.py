@@ -0,0 +1,404 @@
+"""NumPy-only inference for the models in a train.py artifact.
+
+compile_artifacts() flattens every tree ensemble (HistGradientBoosting
+regressors/classifiers and the multi-output ExtraTrees model) into node arrays
+and write_compiled() stores them in one .npz with a JSON header. load_compiled()
+returns the same artifact dict as joblib.load(model.joblib), with small
+stand-ins that have predict()/predict_proba(), so predict.py can run without
+importing scikit-learn or unpickling anything.
+
+The trees of an ensemble are stored back to back. Leaves point to themselves,
+so evaluation walks every tree for every row at once, one level per step, for
+max_depth steps. Tree outputs are added in scikit-learn's order, so outputs
+are bit-identical to the fitted models.
+"""
+
+import argparse
+import io
+import json
+import math
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from prediction_io import atomic_write_bytes
+
+
+FORMAT_VERSION = 1
+META_KEY = "__meta__"
+# compare_models tolerance: |original - compiled| <= RTOL * max(|original|, 1).
+RTOL = 1e-9
+
+
+class TreeEnsemble:
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        missing_left: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int,
+        float32_inputs: bool,
+    ) -> None:
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left.astype(bool)
+        self.value = value if value.ndim == 2 else value[:, None]
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.float32_inputs = bool(float32_inputs)
+
+    def leaf_values(self, x: np.ndarray) -> np.ndarray:
+        """Leaf value of every tree for every row: [trees, rows, outputs]."""
+
+        x = np.asarray(x, dtype=np.float64)
+        if self.float32_inputs:
+            # scikit-learn's DecisionTree compares float32 copies of X.
+            x = x.astype(np.float32).astype(np.float64)
+        rows = np.arange(len(x))[None, :]
+        node = np.repeat(self.roots[:, None], len(x), axis=1)
+        for _ in range(self.max_depth):
+            xv = x[rows, self.feature[node]]
+            go_left = np.where(np.isnan(xv), self.missing_left[node], xv <= self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node]
+
+    def arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {
+            f"{prefix}.feature": self.feature,
+            f"{prefix}.threshold": self.threshold,
+            f"{prefix}.left": self.left,
+            f"{prefix}.right": self.right,
+            f"{prefix}.missing_left": self.missing_left.astype(np.uint8),
+            f"{prefix}.value": self.value,
+            f"{prefix}.roots": self.roots,
+        }
+
+    @classmethod
+    def from_arrays(cls, data: Any, prefix: str, max_depth: int, float32_inputs: bool) -> "TreeEnsemble":
+        return cls(
+            data[f"{prefix}.feature"],
+            data[f"{prefix}.threshold"],
+            data[f"{prefix}.left"],
+            data[f"{prefix}.right"],
+            data[f"{prefix}.missing_left"],
+            data[f"{prefix}.value"],
+            data[f"{prefix}.roots"],
+            max_depth,
+            float32_inputs,
+        )
+
+
+def _stack_trees(
+    trees: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+    float32_inputs: bool,
+) -> TreeEnsemble:
+    # trees: (feature, threshold, left, right, missing_left, value, is_leaf) per
+    # tree with tree-local child indices; the root is node 0.
+    parts: Dict[str, List[np.ndarray]] = {k: [] for k in ("feature", "threshold", "left", "right", "missing", "value")}
+    roots = []
+    offset = 0
+    max_depth = 0
+    for feature, threshold, left, right, missing_left, value, is_leaf in trees:
+        n = len(feature)
+        own = np.arange(n, dtype=np.int64)
+        left = np.where(is_leaf, own, left).astype(np.int64) + offset
+        right = np.where(is_leaf, own, right).astype(np.int64) + offset
+        depth = np.zeros(n, dtype=np.int64)
+        for i in range(n):
+            if not is_leaf[i]:
+                depth[left[i] - offset] = depth[i] + 1
+                depth[right[i] - offset] = depth[i] + 1
+        max_depth = max(max_depth, int(depth.max()) if n else 0)
+        parts["feature"].append(np.where(is_leaf, 0, feature).astype(np.int32))
+        parts["threshold"].append(threshold.astype(np.float64))
+        parts["left"].append(left)
+        parts["right"].append(right)
+        parts["missing"].append(missing_left.astype(np.uint8))
+        parts["value"].append(value.reshape(n, -1).astype(np.float64))
+        roots.append(offset)
+        offset += n
+    return TreeEnsemble(
+        np.concatenate(parts["feature"]),
+        np.concatenate(parts["threshold"]),
+        np.concatenate(parts["left"]),
+        np.concatenate(parts["right"]),
+        np.concatenate(parts["missing"]),
+        np.concatenate(parts["value"]),
+        np.asarray(roots, dtype=np.int64),
+        max_depth,
+        float32_inputs,
+    )
+
+
+class CompiledHGBRegressor:
+    """HistGradientBoostingRegressor (squared error): baseline plus the sum of tree values."""
+
+    def __init__(self, trees: TreeEnsemble, baseline: float) -> None:
+        self.trees = trees
+        self.baseline = float(baseline)
+
+    def _raw(self, x: np.ndarray) -> np.ndarray:
+        leaves = self.trees.leaf_values(x)[:, :, 0]
+        raw = np.full(leaves.shape[1], self.baseline)
+        for t in range(leaves.shape[0]):
+            raw += leaves[t]
+        return raw
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        return self._raw(x)
+
+
+def _expit(v: float) -> float:
+    try:
+        return 1.0 / (1.0 + math.exp(-v))
+    except OverflowError:
+        # exp(-v) is inf in C as well, where expit gives 0.
+        return 0.0
+
+
+class CompiledHGBClassifier(CompiledHGBRegressor):
+    """Binary HistGradientBoostingClassifier: sigmoid of the raw score."""
+
+    def predict_proba(self, x: np.ndarray) -> np.ndarray:
+        # libm exp like scipy's expit; NumPy's vectorized exp can differ by an ulp.
+        p = np.array([_expit(v) for v in self._raw(x).tolist()], dtype=np.float64)
+        return np.column_stack([1.0 - p, p])
+
+
+class CompiledMultiOutput:
+    """group_models.MultiOutputGroupRegressor: imputed inputs, mean of the trees, rescaled."""
+
+    def __init__(
+        self,
+        trees: TreeEnsemble,
+        outputs: List[Tuple[str, str]],
+        fill: np.ndarray,
+        y_mean: np.ndarray,
+        y_scale: np.ndarray,
+    ) -> None:
+        self.trees = trees
+        self.outputs = [tuple(o) for o in outputs]
+        self.fill_ = fill
+        self.y_mean_ = y_mean
+        self.y_scale_ = y_scale
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        x = np.array(x, dtype=float)
+        nan_rows, nan_cols = np.nonzero(np.isnan(x))
+        x[nan_rows, nan_cols] = self.fill_[nan_cols]
+        leaves = self.trees.leaf_values(x)
+        out = np.zeros(leaves.shape[1:])
+        for t in range(leaves.shape[0]):
+            out += leaves[t]
+        out /= leaves.shape[0]
+        return out * self.y_scale_ + self.y_mean_
+
+
+def _compile_hgb(model: Any) -> Tuple[TreeEnsemble, float]:
+    if getattr(model, "n_trees_per_iteration_", 1) != 1:
+        raise ValueError("only single-output HistGradientBoosting models can be compiled")
+    if model._bin_mapper.is_categorical_ is not None and np.any(model._bin_mapper.is_categorical_):
+        raise ValueError("categorical features are not supported")
+    trees = []
+    for (predictor,) in model._predictors:
+        nodes = predictor.nodes
+        trees.append(
+            (
+                nodes["feature_idx"],
+                nodes["num_threshold"],
+                nodes["left"],
+                nodes["right"],
+                nodes["missing_go_to_left"],
+                nodes["value"],
+                nodes["is_leaf"].astype(bool),
+            )
+        )
+    return _stack_trees(trees, float32_inputs=False), float(np.ravel(model._baseline_prediction)[0])
+
+
+def _compile_forest(forest: Any) -> TreeEnsemble:
+    trees = []
+    for est in forest.estimators_:
+        t = est.tree_
+        missing = getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8))
+        trees.append(
+            (t.feature, t.threshold, t.children_left, t.children_right, missing, t.value, t.children_left < 0)
+        )
+    return _stack_trees(trees, float32_inputs=True)
+
+
+def _compile_model(model: Any) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], Any]:
+    """(header entry, arrays, compiled stand-in) of one model."""
+
+    name = type(model).__name__
+    if name == "HistGradientBoostingRegressor":
+        if model.loss != "squared_error":
+            raise ValueError(f"unsupported regressor loss {model.loss!r}")
+        trees, baseline = _compile_hgb(model)
+        return {"type": "hgb_regressor", "baseline": baseline}, {}, CompiledHGBRegressor(trees, baseline)
+    if name == "HistGradientBoostingClassifier":
+        if len(model.classes_) != 2:
+            raise ValueError("only binary classifiers can be compiled")
+        trees, baseline = _compile_hgb(model)
+        return {"type": "hgb_classifier", "baseline": baseline}, {}, CompiledHGBClassifier(trees, baseline)
+    if name == "MultiOutputGroupRegressor":
+        trees = _compile_forest(model.estimator)
+        arrays = {"fill": model.fill_, "y_mean": model.y_mean_, "y_scale": model.y_scale_}
+        compiled = CompiledMultiOutput(trees, model.outputs, model.fill_, model.y_mean_, model.y_scale_)
+        return {"type": "multi_output", "outputs": [list(o) for o in model.outputs]}, arrays, compiled
+    raise ValueError(f"cannot compile {name}")
+
+
+def _model_slots(models: Dict[str, Any]) -> List[Tuple[List[str], Any]]:
+    # (path inside artifacts["models"], model) for every model.
+    slots: List[Tuple[List[str], Any]] = []
+    for kind, by_h in models.items():
+        if kind == "group_multi":
+            if by_h is not None:
+                slots.append(([kind], by_h))
+            continue
+        for h_key, entry in by_h.items():
+            if isinstance(entry, dict):
+                slots.extend(([kind, h_key, col], m) for col, m in entry.items() if m is not None)
+            elif entry is not None:
+                slots.append(([kind, h_key], entry))
+    return slots
+
+
+def _set_slot(models: Dict[str, Any], slot: List[str], value: Any) -> None:
+    d = models
+    for key in slot[:-1]:
+        d = d.setdefault(key, {})
+    d[slot[-1]] = value
+
+
+def compile_artifacts(artifacts: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Header and node arrays for write_compiled()."""
+
+    header: Dict[str, Any] = {
+        "version": FORMAT_VERSION,
+        "trained_at_ms": artifacts.get("trained_at_ms"),
+        "db_path": artifacts.get("db_path"),
+        "horizons_ms": artifacts.get("horizons_ms"),
+        "station_feature_cols": list(artifacts.get("station_feature_cols") or []),
+        "group_feature_cols": list(artifacts.get("group_feature_cols") or []),
+        "metrics": artifacts.get("metrics") or {},
+        "model_kinds": list((artifacts.get("models") or {}).keys()),
+        "models": [],
+    }
+    arrays: Dict[str, np.ndarray] = {}
+    for i, (slot, model) in enumerate(_model_slots(artifacts.get("models") or {})):
+        entry, extra, compiled = _compile_model(model)
+        prefix = f"m{i}"
+        entry.update({"slot": slot, "prefix": prefix, "max_depth": compiled.trees.max_depth})
+        entry["float32_inputs"] = compiled.trees.float32_inputs
+        arrays.update(compiled.trees.arrays(prefix))
+        arrays.update({f"{prefix}.{k}": np.asarray(v, dtype=np.float64) for k, v in extra.items()})
+        header["models"].append(entry)
+    return header, arrays
+
+
+def write_compiled(path: str, artifacts: Dict[str, Any]) -> Dict[str, Any]:
+    header, arrays = compile_artifacts(artifacts)
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    buf = io.BytesIO()
+    np.savez(buf, **{META_KEY: np.frombuffer(raw, dtype=np.uint8)}, **arrays)
+    atomic_write_bytes(path, buf.getvalue())
+    return header
+
+
+def load_compiled(path: str) -> Dict[str, Any]:
+    """Artifact dict shaped like joblib.load(model.joblib), with compiled models."""
+
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(data[META_KEY].tobytes().decode("utf-8"))
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported compiled model version in {path}")
+        models: Dict[str, Any] = {kind: {} for kind in header.get("model_kinds") or []}
+        for entry in header["models"]:
+            prefix = entry["prefix"]
+            trees = TreeEnsemble.from_arrays(data, prefix, entry["max_depth"], entry["float32_inputs"])
+            if entry["type"] == "hgb_regressor":
+                model: Any = CompiledHGBRegressor(trees, entry["baseline"])
+            elif entry["type"] == "hgb_classifier":
+                model = CompiledHGBClassifier(trees, entry["baseline"])
+            else:
+                model = CompiledMultiOutput(
+                    trees,
+                    entry["outputs"],
+                    data[f"{prefix}.fill"],
+                    data[f"{prefix}.y_mean"],
+                    data[f"{prefix}.y_scale"],
+                )
+            _set_slot(models, entry["slot"], model)
+    return {
+        "trained_at_ms": header.get("trained_at_ms"),
+        "db_path": header.get("db_path"),
+        "horizons_ms": header.get("horizons_ms"),
+        "station_feature_cols": header["station_feature_cols"],
+        "group_feature_cols": header["group_feature_cols"],
+        "models": models,
+        "metrics": header.get("metrics") or {},
+    }
+
+
+def compare_models(
+    artifacts: Dict[str, Any],
+    compiled: Dict[str, Any],
+    station_x: np.ndarray,
+    group_x: np.ndarray,
+) -> Dict[str, Any]:
+    """Largest prediction difference between the original and compiled models.
+
+    "ok" is False when any prediction differs by more than RTOL.
+    """
+
+    compiled_slots = {tuple(slot): m for slot, m in _model_slots(compiled["models"])}
+    max_abs_diff = 0.0
+    max_rel_diff = 0.0
+    n_models = 0
+    for slot, model in _model_slots(artifacts.get("models") or {}):
+        other = compiled_slots[tuple(slot)]
+        x = station_x if slot[0] == "station" else group_x
+        if len(x) == 0:
+            continue
+        if slot[0] in ("fault", "warning"):
+            a, b = model.predict_proba(x)[:, 1], other.predict_proba(x)[:, 1]
+        else:
+            a, b = model.predict(x), other.predict(x)
+        diff = np.abs(a - b)
+        max_abs_diff = max(max_abs_diff, float(np.max(diff)))
+        max_rel_diff = max(max_rel_diff, float(np.max(diff / np.maximum(np.abs(a), 1.0))))
+        n_models += 1
+    return {
+        "models": n_models,
+        "max_abs_diff": max_abs_diff,
+        "max_rel_diff": max_rel_diff,
+        "ok": bool(max_rel_diff <= RTOL),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", required=True, help="model.joblib written by train.py")
+    ap.add_argument("--out", default=None, help="Compiled .npz path (default: --model with a .npz suffix)")
+    args = ap.parse_args()
+
+    import joblib
+
+    out_path = args.out or f"{args.model.rsplit('.', 1)[0]}.npz"
+    t0 = time.perf_counter()
+    header = write_compiled(out_path, joblib.load(args.model))
+    print(json.dumps({"ok": True, "path": out_path, "models": len(header["models"]), "seconds": time.perf_counter() - t0}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+"""Split-gain feature pruning for train.py --prune-features.
+
+A model's importance of a feature is the total split gain of the nodes that
+split on it (HistGradientBoosting), or the impurity decrease for the
+multi-output ExtraTrees model, normalized to sum to 1 so that every model
+counts the same. Importances are summed over the models that read each
+matrix: station_x for the station models and group_x for the rest. The kept
+columns are the most important ones that together reach keep_fraction of the
+total. They are stored as the artifact's feature columns, so predict.py only
+builds those.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+def model_importance(model: Any, n_features: int) -> np.ndarray:
+    imp = np.zeros(n_features)
+    if hasattr(model, "_predictors"):
+        for predictors_of_iter in model._predictors:
+            for predictor in predictors_of_iter:
+                nodes = predictor.nodes
+                split = nodes["is_leaf"] == 0
+                np.add.at(imp, nodes["feature_idx"][split], np.maximum(nodes["gain"][split], 0.0))
+    elif hasattr(model, "estimator"):
+        imp = np.asarray(model.estimator.feature_importances_, dtype=float)
+    total = imp.sum()
+    return imp / total if total > 0 else imp
+
+
+def keep_by_importance(cols: List[str], importance: np.ndarray, keep_fraction: float) -> List[str]:
+    """Smallest set of cols (in their original order) with keep_fraction of the importance."""
+
+    total = importance.sum()
+    if total <= 0:
+        # No model split on this matrix: nothing to rank by.
+        return list(cols)
+    order = np.argsort(-importance, kind="stable")
+    covered = np.cumsum(importance[order]) / total
+    n_keep = int(np.searchsorted(covered, keep_fraction - 1e-12)) + 1
+    keep = set(order[: min(n_keep, len(cols))].tolist())
+    return [c for i, c in enumerate(cols) if i in keep]
+
+
+def prune_features(
+    tasks: List[Tuple[Any, ...]],
+    models: List[Any],
+    station_cols: List[str],
+    group_cols: List[str],
+    keep_fraction: float,
+) -> Tuple[List[str], List[str], Dict[str, Any]]:
+    """(kept station columns, kept group columns, report) from the fitted models of tasks."""
+
+    station_imp = np.zeros(len(station_cols))
+    group_imp = np.zeros(len(group_cols))
+    for task, model in zip(tasks, models):
+        if task[0] == "station":
+            station_imp += model_importance(model, len(station_cols))
+        else:
+            group_imp += model_importance(model, len(group_cols))
+
+    report: Dict[str, Any] = {"keep_importance": keep_fraction}
+    kept: List[List[str]] = []
+    for name, cols, imp in (("station", station_cols, station_imp), ("group", group_cols, group_imp)):
+        keep = keep_by_importance(cols, imp, keep_fraction)
+        total = imp.sum()
+        report[name] = {
+            "kept": len(keep),
+            "total": len(cols),
+            "dropped": [c for c in cols if c not in set(keep)],
+            "top": [
+                {"col": cols[i], "importance": float(imp[i] / total)}
+                for i in np.argsort(-imp, kind="stable")[:10]
+                if total > 0
+            ],
+        }
+        kept.append(keep)
+    return kept[0], kept[1], report
+
+
+def select_feature_columns(
+    arrays: Dict[str, np.ndarray],
+    station_cols: List[str],
+    group_cols: List[str],
+    keep_station: List[str],
+    keep_group: List[str],
+) -> Dict[str, np.ndarray]:
+    """arrays with station_x/group_x reduced to the kept columns (in the kept order)."""
+
+    out = dict(arrays)
+    for name, cols, keep in (("station_x", station_cols, keep_station), ("group_x", group_cols, keep_group)):
+        if keep == cols:
+            continue
+        missing = [c for c in keep if c not in cols]
+        if missing:
+            raise ValueError(f"{name} has no column(s) {missing}")
+        idx = [cols.index(c) for c in keep]
+        out[name] = np.ascontiguousarray(np.asarray(arrays[name])[:, idx])
+    return out
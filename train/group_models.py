@@ -0,0 +1,48 @@
+from typing import List, Tuple
+
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor
+
+
+class MultiOutputGroupRegressor:
+    """One multi-output tree ensemble for every (horizon, target) group regression.
+
+    Replaces the per-target layout (one HistGradientBoostingRegressor per
+    horizon and target) with a single fit over the shared group_x. Targets are
+    standardized so that no single unit (kOhm vs %) dominates the split
+    criterion, and missing features are filled with the training medians.
+    predict() returns one column per entry of `outputs`.
+    """
+
+    def __init__(self, outputs: List[Tuple[str, str]], random_state: int = 0) -> None:
+        self.outputs = list(outputs)
+        self.random_state = random_state
+        self.estimator = ExtraTreesRegressor(
+            n_estimators=30,
+            max_depth=10,
+            min_samples_leaf=20,
+            max_features=0.3,
+            random_state=random_state,
+        )
+
+    def _impute(self, x: np.ndarray) -> np.ndarray:
+        x = np.array(x, dtype=float)
+        nan_rows, nan_cols = np.nonzero(np.isnan(x))
+        x[nan_rows, nan_cols] = self.fill_[nan_cols]
+        return x
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> "MultiOutputGroupRegressor":
+        with np.errstate(all="ignore"):
+            fill = np.nanmedian(x, axis=0) if len(x) else np.zeros(x.shape[1])
+        self.fill_ = np.where(np.isfinite(fill), fill, 0.0)
+        self.y_mean_ = y.mean(axis=0)
+        scale = y.std(axis=0)
+        self.y_scale_ = np.where(scale > 0, scale, 1.0)
+        self.estimator.fit(self._impute(x), (y - self.y_mean_) / self.y_scale_)
+        return self
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        pred = self.estimator.predict(self._impute(x))
+        if pred.ndim == 1:
+            pred = pred[:, None]
+        return pred * self.y_scale_ + self.y_mean_
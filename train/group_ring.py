@@ -0,0 +1,186 @@
+"""Memory-mapped ring file of decoded battery-group rows.
+
+ingest_sink.py is the only writer: it decodes each battery_groups_snapshots
+payload once and appends one row per group. load_data reads a ts window
+straight from the mapped arrays instead of querying SQLite and re-parsing
+the JSON (see read_group_ring in common.py).
+
+Layout: an 8-byte magic, HEADER_FIELDS int64 counters, then ts int64[capacity],
+groupId int64[capacity] and values float64[capacity, n_values]. Rows are kept
+in append order, so ts is non-decreasing along the logical ring. The writer
+bumps seq to an odd value before touching rows or counters and back to even
+afterwards; readers copy their window and retry if seq moved (a seqlock), so
+a window is never torn by a concurrent append that wraps over it.
+
+A snapshot that decoded to no groups is kept as one EMPTY_GROUP_ID row, so the
+ring holds every ingested snapshot ts and a reader can tell a missed snapshot
+from an empty one (see read_group_ring).
+"""
+
+import bisect
+import os
+import time
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+
+MAGIC = b"GRPRING1"
+VERSION = 2
+
+HEADER_FIELDS = 8
+H_VERSION, H_CAPACITY, H_N_VALUES, H_SEQ, H_WRITE_POS, H_COVERED_FROM, H_NEWEST, _H_RESERVED = range(HEADER_FIELDS)
+DATA_OFFSET = len(MAGIC) + 8 * HEADER_FIELDS
+
+# covered_from_ts before the first append: the ring covers nothing yet.
+UNSET_TS = np.iinfo(np.int64).max
+# groupId of the placeholder row of a snapshot without groups.
+EMPTY_GROUP_ID = -1
+
+READ_RETRIES = 20
+
+
+class _LogicalTs:
+    # ts of logical rows [lo, hi) of the ring, indexable for bisect.
+    def __init__(self, ts: np.ndarray, lo: int, hi: int) -> None:
+        self.ts, self.lo, self.n, self.cap = ts, lo, hi - lo, len(ts)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> int:
+        return int(self.ts[(self.lo + i) % self.cap])
+
+
+class GroupRing:
+    def __init__(self, path: str, writable: bool) -> None:
+        mode = "r+" if writable else "r"
+        raw = np.memmap(path, dtype=np.uint8, mode=mode)
+        if len(raw) < DATA_OFFSET or raw[: len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"{path} is not a group ring file")
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=raw, offset=len(MAGIC))
+        if int(header[H_VERSION]) != VERSION:
+            raise ValueError(f"unsupported group ring version in {path}")
+        cap, k = int(header[H_CAPACITY]), int(header[H_N_VALUES])
+        self.path = path
+        self.capacity = cap
+        self.n_values = k
+        self._raw = raw
+        self._h = header
+        self._ts = np.ndarray((cap,), dtype=np.int64, buffer=raw, offset=DATA_OFFSET)
+        self._gid = np.ndarray((cap,), dtype=np.int64, buffer=raw, offset=DATA_OFFSET + 8 * cap)
+        self._values = np.ndarray((cap, k), dtype=np.float64, buffer=raw, offset=DATA_OFFSET + 16 * cap)
+
+    @classmethod
+    def create(cls, path: str, capacity: int, n_values: int) -> "GroupRing":
+        """New empty ring (replacing any existing file), opened for writing."""
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        size = DATA_OFFSET + 8 * capacity * (2 + n_values)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.array([VERSION, capacity, n_values, 0, 0, UNSET_TS, 0, 0], dtype=np.int64).tobytes())
+            f.truncate(size)
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+    @classmethod
+    def open(cls, path: str) -> Optional["GroupRing"]:
+        """Read-only view of an existing ring; None when missing or not a ring file."""
+
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path, writable=False)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def covered_from_ts(self) -> int:
+        return int(self._h[H_COVERED_FROM])
+
+    @property
+    def newest_ts(self) -> int:
+        return int(self._h[H_NEWEST])
+
+    @property
+    def rows(self) -> int:
+        return min(int(self._h[H_WRITE_POS]), self.capacity)
+
+    def mark_covered_from(self, ts: int) -> None:
+        """Declare every snapshot with ts >= this one present (before a backfill)."""
+
+        self._h[H_SEQ] += 1
+        self._h[H_COVERED_FROM] = ts
+        self._h[H_SEQ] += 1
+
+    def append(self, ts: np.ndarray, group_ids: np.ndarray, values: np.ndarray) -> None:
+        """Append rows with non-decreasing ts, all newer than newest_ts."""
+
+        n = len(ts)
+        if n == 0:
+            return
+        if n > self.capacity:
+            raise ValueError(f"{n} rows do not fit a ring of {self.capacity}")
+        pos = int(self._h[H_WRITE_POS])
+        end = pos + n
+        idx = np.arange(pos, end) % self.capacity
+        covered = int(self._h[H_COVERED_FROM])
+        if covered == UNSET_TS:
+            covered = int(ts[0])
+        if end > self.capacity:
+            # The newest overwritten row may share its ts with rows that stay,
+            # so the ring is only complete from the next ts on.
+            lost_ts = int(self._ts[(end - self.capacity - 1) % self.capacity])
+            covered = max(covered, lost_ts + 1)
+
+        self._h[H_SEQ] += 1
+        self._ts[idx] = ts
+        self._gid[idx] = group_ids
+        self._values[idx] = values
+        self._h[H_WRITE_POS] = end
+        self._h[H_COVERED_FROM] = covered
+        self._h[H_NEWEST] = int(ts[-1])
+        self._h[H_SEQ] += 1
+
+    def window(
+        self, start_ts: int, end_ts: int
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Copies of (ts, groupId, values) for start_ts <= ts <= end_ts, in append order,
+        plus the distinct snapshot ts of the window (including empty snapshots).
+
+        None when the ring does not hold the whole window (not covered back to
+        start_ts, or nothing newer than end_ts seen yet) or when the writer
+        kept moving during every read attempt.
+        """
+
+        for attempt in range(READ_RETRIES):
+            seq = int(self._h[H_SEQ])
+            if seq % 2:
+                time.sleep(0.001 * (attempt + 1))
+                continue
+            pos = int(self._h[H_WRITE_POS])
+            if pos == 0 or self.covered_from_ts > start_ts or self.newest_ts < end_ts:
+                return None
+            lo = max(0, pos - self.capacity)
+            logical = _LogicalTs(self._ts, lo, pos)
+            a = lo + bisect.bisect_left(logical, start_ts)
+            b = lo + bisect.bisect_right(logical, end_ts)
+            first, n = a % self.capacity, b - a
+            if first + n <= self.capacity:
+                rows: Any = slice(first, first + n)
+            else:
+                rows = np.arange(a, b) % self.capacity
+            out = (np.array(self._ts[rows]), np.array(self._gid[rows]), np.array(self._values[rows]))
+            if int(self._h[H_SEQ]) == seq:
+                ts, gids, values = out
+                real = gids != EMPTY_GROUP_ID
+                snapshot_ts = np.unique(ts)
+                if not real.all():
+                    ts, gids, values = ts[real], gids[real], values[real]
+                return ts, gids, values, snapshot_ts
+        return None
+
+    def flush(self) -> None:
+        self._raw.flush()
@@ -0,0 +1,106 @@
+"""Cache of finished training rows for train.py --incremental.
+
+A row's labels look up to the longest horizon ahead, so they only stop
+changing once that much newer data exists. The cache keeps the training arrays
+(the same names as shards.training_arrays) of rows up to final_ts = newest data
+ts - longest horizon, plus the settings they were built with. The next run
+rebuilds features and labels only for rows after final_ts (reading RETAIN_MS
+more for the rolling windows, like shards.py), appends them, and caches the
+rows that became final in the meantime.
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from common import HORIZONS_MS
+
+
+CACHE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+LABEL_LOOKAHEAD_MS = max(HORIZONS_MS.values())
+
+
+def _is_station_array(name: str) -> bool:
+    return name.startswith("station_") or name.startswith("y_station_")
+
+
+def select_rows(
+    arrays: Dict[str, np.ndarray],
+    station_keep: np.ndarray,
+    group_keep: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    return {name: arr[station_keep if _is_station_array(name) else group_keep] for name, arr in arrays.items()}
+
+
+def rows_in_range(
+    arrays: Dict[str, np.ndarray],
+    after_ts: Optional[int] = None,
+    upto_ts: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Rows with after_ts < ts <= upto_ts (either bound may be None)."""
+
+    def keep(ts: np.ndarray) -> np.ndarray:
+        mask = np.ones(len(ts), dtype=bool)
+        if after_ts is not None:
+            mask &= ts > after_ts
+        if upto_ts is not None:
+            mask &= ts <= upto_ts
+        return mask
+
+    return select_rows(arrays, keep(arrays["station_ts"]), keep(arrays["group_ts"]))
+
+
+def concat_arrays(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    if set(a) != set(b):
+        raise ValueError("cached and new training arrays differ")
+    return {name: np.concatenate([a[name], b[name]]) for name in a.keys()}
+
+
+def final_label_ts(arrays: Dict[str, np.ndarray]) -> Optional[int]:
+    # Newest ts whose labels no longer depend on data still to come.
+    if len(arrays["station_ts"]) == 0 or len(arrays["group_ts"]) == 0:
+        return None
+    newest = min(int(arrays["station_ts"].max()), int(arrays["group_ts"].max()))
+    return newest - LABEL_LOOKAHEAD_MS
+
+
+def load_cache(cache_dir: str, settings: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+    """Manifest and arrays, or None when missing or built with other settings."""
+
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != CACHE_VERSION or manifest.get("settings") != settings:
+        return None
+    arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy")) for name in manifest["arrays"]}
+    return manifest, arrays
+
+
+def save_cache(cache_dir: str, manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+    # Written next to the old cache and swapped in, so an interrupted run
+    # leaves the previous cache usable.
+    tmp_dir = f"{cache_dir}.tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+    manifest = dict(manifest, version=CACHE_VERSION, saved_at_ms=int(time.time() * 1000), arrays=sorted(arrays))
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    old_dir = f"{cache_dir}.old"
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.isdir(cache_dir):
+        os.replace(cache_dir, old_dir)
+    os.replace(tmp_dir, cache_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
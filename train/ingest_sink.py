@@ -0,0 +1,238 @@
+"""Columnar ingest sink for battery-group snapshots.
+
+Keeps a rolling window of decoded group rows in a group_ring.py ring file so
+load_data(group_ring=...) can skip the battery_groups_snapshots query and
+JSON decode. Each snapshot is decoded exactly once, when it arrives:
+
+- over a local socket (TCP or Unix), one JSON object per line:
+  {"ts": <ms>, "groups": <the array the server stores in battery_groups_snapshots.json>}
+- and/or by following the DB (--follow-s): rows newer than the ring's newest ts
+  are read with the same SQL decode load_data uses.
+
+--backfill-hours fills the ring from the DB at startup so it is warm right
+away. Snapshots not newer than the ring's newest ts are dropped, which keeps
+the ring in ts order when both sources are used. A snapshot that never reaches
+the sink leaves a hole in the ring; read_group_ring notices it by comparing
+the window's snapshot ts with battery_groups_snapshots and reads SQLite.
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common import GROUP_DF_COLUMNS, GROUP_VALUE_FIELDS, _read_battery_groups_sql, _to_float, connect_readonly
+from group_ring import EMPTY_GROUP_ID, GroupRing
+
+
+DEFAULT_CAPACITY = 1_000_000
+
+# "$.bms.socPct" -> ("bms", "socPct")
+_FIELD_KEYS = [tuple(path[2:].split(".")) for _col, path in GROUP_VALUE_FIELDS]
+
+
+def decode_group_snapshot(groups: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """(groupId, values) of one battery_groups_snapshots payload, with load_data's rules."""
+
+    gids = []
+    rows = []
+    if isinstance(groups, list):
+        for g in groups:
+            if not isinstance(g, dict):
+                continue
+            gid = g.get("id")
+            if type(gid) is not int:
+                continue
+            parts = {section: g.get(section) for section in ("bms", "pcs")}
+            parts = {section: part if isinstance(part, dict) else {} for section, part in parts.items()}
+            gids.append(gid)
+            rows.append([_to_float(parts[section].get(key)) for section, key in _FIELD_KEYS])
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(_FIELD_KEYS))
+    return np.array(gids, dtype=np.int64), values
+
+
+def read_snapshots(conn: sqlite3.Connection, since: Optional[int]) -> Tuple[np.ndarray, pd.DataFrame]:
+    """(every snapshot ts >= since, decoded group_df of exactly those snapshots)."""
+
+    where, args = ("WHERE ts >= ?", [since]) if since is not None else ("", [])
+    rows = conn.execute(f"SELECT ts FROM battery_groups_snapshots {where} ORDER BY ts", args).fetchall()
+    snapshot_ts = np.array([r[0] for r in rows], dtype=np.int64)
+    if len(snapshot_ts) == 0:
+        return snapshot_ts, pd.DataFrame(columns=GROUP_DF_COLUMNS)
+    # Bounded by the listed ts: a snapshot inserted in between is left for
+    # the next read instead of being taken for an empty one.
+    return snapshot_ts, _read_battery_groups_sql(conn, since, int(snapshot_ts[-1]))
+
+
+class IngestSink:
+    """Serializes appends from the socket handlers and the DB follower."""
+
+    def __init__(self, ring: GroupRing) -> None:
+        self.ring = ring
+        self.lock = threading.Lock()
+        self.snapshots = 0
+        self.dropped = 0
+
+    def append_snapshot(self, ts: int, group_ids: np.ndarray, values: np.ndarray) -> bool:
+        if len(group_ids) == 0:
+            group_ids = np.array([EMPTY_GROUP_ID], dtype=np.int64)
+            values = np.full((1, self.ring.n_values), np.nan)
+        with self.lock:
+            if self.ring.rows and ts <= self.ring.newest_ts:
+                self.dropped += 1
+                return False
+            self.ring.append(np.full(len(group_ids), ts, dtype=np.int64), group_ids, values)
+            self.snapshots += 1
+            return True
+
+    def append_frame(self, group_df: pd.DataFrame, snapshot_ts: Optional[np.ndarray] = None) -> int:
+        """Append a decoded group_df (ts-ordered, as _read_battery_groups_sql returns); returns rows.
+
+        snapshot_ts lists every snapshot the frame was read from; the ones
+        without group rows get an EMPTY_GROUP_ID row.
+        """
+
+        ts = group_df["ts"].to_numpy(dtype=np.int64)
+        gids = group_df["groupId"].to_numpy(dtype=np.int64)
+        values = group_df[[c for c, _path in GROUP_VALUE_FIELDS]].to_numpy(dtype=np.float64)
+        if snapshot_ts is not None:
+            empty = np.setdiff1d(snapshot_ts, ts)
+            if len(empty):
+                ts = np.concatenate([ts, empty])
+                gids = np.concatenate([gids, np.full(len(empty), EMPTY_GROUP_ID, dtype=np.int64)])
+                values = np.vstack([values, np.full((len(empty), values.shape[1]), np.nan)])
+                order = np.argsort(ts, kind="stable")
+                ts, gids, values = ts[order], gids[order], values[order]
+
+        with self.lock:
+            keep = None
+            if self.ring.rows:
+                keep = ts > self.ring.newest_ts
+            if keep is not None and not keep.all():
+                ts, gids, values = ts[keep], gids[keep], values[keep]
+            if len(ts) > self.ring.capacity:
+                # Keep whole snapshots only: drop the oldest ts until it fits.
+                cutoff = int(ts[len(ts) - self.ring.capacity])
+                keep = ts > cutoff
+                ts, gids, values = ts[keep], gids[keep], values[keep]
+                self.ring.mark_covered_from(cutoff + 1)
+            if len(ts) == 0:
+                return 0
+            self.ring.append(ts, gids, values)
+            self.snapshots += int(len(np.unique(ts)))
+            return int((gids != EMPTY_GROUP_ID).sum())
+
+    def backfill(self, db_path: str, start_ts: Optional[int]) -> int:
+        conn = connect_readonly(db_path)
+        try:
+            snapshot_ts, group_df = read_snapshots(conn, start_ts)
+            first_ts = conn.execute("SELECT MIN(ts) FROM battery_groups_snapshots").fetchone()[0]
+        finally:
+            conn.close()
+        if not self.ring.rows:
+            # Everything from start_ts (or the first snapshot in the DB) on is
+            # about to be in the ring, even snapshots that decode to no rows.
+            covered = start_ts if start_ts is not None else first_ts
+            if covered is not None:
+                self.ring.mark_covered_from(int(covered))
+        return self.append_frame(group_df, snapshot_ts)
+
+    def follow(self, db_path: str, interval_s: float, stop: threading.Event) -> None:
+        conn = connect_readonly(db_path)
+        try:
+            while not stop.wait(interval_s):
+                since = self.ring.newest_ts + 1 if self.ring.rows else None
+                snapshot_ts, group_df = read_snapshots(conn, since)
+                self.append_frame(group_df, snapshot_ts)
+        finally:
+            conn.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "rows": self.ring.rows,
+            "capacity": self.ring.capacity,
+            "snapshots": self.snapshots,
+            "dropped": self.dropped,
+            "coveredFromTs": self.ring.covered_from_ts if self.ring.rows else None,
+            "newestTs": self.ring.newest_ts if self.ring.rows else None,
+        }
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    sink: IngestSink
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                ts = int(msg["ts"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            gids, values = decode_group_snapshot(msg.get("groups"))
+            self.sink.append_snapshot(ts, gids, values)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ring", required=True, help="Ring file to (re)create; pass the same path as --group-ring")
+    ap.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="Group rows kept (oldest are overwritten)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8766, help="TCP port for line-delimited snapshots (0: any free port)")
+    ap.add_argument("--unix-socket", default=None, help="Listen on this Unix socket instead of TCP")
+    ap.add_argument("--db", default=None, help="SQLite DB for --backfill-hours and --follow-s")
+    ap.add_argument("--backfill-hours", type=float, default=0.0, help="Fill the ring from --db at startup (<0: all rows)")
+    ap.add_argument("--follow-s", type=float, default=0.0, help="Poll --db for new snapshots every N seconds (0: off)")
+    args = ap.parse_args()
+
+    if (args.backfill_hours or args.follow_s) and not args.db:
+        ap.error("--backfill-hours and --follow-s need --db")
+
+    ring = GroupRing.create(args.ring, args.capacity, len(GROUP_VALUE_FIELDS))
+    sink = IngestSink(ring)
+    backfilled = 0
+    if args.backfill_hours:
+        start_ts = None
+        if args.backfill_hours > 0:
+            start_ts = int(time.time() * 1000) - int(args.backfill_hours * 60 * 60 * 1000)
+        backfilled = sink.backfill(args.db, start_ts)
+
+    stop = threading.Event()
+    if args.follow_s > 0:
+        threading.Thread(target=sink.follow, args=(args.db, args.follow_s, stop), daemon=True).start()
+
+    handler = type("Handler", (_LineHandler,), {"sink": sink})
+    server: socketserver.BaseServer
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = socketserver.ThreadingUnixStreamServer(args.unix_socket, handler)
+        listening = args.unix_socket
+    else:
+        server = socketserver.ThreadingTCPServer((args.host, args.port), handler)
+        listening = f"{args.host}:{server.server_address[1]}"
+    server.daemon_threads = True  # type: ignore[attr-defined]
+    print(
+        json.dumps({"ok": True, "ring": args.ring, "listening": listening, "backfilledRows": backfilled}),
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        ring.flush()
+    print(json.dumps({"ok": True, **sink.status()}), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
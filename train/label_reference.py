@@ -0,0 +1,173 @@
+"""Per-group label functions build_labels replaced.
+
+They loop over groups and horizons with one searchsorted each. Kept as the
+reference build_labels is checked against (tests/test_labels.py) and timed
+against (benchmarks.py labels).
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+def add_future_targets_by_horizon(
+    df: pd.DataFrame,
+    horizons_ms: Dict[str, int],
+    target_cols: List[str],
+) -> pd.DataFrame:
+    out = df.copy()
+    out = out.sort_values(["groupId", "ts"]).reset_index(drop=True)
+
+    for h_key, h_ms in horizons_ms.items():
+        for col in target_cols:
+            out[f"y_{col}_{h_key}"] = np.nan
+
+        for gid, g in out.groupby("groupId", sort=False):
+            ts = g["ts"].to_numpy(dtype=np.int64)
+            idx = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
+            valid = idx < len(ts)
+            for col in target_cols:
+                vals = g[col].to_numpy(dtype=float)
+                y = np.full(len(ts), np.nan)
+                y[valid] = vals[idx[valid]]
+                out.loc[g.index, f"y_{col}_{h_key}"] = y
+
+    return out
+
+
+def merge_risk_labels_from_future_counts(
+    df: pd.DataFrame,
+    horizons_ms: Dict[str, int],
+) -> pd.DataFrame:
+    """Merge risk labels derived from future BMS counters.
+
+    This is a robust fallback when alarm_occurrences is sparse.
+    - warning: future bms_warningCount > 0
+    - fault: future bms_faultCount > 0
+
+    The result is merged into existing y_warning_{h} / y_fault_{h} columns if present.
+    """
+
+    out = df.copy()
+    out = out.sort_values(["groupId", "ts"]).reset_index(drop=True)
+
+    for h_key, _h_ms in horizons_ms.items():
+        if f"y_warning_{h_key}" not in out.columns:
+            out[f"y_warning_{h_key}"] = 0
+        if f"y_fault_{h_key}" not in out.columns:
+            out[f"y_fault_{h_key}"] = 0
+
+    for gid, g in out.groupby("groupId", sort=False):
+        ts = g["ts"].to_numpy(dtype=np.int64)
+        idx = {}
+        for h_key, h_ms in horizons_ms.items():
+            idx[h_key] = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
+
+        warn_cnt = g.get("bms_warningCount")
+        fault_cnt = g.get("bms_faultCount")
+
+        warn_vals = warn_cnt.to_numpy(dtype=float) if warn_cnt is not None else np.full(len(ts), np.nan)
+        fault_vals = (
+            fault_cnt.to_numpy(dtype=float) if fault_cnt is not None else np.full(len(ts), np.nan)
+        )
+
+        for h_key in horizons_ms.keys():
+            j = idx[h_key]
+            valid = j < len(ts)
+
+            y_warn = np.zeros(len(ts), dtype=np.int32)
+            y_fault = np.zeros(len(ts), dtype=np.int32)
+
+            if valid.any():
+                fut_warn = warn_vals[j[valid]]
+                fut_fault = fault_vals[j[valid]]
+                y_warn[valid] = (np.nan_to_num(fut_warn, nan=0.0) > 0).astype(np.int32)
+                y_fault[valid] = (np.nan_to_num(fut_fault, nan=0.0) > 0).astype(np.int32)
+
+            out.loc[g.index, f"y_warning_{h_key}"] = np.maximum(
+                out.loc[g.index, f"y_warning_{h_key}"].to_numpy(dtype=np.int32),
+                y_warn,
+            )
+            out.loc[g.index, f"y_fault_{h_key}"] = np.maximum(
+                out.loc[g.index, f"y_fault_{h_key}"].to_numpy(dtype=np.int32),
+                y_fault,
+            )
+
+    return out
+
+
+def add_warning_labels_by_horizon(
+    df: pd.DataFrame,
+    alarm_occurrences: pd.DataFrame,
+    horizons_ms: Dict[str, int],
+) -> pd.DataFrame:
+    out = df.copy()
+    occ = alarm_occurrences.copy()
+    if not occ.empty:
+        occ = occ[(occ["groupId"].notna())]
+        occ["groupId"] = occ["groupId"].astype(int)
+        occ["ts"] = occ["ts"].astype(int)
+
+    event_ts_by_group: Dict[int, np.ndarray] = {}
+    if not occ.empty:
+        is_warning = occ["level"].isin(["warning"])
+        warn_occ = occ[is_warning]
+        for gid, g in warn_occ.groupby("groupId"):
+            arr = np.sort(g["ts"].to_numpy(dtype=np.int64))
+            event_ts_by_group[int(gid)] = arr
+
+    for h_key, _h_ms in horizons_ms.items():
+        out[f"y_warning_{h_key}"] = 0
+
+    for gid, g in out.groupby("groupId", sort=False):
+        ts = g["ts"].to_numpy(dtype=np.int64)
+        events = event_ts_by_group.get(int(gid), np.array([], dtype=np.int64))
+        if events.size == 0:
+            continue
+        for h_key, h_ms in horizons_ms.items():
+            idx = np.searchsorted(events, ts, side="right")
+            has = np.zeros(len(ts), dtype=np.int32)
+            mask = idx < len(events)
+            has[mask] = (events[idx[mask]] <= (ts[mask] + np.int64(h_ms))).astype(np.int32)
+            out.loc[g.index, f"y_warning_{h_key}"] = has
+
+    return out
+
+
+def add_fault_labels_by_horizon(
+    df: pd.DataFrame,
+    alarm_occurrences: pd.DataFrame,
+    horizons_ms: Dict[str, int],
+) -> pd.DataFrame:
+    out = df.copy()
+    occ = alarm_occurrences.copy()
+    if not occ.empty:
+        occ = occ[(occ["groupId"].notna())]
+        occ["groupId"] = occ["groupId"].astype(int)
+        occ["ts"] = occ["ts"].astype(int)
+
+    event_ts_by_group: Dict[int, np.ndarray] = {}
+    if not occ.empty:
+        is_fault = (occ["level"].isin(["critical"])) | (occ["type"].astype(str) == "锁存")
+        fault_occ = occ[is_fault]
+        for gid, g in fault_occ.groupby("groupId"):
+            arr = np.sort(g["ts"].to_numpy(dtype=np.int64))
+            event_ts_by_group[int(gid)] = arr
+
+    for h_key, h_ms in horizons_ms.items():
+        out[f"y_fault_{h_key}"] = 0
+
+    for gid, g in out.groupby("groupId", sort=False):
+        ts = g["ts"].to_numpy(dtype=np.int64)
+        events = event_ts_by_group.get(int(gid), np.array([], dtype=np.int64))
+        if events.size == 0:
+            continue
+        for h_key, h_ms in horizons_ms.items():
+            idx = np.searchsorted(events, ts, side="right")
+            has = np.zeros(len(ts), dtype=np.int32)
+            mask = idx < len(events)
+            has[mask] = (events[idx[mask]] <= (ts[mask] + np.int64(h_ms))).astype(np.int32)
+            out.loc[g.index, f"y_fault_{h_key}"] = has
+
+    return out
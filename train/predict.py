@@ -1,19 +1,40 @@
 import argparse
 import json
 import os
+import threading
 import time
-from typing import Any, Dict, List, Tuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Tuple
 
 import joblib
 import numpy as np
+import pandas as pd
 
 from common import (
     HORIZONS_MS,
     build_group_features,
+    STATION_BASE_COLS,
     build_station_features,
+    latest_features_direct,
     latest_features_for_inference,
+    latest_window_start,
     load_data,
 )
+from compiled_models import load_compiled
+from feature_store import advance_feature_state, load_feature_state, save_feature_state
+from prediction_io import write_prediction_bin, write_prediction_json
+from prediction_log import append_predictions
+from profiling import StageRecorder, cprofile_to, recording, stage, write_profile
+
+
+# (training target column, key in the per-group "bms" output)
+GROUP_TARGET_KEYS: List[Tuple[str, str]] = [
+    ("bms_socPct", "socPct"),
+    ("bms_temperatureC", "temperatureC"),
+    ("bms_insulationResistanceKohm", "insulationResistanceKohm"),
+    ("bms_deltaCellVoltageMv", "deltaCellVoltageMv"),
+    ("pcs_actualKw", "pcsActualKw"),
+]
 
 
 def _ensure_columns(df, cols):
@@ -36,48 +57,178 @@ def _to_py(v: Any) -> Any:
     return v
 
 
-def main() -> int:
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
-    ap.add_argument("--model", default=os.path.join("train", "artifacts", "model.joblib"))
-    ap.add_argument("--out", default=os.path.join("server", "data", "predictions-latest.json"))
-    ap.add_argument("--window-hours", type=float, default=12.0)
-    args = ap.parse_args()
-
-    artifacts = joblib.load(args.model)
-
-    station_feature_cols = list(artifacts.get("station_feature_cols") or [])
-    group_feature_cols = list(artifacts.get("group_feature_cols") or [])
-
+def load_artifacts(path: str) -> Dict[str, Any]:
+    """model.joblib, or the NumPy-only model.npz that loads without scikit-learn."""
+
+    if path.endswith(".npz"):
+        return load_compiled(path)
+    return joblib.load(path)
+
+
+class ModelCache:
+    """Keeps the model in memory and reloads it only when its mtime changes."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.mtime_ns: Optional[int] = None
+        self.artifacts: Dict[str, Any] = {}
+        self.loaded_at_ms = 0
+
+    def get(self) -> Dict[str, Any]:
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        if mtime_ns != self.mtime_ns:
+            self.artifacts = load_artifacts(self.path)
+            self.mtime_ns = mtime_ns
+            self.loaded_at_ms = int(time.time() * 1000)
+        return self.artifacts
+
+
+def predict_groups(
+    artifacts: Dict[str, Any],
+    x_group: np.ndarray,
+) -> Tuple[Dict[str, Dict[str, np.ndarray]], Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Run every group model once over all groups.
+
+    Returns regression predictions by horizon and target column plus fault and
+    warning probabilities by horizon, each aligned with the rows of x_group.
+    """
+
+    models = artifacts.get("models") or {}
+    n = len(x_group)
+    group_preds_by_h: Dict[str, Dict[str, np.ndarray]] = {}
+    fault_probs_by_h: Dict[str, np.ndarray] = {}
+    warn_probs_by_h: Dict[str, np.ndarray] = {}
+    for h_key in HORIZONS_MS.keys():
+        models_group = models.get("group", {}).get(h_key, {})
+        group_preds_by_h[h_key] = {}
+        for col, _out_key in GROUP_TARGET_KEYS:
+            m = models_group.get(col)
+            if m is not None:
+                group_preds_by_h[h_key][col] = m.predict(x_group)
+
+    multi = models.get("group_multi")
+    if multi is not None:
+        preds = multi.predict(x_group)
+        for j, (h_key, col) in enumerate(multi.outputs):
+            group_preds_by_h[h_key][col] = preds[:, j]
+
+    for h_key in HORIZONS_MS.keys():
+        clf_fault = models.get("fault", {}).get(h_key)
+        if clf_fault is None:
+            fault_probs_by_h[h_key] = np.full(n, np.nan)
+        else:
+            fault_probs_by_h[h_key] = clf_fault.predict_proba(x_group)[:, 1]
+
+        clf_warn = models.get("warning", {}).get(h_key)
+        if clf_warn is None:
+            warn_probs_by_h[h_key] = np.full(n, np.nan)
+        else:
+            warn_probs_by_h[h_key] = clf_warn.predict_proba(x_group)[:, 1]
+
+    return group_preds_by_h, fault_probs_by_h, warn_probs_by_h
+
+
+def load_frames(
+    db_path: str,
+    window_hours: float,
+    feature_state_path: Optional[str] = None,
+    feature_path: str = "full",
+    target_cache: Optional[str] = None,
+    group_ring: Optional[str] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     end_ts = None
     start_ts = None
-    if args.window_hours and args.window_hours > 0:
-        start_ts = int(time.time() * 1000) - int(args.window_hours * 60 * 60 * 1000)
-
-    loaded = load_data(args.db, start_ts=start_ts, end_ts=end_ts)
-    station_feat_df, station_feature_cols_runtime = build_station_features(
-        loaded.station_df, loaded.group_df
-    )
-    group_feat_df, group_feature_cols_runtime = build_group_features(station_feat_df, loaded.group_df)
-
-    # Enforce feature schema from training artifacts to avoid X feature-count mismatch.
-    # If columns are missing (e.g. due to short history), add them as NaN.
-    if station_feature_cols:
-        station_feat_df = _ensure_columns(station_feat_df, station_feature_cols)
-    else:
-        station_feature_cols = station_feature_cols_runtime
+    if window_hours and window_hours > 0:
+        start_ts = int(time.time() * 1000) - int(window_hours * 60 * 60 * 1000)
+    if feature_path == "latest" and not feature_state_path:
+        # Only the rows the latest-row features can see; --window-hours then
+        # no longer changes how much is read.
+        with stage("latest_window"):
+            tail_start = latest_window_start(db_path, end_ts)
+        if tail_start is not None:
+            start_ts = max(start_ts, tail_start) if start_ts is not None else tail_start
+
+    with stage("load_data") as rec:
+        if feature_state_path:
+            state, station_df, group_df = advance_feature_state(
+                load_feature_state(feature_state_path),
+                db_path,
+                start_ts=start_ts,
+                end_ts=end_ts,
+                target_cache=target_cache,
+                group_ring=group_ring,
+            )
+            save_feature_state(feature_state_path, state)
+        else:
+            loaded = load_data(
+                db_path, start_ts=start_ts, end_ts=end_ts, target_cache=target_cache, group_ring=group_ring
+            )
+            station_df, group_df = loaded.station_df, loaded.group_df
+        rec["rows"] = int(len(group_df))
+    return station_df, group_df
+
+
+def predict_from_frames(
+    artifacts: Dict[str, Any],
+    model_path: str,
+    station_df: pd.DataFrame,
+    group_df: pd.DataFrame,
+    feature_engine: str = "pandas",
+    include_features: bool = False,
+    feature_path: str = "full",
+    workers: int = 1,
+) -> Dict[str, Any]:
+    station_feature_cols = list(artifacts.get("station_feature_cols") or [])
+    group_feature_cols = list(artifacts.get("group_feature_cols") or [])
 
-    if group_feature_cols:
-        group_feat_df = _ensure_columns(group_feat_df, group_feature_cols)
+    if feature_path == "latest":
+        with stage("latest_features") as rec:
+            station_x_df, group_x_df, latest_ts = latest_features_direct(
+                station_df, group_df, station_feature_cols or None, group_feature_cols or None
+            )
+            rec["rows"] = int(len(group_x_df))
+        station_now_df = station_x_df
+        if not station_feature_cols:
+            station_feature_cols = [c for c in station_x_df.columns if c != "ts" and c not in STATION_BASE_COLS]
+        if not group_feature_cols:
+            group_feature_cols = [c for c in group_x_df.columns if c != "ts"]
+        station_x_df = _ensure_columns(station_x_df, station_feature_cols)
+        group_x_df = _ensure_columns(group_x_df, group_feature_cols)
     else:
-        group_feature_cols = group_feature_cols_runtime
-
-    station_x_df, group_x_df, latest_ts = latest_features_for_inference(
-        station_feat_df,
-        group_feat_df,
-        station_feature_cols,
-        group_feature_cols,
-    )
+        with stage("station_features") as rec:
+            station_feat_df, station_feature_cols_runtime = build_station_features(
+                station_df, group_df, feature_cols=station_feature_cols or None
+            )
+            rec["rows"] = int(len(station_feat_df))
+        with stage("group_features") as rec:
+            group_feat_df, group_feature_cols_runtime = build_group_features(
+                station_feat_df,
+                group_df,
+                engine=feature_engine,
+                workers=workers,
+                feature_cols=group_feature_cols or None,
+            )
+            rec["rows"] = int(len(group_feat_df))
+
+        # Enforce feature schema from training artifacts to avoid X feature-count mismatch.
+        # If columns are missing (e.g. due to short history), add them as NaN.
+        if station_feature_cols:
+            station_feat_df = _ensure_columns(station_feat_df, station_feature_cols)
+        else:
+            station_feature_cols = station_feature_cols_runtime
+
+        if group_feature_cols:
+            group_feat_df = _ensure_columns(group_feat_df, group_feature_cols)
+        else:
+            group_feature_cols = group_feature_cols_runtime
+
+        station_x_df, group_x_df, latest_ts = latest_features_for_inference(
+            station_feat_df,
+            group_feat_df,
+            station_feature_cols,
+            group_feature_cols,
+        )
+        station_now_df = station_feat_df[station_feat_df["ts"] == latest_ts]
 
     out: Dict[str, Any] = {
         "ts": latest_ts,
@@ -94,7 +245,7 @@ def main() -> int:
         "modelInfo": {
             "trainedAtMs": int(artifacts.get("trained_at_ms") or 0),
             "dbPath": str(artifacts.get("db_path") or ""),
-            "modelPath": os.path.abspath(args.model),
+            "modelPath": os.path.abspath(model_path),
             "stationFeatureCols": list(artifacts.get("station_feature_cols") or []),
             "groupFeatureCols": list(artifacts.get("group_feature_cols") or []),
             "metrics": artifacts.get("metrics") or {},
@@ -102,7 +253,7 @@ def main() -> int:
     }
 
     if not station_x_df.empty:
-        station_now = float(station_feat_df[station_feat_df["ts"] == latest_ts]["stationTargetPowerKw"].tail(1).iloc[0])
+        station_now = float(station_now_df["stationTargetPowerKw"].tail(1).iloc[0])
         out["station"]["targetPowerKw"]["now"] = _to_py(station_now)
 
         x_station = station_x_df[station_feature_cols].to_numpy(dtype=float)
@@ -114,29 +265,19 @@ def main() -> int:
             pred = float(model.predict(x_station)[0])
             out["station"]["targetPowerKw"]["pred"][h_key] = _to_py(pred)
 
-        out["features"]["station"] = {
-            k: _to_py(float(station_x_df[k].iloc[0])) if k in station_x_df.columns else None
-            for k in station_feature_cols
-        }
+        if include_features:
+            out["features"]["station"] = {
+                k: _to_py(float(station_x_df[k].iloc[0])) if k in station_x_df.columns else None
+                for k in station_feature_cols
+            }
 
     if not group_x_df.empty:
         x_group = group_x_df[group_feature_cols].to_numpy(dtype=float)
         gids = group_x_df["groupId"].to_numpy(dtype=int)
 
-        fault_probs_by_h: Dict[str, np.ndarray] = {}
-        warn_probs_by_h: Dict[str, np.ndarray] = {}
-        for h_key in HORIZONS_MS.keys():
-            clf_fault = (artifacts.get("models") or {}).get("fault", {}).get(h_key)
-            if clf_fault is None:
-                fault_probs_by_h[h_key] = np.full(len(gids), np.nan)
-            else:
-                fault_probs_by_h[h_key] = clf_fault.predict_proba(x_group)[:, 1]
-
-            clf_warn = (artifacts.get("models") or {}).get("warning", {}).get(h_key)
-            if clf_warn is None:
-                warn_probs_by_h[h_key] = np.full(len(gids), np.nan)
-            else:
-                warn_probs_by_h[h_key] = clf_warn.predict_proba(x_group)[:, 1]
+        with stage("predict_groups") as rec:
+            group_preds_by_h, fault_probs_by_h, warn_probs_by_h = predict_groups(artifacts, x_group)
+            rec["rows"] = int(len(x_group))
 
         for i, gid in enumerate(gids):
             bms_item: Dict[str, Any] = {
@@ -150,20 +291,12 @@ def main() -> int:
             }
 
             for h_key in HORIZONS_MS.keys():
-                models_group = (artifacts.get("models") or {}).get("group", {}).get(h_key, {})
-                for col, out_key in [
-                    ("bms_socPct", "socPct"),
-                    ("bms_temperatureC", "temperatureC"),
-                    ("bms_insulationResistanceKohm", "insulationResistanceKohm"),
-                    ("bms_deltaCellVoltageMv", "deltaCellVoltageMv"),
-                    ("pcs_actualKw", "pcsActualKw"),
-                ]:
-                    m = models_group.get(col)
-                    if m is None:
+                for col, out_key in GROUP_TARGET_KEYS:
+                    preds = group_preds_by_h[h_key].get(col)
+                    if preds is None:
                         bms_item[out_key]["pred"][h_key] = None
                         continue
-                    pred = float(m.predict(x_group[i : i + 1])[0])
-                    bms_item[out_key]["pred"][h_key] = _to_py(pred)
+                    bms_item[out_key]["pred"][h_key] = _to_py(float(preds[i]))
 
                 fp = float(fault_probs_by_h[h_key][i])
                 wp = float(warn_probs_by_h[h_key][i])
@@ -172,10 +305,11 @@ def main() -> int:
 
             out["bms"][str(gid)] = bms_item
 
-            out["features"]["groups"][str(gid)] = {
-                k: _to_py(float(group_x_df[k].iloc[i])) if k in group_x_df.columns else None
-                for k in group_feature_cols
-            }
+        if include_features:
+            for i, gid in enumerate(gids):
+                out["features"]["groups"][str(gid)] = {
+                    k: _to_py(float(v)) for k, v in zip(group_feature_cols, x_group[i])
+                }
 
         for h_key in HORIZONS_MS.keys():
             ps = fault_probs_by_h[h_key]
@@ -200,13 +334,191 @@ def main() -> int:
                 out["macro"]["expectedWarnedGroups"][h_key] = _to_py(exp_w)
                 out["macro"]["probAnyWarning"][h_key] = _to_py(prob_any_w)
 
-    os.makedirs(os.path.dirname(args.out), exist_ok=True)
-    with open(args.out, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False)
+    return out
+
+
+def write_output(path: str, out: Dict[str, Any], fmt: str = "json", bin_path: Optional[str] = None) -> None:
+    # Both formats are written to a temp file and renamed, so readers never
+    # see a partial file.
+    with stage("write"):
+        if fmt in ("json", "both"):
+            write_prediction_json(path, out)
+        if fmt in ("bin", "both"):
+            write_prediction_bin(bin_path or f"{os.path.splitext(path)[0]}.bin", out)
+
 
-    print(json.dumps({"ok": True, "path": args.out, "ts": latest_ts}, ensure_ascii=False))
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
+    ap.add_argument(
+        "--model",
+        default=os.path.join("train", "artifacts", "model.joblib"),
+        help="model.joblib, or the model.npz train.py writes next to it (loads without scikit-learn)",
+    )
+    ap.add_argument("--out", default=os.path.join("server", "data", "predictions-latest.json"))
+    ap.add_argument("--window-hours", type=float, default=12.0)
+    ap.add_argument(
+        "--feature-state",
+        default=None,
+        help="Incremental feature state file; when set only rows near or past its watermark are loaded",
+    )
+    ap.add_argument("--feature-engine", choices=["pandas", "numpy"], default="pandas")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for the per-group rolling features")
+    ap.add_argument(
+        "--feature-path",
+        choices=["full", "latest"],
+        default="full",
+        help="full: features for every row in the window; latest: read the trailing 5 minutes and compute "
+        "features for the latest rows only (latency independent of --window-hours)",
+    )
+    ap.add_argument(
+        "--format",
+        choices=["json", "bin", "both"],
+        default="json",
+        help="json: nested predictions JSON; bin: columnar binary file (see prediction_io.py)",
+    )
+    ap.add_argument("--bin-out", default=None, help="Binary output path (default: --out with a .bin suffix)")
+    ap.add_argument("--include-features", action="store_true", help="Also dump every model input feature")
+    ap.add_argument("--target-cache", default=None, help="SQLite file caching stationTargetPowerKw per ts; filled incrementally from the coordination snapshots")
+    ap.add_argument(
+        "--group-ring",
+        default=None,
+        help="Ring file kept warm by ingest_sink.py; group rows are read from it instead of SQLite when it covers the window",
+    )
+    ap.add_argument(
+        "--prediction-log",
+        default=None,
+        help="Append every run's forecasts to this SQLite file (see prediction_log.py)",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store_true",
+        help="Add wall/CPU time, rows and peak RSS of every stage to the output (and to each served response)",
+    )
+    ap.add_argument("--profile-out", default=None, help="Write the stage profile JSON of each run to this file")
+    ap.add_argument("--cprofile-out", default=None, help="Dump cProfile stats of the run to this file (not with --serve)")
+    ap.add_argument("--serve", action="store_true", help="Run as a daemon serving predictions over HTTP")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    recorder = StageRecorder(enabled=bool(args.profile or args.profile_out))
+    with recording(recorder), cprofile_to(args.cprofile_out):
+        with stage("load_model"):
+            artifacts = load_artifacts(args.model)
+        out, logged_rows = run_prediction(args, artifacts, args.model)
+
+    result: Dict[str, Any] = {"ok": True, "path": args.out, "ts": out["ts"]}
+    if args.format != "json":
+        result["binPath"] = args.bin_out or f"{os.path.splitext(args.out)[0]}.bin"
+    if args.prediction_log:
+        result["loggedRows"] = logged_rows
+    profile = _finish_profile(args, recorder)
+    if profile is not None:
+        result["profile"] = profile
+    print(json.dumps(result, ensure_ascii=False))
     return 0
 
 
+def run_prediction(args: argparse.Namespace, artifacts: Dict[str, Any], model_path: str) -> Tuple[Dict[str, Any], int]:
+    """One load -> features -> predict -> write (-> log) pass; returns the output and logged rows."""
+
+    station_df, group_df = load_frames(
+        args.db, args.window_hours, args.feature_state, args.feature_path, args.target_cache, args.group_ring
+    )
+    out = predict_from_frames(
+        artifacts,
+        model_path,
+        station_df,
+        group_df,
+        args.feature_engine,
+        args.include_features,
+        args.feature_path,
+        args.workers,
+    )
+    write_output(args.out, out, args.format, args.bin_out)
+    logged_rows = 0
+    if args.prediction_log:
+        with stage("prediction_log") as rec:
+            logged_rows = append_predictions(args.prediction_log, out)
+            rec["rows"] = logged_rows
+    return out, logged_rows
+
+
+def _finish_profile(args: argparse.Namespace, recorder: StageRecorder) -> Optional[Dict[str, Any]]:
+    # The profile for --profile output; also written to --profile-out.
+    if not recorder.enabled:
+        return None
+    profile = recorder.profile()
+    if args.profile_out:
+        write_profile(args.profile_out, profile)
+    return profile if args.profile else None
+
+
+def serve(args: argparse.Namespace) -> int:
+    cache = ModelCache(args.model)
+    cache.get()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            path = self.path.split("?", 1)[0]
+            if path == "/health":
+                self._send_json(
+                    200,
+                    {
+                        "ok": True,
+                        "modelPath": os.path.abspath(cache.path),
+                        "modelLoadedAtMs": cache.loaded_at_ms,
+                    },
+                )
+                return
+            if path != "/predict":
+                self._send_json(404, {"ok": False, "error": "not found"})
+                return
+            try:
+                # One prediction at a time: the feature state file is not safe
+                # for concurrent writers.
+                with lock:
+                    recorder = StageRecorder(enabled=bool(args.profile or args.profile_out))
+                    with recording(recorder):
+                        with stage("load_model"):
+                            artifacts = cache.get()
+                        out, _logged_rows = run_prediction(args, artifacts, cache.path)
+                    profile = _finish_profile(args, recorder)
+            except Exception as e:
+                self._send_json(500, {"ok": False, "error": str(e)})
+                return
+            if profile is not None:
+                out = dict(out, profile=profile)
+            self._send_json(200, out)
+
+        def log_message(self, format: str, *log_args: Any) -> None:
+            pass
+
+    httpd = HTTPServer((args.host, args.port), Handler)
+    print(
+        json.dumps({"ok": True, "serving": f"http://{args.host}:{httpd.server_address[1]}"}, ensure_ascii=False),
+        flush=True,
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
 if __name__ == "__main__":
     raise SystemExit(main())
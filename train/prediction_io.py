@@ -0,0 +1,216 @@
+"""Prediction file formats written by predict.py.
+
+The binary format is one file:
+
+    MAGIC (8 bytes) | header length (uint64 LE) | JSON header | arrays
+
+The header holds the scalar fields plus, for every array, its dtype, shape and
+byte offset from the start of the array block (each array is 8-byte aligned).
+Arrays are little-endian and C-ordered:
+
+    groupIds        int64   [groups]
+    bms             float64 [groups, horizons, targets]   NaN = no prediction
+    station         float64 [horizons]                     targetPowerKw pred
+    groupFeatures   float64 [groups, groupFeatureCols]     only with features
+    stationFeatures float64 [stationFeatureCols]           only with features
+
+read_prediction_bin() rebuilds the same nested dict as the JSON output.
+"""
+
+import json
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+MAGIC = b"ESPRED01"
+FORMAT_VERSION = 1
+
+# Order of the last axis of the "bms" array; keys of each per-group bms item.
+BMS_TARGETS: List[str] = [
+    "socPct",
+    "temperatureC",
+    "insulationResistanceKohm",
+    "deltaCellVoltageMv",
+    "pcsActualKw",
+    "faultProbability",
+    "warningProbability",
+]
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """Write via a temp file in the same directory and rename it over path."""
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_prediction_json(path: str, out: Dict[str, Any]) -> None:
+    atomic_write_bytes(path, json.dumps(out, ensure_ascii=False).encode("utf-8"))
+
+
+def _nan_if_none(v: Any) -> float:
+    return float("nan") if v is None else float(v)
+
+
+def _none_if_nan(v: float) -> Optional[float]:
+    return None if v != v else float(v)
+
+
+def encode_prediction_bin(out: Dict[str, Any]) -> bytes:
+    horizons: List[str] = list(out.get("horizons") or [])
+    bms: Dict[str, Any] = out.get("bms") or {}
+    gids = list(bms.keys())
+
+    bms_arr = np.full((len(gids), len(horizons), len(BMS_TARGETS)), np.nan)
+    for i, gid in enumerate(gids):
+        item = bms[gid]
+        for k, target in enumerate(BMS_TARGETS):
+            pred = (item.get(target) or {}).get("pred") or {}
+            for j, h_key in enumerate(horizons):
+                bms_arr[i, j, k] = _nan_if_none(pred.get(h_key))
+
+    station_pred = ((out.get("station") or {}).get("targetPowerKw") or {}).get("pred") or {}
+    arrays: List[Tuple[str, np.ndarray]] = [
+        ("groupIds", np.array([int(g) for g in gids], dtype="<i8")),
+        ("bms", bms_arr.astype("<f8")),
+        ("station", np.array([_nan_if_none(station_pred.get(h)) for h in horizons], dtype="<f8")),
+    ]
+
+    features = out.get("features") or {}
+    model_info = dict(out.get("modelInfo") or {})
+    group_feature_cols = list(model_info.get("groupFeatureCols") or [])
+    station_feature_cols = list(model_info.get("stationFeatureCols") or [])
+    has_features = bool(features.get("groups") or features.get("station"))
+    if has_features:
+        group_feats = features.get("groups") or {}
+        gf = np.full((len(gids), len(group_feature_cols)), np.nan)
+        for i, gid in enumerate(gids):
+            row = group_feats.get(gid) or {}
+            gf[i] = [_nan_if_none(row.get(c)) for c in group_feature_cols]
+        station_feats = features.get("station") or {}
+        arrays.append(("groupFeatures", gf.astype("<f8")))
+        arrays.append(
+            ("stationFeatures", np.array([_nan_if_none(station_feats.get(c)) for c in station_feature_cols], dtype="<f8"))
+        )
+
+    layout: Dict[str, Dict[str, Any]] = {}
+    blobs: List[bytes] = []
+    offset = 0
+    for name, arr in arrays:
+        raw = np.ascontiguousarray(arr).tobytes()
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        pad = (-len(raw)) % 8
+        blobs.append(raw + b"\0" * pad)
+        offset += len(raw) + pad
+
+    header = {
+        "version": FORMAT_VERSION,
+        "ts": out.get("ts"),
+        "horizons": horizons,
+        "targets": BMS_TARGETS,
+        "stationNow": ((out.get("station") or {}).get("targetPowerKw") or {}).get("now"),
+        "macro": out.get("macro") or {},
+        "modelInfo": {
+            "trainedAtMs": model_info.get("trainedAtMs"),
+            "dbPath": model_info.get("dbPath"),
+            "modelPath": model_info.get("modelPath"),
+        },
+        "arrays": layout,
+    }
+    if has_features:
+        header["groupFeatureCols"] = group_feature_cols
+        header["stationFeatureCols"] = station_feature_cols
+    header_raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_raw += b" " * ((-(len(MAGIC) + 8 + len(header_raw))) % 8)
+    return b"".join([MAGIC, struct.pack("<Q", len(header_raw)), header_raw] + blobs)
+
+
+def write_prediction_bin(path: str, out: Dict[str, Any]) -> None:
+    atomic_write_bytes(path, encode_prediction_bin(out))
+
+
+def is_prediction_bin(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_prediction_arrays(path: str) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Header dict and the raw arrays of a binary prediction file."""
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a binary prediction file")
+    (header_len,) = struct.unpack_from("<Q", data, len(MAGIC))
+    start = len(MAGIC) + 8
+    header = json.loads(data[start : start + header_len].decode("utf-8"))
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported prediction file version in {path}")
+    base = start + header_len
+    arrays: Dict[str, np.ndarray] = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=base + spec["offset"]).reshape(spec["shape"])
+    return header, arrays
+
+
+def read_prediction_bin(path: str) -> Dict[str, Any]:
+    header, arrays = read_prediction_arrays(path)
+    horizons: List[str] = header["horizons"]
+    targets: List[str] = header["targets"]
+    gids = [str(int(g)) for g in arrays["groupIds"]]
+    bms_arr = arrays["bms"]
+
+    bms: Dict[str, Any] = {}
+    for i, gid in enumerate(gids):
+        bms[gid] = {
+            target: {"pred": {h_key: _none_if_nan(bms_arr[i, j, k]) for j, h_key in enumerate(horizons)}}
+            for k, target in enumerate(targets)
+        }
+
+    features: Dict[str, Any] = {"station": {}, "groups": {}}
+    if "groupFeatures" in arrays:
+        cols = header.get("groupFeatureCols") or []
+        for i, gid in enumerate(gids):
+            features["groups"][gid] = {c: _none_if_nan(v) for c, v in zip(cols, arrays["groupFeatures"][i])}
+        features["station"] = {
+            c: _none_if_nan(v) for c, v in zip(header.get("stationFeatureCols") or [], arrays["stationFeatures"])
+        }
+
+    return {
+        "ts": header.get("ts"),
+        "horizons": horizons,
+        "station": {
+            "targetPowerKw": {
+                "now": header.get("stationNow"),
+                "pred": {h_key: _none_if_nan(v) for h_key, v in zip(horizons, arrays["station"])},
+            }
+        },
+        "bms": bms,
+        "macro": header.get("macro") or {},
+        "features": features,
+        "modelInfo": header.get("modelInfo") or {},
+    }
+
+
+def read_prediction(path: str) -> Dict[str, Any]:
+    """Load a prediction file in either format."""
+
+    if is_prediction_bin(path):
+        return read_prediction_bin(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
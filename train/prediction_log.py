@@ -0,0 +1,196 @@
+"""Append-only prediction history for backtesting.
+
+Every predict.py run can append its forecasts to a separate SQLite file (the
+server's DB stays read-only for the Python side). One row per
+(ts, groupId, horizon, target) in a WITHOUT ROWID table clustered on that key,
+so a row is a handful of integers plus one REAL and time-range reads are a
+single index range scan. Station forecasts use groupId -1.
+
+realized_vs_predicted() joins a ts range of the log against what actually
+happened, using the same label definitions as training (build_labels and
+add_station_targets_by_horizon). The primary key is the only index: appends
+stay one B-tree insert per row, and per-group questions scan a ts range.
+"""
+
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common import GROUP_TARGET_COLS, HORIZONS_MS, add_station_targets_by_horizon, build_labels, load_data
+from prediction_io import BMS_TARGETS
+
+
+STATION_GROUP_ID = -1
+STATION_TARGET = "targetPowerKw"
+
+# Stored target codes; only ever append to this list.
+TARGETS: List[str] = BMS_TARGETS + [STATION_TARGET]
+TARGET_CODES: Dict[str, int] = {name: code for code, name in enumerate(TARGETS)}
+
+# Target name -> training label column prefix (label column is f"y_{prefix}_{h}").
+LABEL_PREFIXES: Dict[str, str] = {
+    "socPct": "bms_socPct",
+    "temperatureC": "bms_temperatureC",
+    "insulationResistanceKohm": "bms_insulationResistanceKohm",
+    "deltaCellVoltageMv": "bms_deltaCellVoltageMv",
+    "pcsActualKw": "pcs_actualKw",
+    "faultProbability": "fault",
+    "warningProbability": "warning",
+    STATION_TARGET: "stationTargetPowerKw",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction_targets (
+    code INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS prediction_log (
+    ts INTEGER NOT NULL,
+    group_id INTEGER NOT NULL,
+    horizon_ms INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (ts, group_id, horizon_ms, target)
+) WITHOUT ROWID;
+"""
+
+
+def open_prediction_log(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(_SCHEMA)
+    conn.executemany(
+        "INSERT OR IGNORE INTO prediction_targets(code, name) VALUES (?, ?)",
+        [(code, name) for name, code in TARGET_CODES.items()],
+    )
+    conn.commit()
+    return conn
+
+
+def prediction_rows(out: Dict[str, Any]) -> List[Tuple[int, int, int, int, float]]:
+    """(ts, groupId, horizon_ms, target code, value) for every non-null forecast."""
+
+    ts = out.get("ts")
+    if not ts:
+        return []
+    ts = int(ts)
+    rows: List[Tuple[int, int, int, int, float]] = []
+    for gid, item in (out.get("bms") or {}).items():
+        for target in BMS_TARGETS:
+            pred = (item.get(target) or {}).get("pred") or {}
+            for h_key, v in pred.items():
+                if v is not None and h_key in HORIZONS_MS:
+                    rows.append((ts, int(gid), HORIZONS_MS[h_key], TARGET_CODES[target], float(v)))
+    station_pred = ((out.get("station") or {}).get(STATION_TARGET) or {}).get("pred") or {}
+    for h_key, v in station_pred.items():
+        if v is not None and h_key in HORIZONS_MS:
+            rows.append((ts, STATION_GROUP_ID, HORIZONS_MS[h_key], TARGET_CODES[STATION_TARGET], float(v)))
+    return rows
+
+
+def append_predictions(path: str, out: Dict[str, Any]) -> int:
+    """Append one prediction run in a single transaction; returns rows written.
+
+    Rows that already exist (same run logged twice) are left untouched.
+    """
+
+    rows = prediction_rows(out)
+    if not rows:
+        return 0
+    conn = open_prediction_log(path)
+    try:
+        with conn:
+            cur = conn.executemany(
+                "INSERT OR IGNORE INTO prediction_log(ts, group_id, horizon_ms, target, value) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def read_prediction_log(
+    path: str,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+    targets: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    where = []
+    args: List[Any] = []
+    if isinstance(start_ts, int):
+        where.append("ts >= ?")
+        args.append(start_ts)
+    if isinstance(end_ts, int):
+        where.append("ts <= ?")
+        args.append(end_ts)
+    if targets:
+        where.append(f"target IN ({','.join('?' for _ in targets)})")
+        args.extend(TARGET_CODES[t] for t in targets)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    conn = sqlite3.connect(path)
+    try:
+        df = pd.read_sql_query(
+            f"SELECT ts, group_id AS groupId, horizon_ms, target, value AS pred FROM prediction_log {where_sql} "
+            "ORDER BY ts ASC",
+            conn,
+            params=args,
+        )
+    finally:
+        conn.close()
+    names = np.array(TARGETS, dtype=object)
+    df["target"] = names[df["target"].to_numpy(dtype=np.int64)]
+    horizon_keys = {h_ms: h_key for h_key, h_ms in HORIZONS_MS.items()}
+    df["horizon"] = df["horizon_ms"].map(horizon_keys)
+    return df
+
+
+def realized_vs_predicted(
+    log_path: str,
+    db_path: str,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+    targets: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """Logged forecasts in [start_ts, end_ts] next to their realized values.
+
+    The realized value of a forecast made at ts for horizon h is the training
+    label of that row: the first snapshot at or after ts + h for the numeric
+    targets, and whether a fault/warning occurred in (ts, ts + h] for the
+    probabilities. It is NaN until the DB holds data past ts + h.
+    """
+
+    log = read_prediction_log(log_path, start_ts, end_ts, targets)
+    log["actual"] = np.nan
+    if log.empty:
+        log["error"] = np.nan
+        return log
+
+    lo = int(log["ts"].min())
+    hi = int(log["ts"].max()) + max(HORIZONS_MS.values())
+    loaded = load_data(db_path, start_ts=lo, end_ts=hi)
+    group_labels = build_labels(loaded.group_df, loaded.alarm_occurrences, HORIZONS_MS, GROUP_TARGET_COLS)
+    group_labels = group_labels.drop_duplicates(["groupId", "ts"], keep="last").set_index(["groupId", "ts"])
+    station_labels = add_station_targets_by_horizon(loaded.station_df, HORIZONS_MS, [LABEL_PREFIXES[STATION_TARGET]])
+    station_labels = station_labels.drop_duplicates("ts", keep="last").set_index("ts")
+    data_end = int(loaded.group_df["ts"].max()) if not loaded.group_df.empty else lo - 1
+
+    actual = np.full(len(log), np.nan)
+    for (target, h_key), idx in log.groupby(["target", "horizon"]).indices.items():
+        label_col = f"y_{LABEL_PREFIXES[target]}_{h_key}"
+        part = log.iloc[idx]
+        if target == STATION_TARGET:
+            vals = station_labels[label_col].reindex(part["ts"].to_numpy()).to_numpy(dtype=float)
+        else:
+            keys = pd.MultiIndex.from_arrays([part["groupId"].to_numpy(), part["ts"].to_numpy()])
+            vals = group_labels[label_col].reindex(keys).to_numpy(dtype=float)
+        # Fault/warning labels read 0 before the horizon has elapsed.
+        vals[part["ts"].to_numpy(dtype=np.int64) + HORIZONS_MS[h_key] > data_end] = np.nan
+        actual[idx] = vals
+    log["actual"] = actual
+    log["error"] = log["pred"] - log["actual"]
+    return log
@@ -0,0 +1,185 @@
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+
+_MB = 1024.0 * 1024.0
+
+
+def _proc_status_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def current_rss_bytes() -> Optional[int]:
+    kb = _proc_status_kb("VmRSS")
+    return kb * 1024 if kb is not None else None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    kb = _proc_status_kb("VmHWM")
+    if kb is not None:
+        return kb * 1024
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+    return None
+
+
+def children_peak_rss_bytes() -> Optional[int]:
+    # Largest peak of any waited-for child, e.g. the --jobs fit workers.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if peak <= 0:
+        return None
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's peak-RSS mark (Linux >= 4.0); False when unsupported."""
+
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _mb(v: Optional[int]) -> Optional[float]:
+    return round(v / _MB, 1) if v is not None else None
+
+
+class StageRecorder:
+    """Records wall time, CPU time, RSS and peak RSS for each pipeline stage.
+
+    Stages opened inside another stage are recorded as "outer/inner". When the
+    peak-RSS mark can be reset, peak_rss_mb of a top-level stage is the peak
+    inside it and that of a nested stage the peak since its top-level stage
+    began; otherwise it is the process peak so far (peak_scope says which).
+    Callers may add fields such as "rows" to the yielded record. A disabled
+    recorder only yields empty records.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.stages: List[Dict[str, Any]] = []
+        self._open: List[str] = []
+        self._peak_reset = False
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        rec: Dict[str, Any] = {"stage": "/".join(self._open + [name])}
+        if not self.enabled:
+            yield rec
+            return
+        if self._open:
+            peak_scope = "outer_stage" if self._peak_reset else "process"
+        else:
+            self._peak_reset = reset_peak_rss()
+            peak_scope = "stage" if self._peak_reset else "process"
+        self._open.append(name)
+        rss_before = current_rss_bytes()
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield rec
+        finally:
+            self._open.pop()
+            rss_after = current_rss_bytes()
+            rec["wall_s"] = time.perf_counter() - t0
+            rec["cpu_s"] = time.process_time() - c0
+            rec["rss_mb"] = _mb(rss_after)
+            rec["delta_rss_mb"] = (
+                _mb(rss_after - rss_before) if rss_before is not None and rss_after is not None else None
+            )
+            rec["peak_rss_mb"] = _mb(peak_rss_bytes())
+            rec["peak_scope"] = peak_scope
+            rec["children_peak_rss_mb"] = _mb(children_peak_rss_bytes())
+            self.stages.append(rec)
+
+    def report(self) -> List[Dict[str, Any]]:
+        return list(self.stages)
+
+    def profile(self) -> Dict[str, Any]:
+        """Stage records plus wall/CPU time and peak RSS since the recorder was created."""
+
+        return {
+            "wall_s": time.perf_counter() - self._wall0,
+            "cpu_s": time.process_time() - self._cpu0,
+            "peak_rss_mb": _mb(peak_rss_bytes()),
+            "stages": self.report(),
+        }
+
+
+_active: Optional[StageRecorder] = None
+
+
+@contextmanager
+def recording(recorder: StageRecorder) -> Iterator[StageRecorder]:
+    """Make recorder the target of stage() hooks for the duration of the block."""
+
+    global _active
+    previous = _active
+    _active = recorder
+    try:
+        yield recorder
+    finally:
+        _active = previous
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict[str, Any]]:
+    """Stage hook for library code; a no-op unless a recorder is active."""
+
+    recorder = _active
+    if recorder is None or not recorder.enabled:
+        yield {"stage": name}
+        return
+    with recorder.stage(name) as rec:
+        yield rec
+
+
+@contextmanager
+def cprofile_to(path: Optional[str]) -> Iterator[None]:
+    """Run the block under cProfile and dump pstats to path (no-op when None).
+
+    Inspect with `python -m pstats PATH` or snakeviz.
+    """
+
+    if not path:
+        yield
+        return
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        prof.dump_stats(path)
+
+
+def write_profile(path: str, profile: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
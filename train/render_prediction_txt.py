@@ -1,9 +1,10 @@
 import argparse
-import json
 import os
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
+from prediction_io import read_prediction
+
 
 def _fmt_dt(ts_ms: int) -> str:
     try:
@@ -90,12 +91,15 @@ def _health_flags(insu: Any, delta: Any, temp: Any) -> List[str]:
 
 def main() -> int:
     ap = argparse.ArgumentParser()
-    ap.add_argument("--json", default=os.path.join("server", "data", "predictions-latest.json"))
+    ap.add_argument(
+        "--json",
+        default=os.path.join("server", "data", "predictions-latest.json"),
+        help="predict.py output, either the JSON or the binary (.bin) format",
+    )
     ap.add_argument("--out", default=os.path.join("train", "prediction.txt"))
     args = ap.parse_args()
 
-    with open(args.json, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = read_prediction(args.json)
 
     ts = int(data.get("ts") or 0)
     horizons = list(data.get("horizons") or [])
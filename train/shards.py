@@ -0,0 +1,358 @@
+"""Streaming feature/label builder for training windows larger than RAM.
+
+The window is processed in ts-ordered chunks. Each chunk reads only the rows
+newer than what is already buffered, builds features and labels over the
+buffer, and writes the rows of its core [chunk_start, chunk_end) as .npy parts.
+The buffer then keeps RETAIN_MS of rows before the next core (rolling-window
+context) plus everything after it that was read as label lookahead, so every
+row is read from SQLite once. Parts are finally concatenated on disk into one
+.npy per array that train.py --shards memory-maps.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common import (
+    GROUP_TARGET_COLS,
+    HORIZONS_MS,
+    STATION_TARGET_COLS,
+    add_station_targets_by_horizon,
+    build_group_features,
+    build_labels,
+    build_station_features,
+    connect_readonly,
+    load_data,
+)
+from feature_store import RETAIN_MS, _append_rows
+from profiling import stage
+
+
+SHARDS_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+_RANGE_TABLES = [
+    "telemetry",
+    "system_status",
+    "alarm_snapshots",
+    "coordination_units_snapshots",
+    "battery_groups_snapshots",
+]
+
+
+def label_frames(
+    station_feat_df: pd.DataFrame,
+    group_feat_df: pd.DataFrame,
+    alarm_occurrences: pd.DataFrame,
+    group_targets: List[str],
+    station_targets: List[str],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    with stage("group_labels") as rec:
+        group_all = build_labels(group_feat_df, alarm_occurrences, HORIZONS_MS, group_targets)
+        rec["rows"] = int(len(group_all))
+    with stage("station_targets") as rec:
+        station_all = add_station_targets_by_horizon(station_feat_df, HORIZONS_MS, station_targets)
+        rec["rows"] = int(len(station_all))
+    return station_all, group_all
+
+
+def training_arrays(
+    station_all: pd.DataFrame,
+    group_all: pd.DataFrame,
+    station_feature_cols: List[str],
+    group_feature_cols: List[str],
+    group_targets: List[str],
+    x_dtype: Any = np.float64,
+) -> Dict[str, np.ndarray]:
+    arrays: Dict[str, np.ndarray] = {
+        "station_ts": station_all["ts"].to_numpy(dtype=np.int64),
+        "station_x": station_all[station_feature_cols].to_numpy(dtype=x_dtype),
+        "group_ts": group_all["ts"].to_numpy(dtype=np.int64),
+        "group_x": group_all[group_feature_cols].to_numpy(dtype=x_dtype),
+    }
+    for h_key in HORIZONS_MS.keys():
+        arrays[f"y_station_{h_key}"] = station_all[f"y_stationTargetPowerKw_{h_key}"].to_numpy(dtype=float)
+        for col in group_targets:
+            arrays[f"y_{col}_{h_key}"] = group_all[f"y_{col}_{h_key}"].to_numpy(dtype=float)
+        arrays[f"y_fault_{h_key}"] = group_all[f"y_fault_{h_key}"].to_numpy(dtype=int)
+        arrays[f"y_warning_{h_key}"] = group_all[f"y_warning_{h_key}"].to_numpy(dtype=int)
+    arrays["group_mask_all"] = np.isfinite(arrays["group_x"]).all(axis=1)
+    return arrays
+
+
+def _data_ts_range(db_path: str) -> Optional[Tuple[int, int]]:
+    conn = connect_readonly(db_path)
+    try:
+        lo: Optional[int] = None
+        hi: Optional[int] = None
+        for table in _RANGE_TABLES:
+            row = conn.execute(f"SELECT MIN(ts), MAX(ts) FROM {table}").fetchone()
+            if row is None or row[0] is None:
+                continue
+            lo = int(row[0]) if lo is None else min(lo, int(row[0]))
+            hi = int(row[1]) if hi is None else max(hi, int(row[1]))
+    finally:
+        conn.close()
+    if lo is None or hi is None:
+        return None
+    return lo, hi
+
+
+def _is_shard_dir(path: str) -> bool:
+    # An earlier build holds only manifest.json, the <array>.npy files and,
+    # when it was interrupted, parts/.
+    entries = os.listdir(path)
+    if MANIFEST_NAME not in entries and "parts" not in entries:
+        return False
+    for name in entries:
+        full = os.path.join(path, name)
+        if name == "parts":
+            if not os.path.isdir(full) or any(not n.endswith(".npy") for n in os.listdir(full)):
+                return False
+        elif name != MANIFEST_NAME and not (name.endswith(".npy") and os.path.isfile(full)):
+            return False
+    return True
+
+
+def _prepare_out_dir(out_dir: str, overwrite: bool) -> None:
+    if os.path.isdir(out_dir) and os.listdir(out_dir):
+        if not (overwrite or _is_shard_dir(out_dir)):
+            raise ValueError(f"{out_dir} is not empty and not a shard build; pass overwrite=True to replace it")
+        shutil.rmtree(out_dir)
+    elif os.path.exists(out_dir) and not os.path.isdir(out_dir):
+        raise ValueError(f"{out_dir} exists and is not a directory")
+    os.makedirs(os.path.join(out_dir, "parts"), exist_ok=True)
+
+
+def _trim(df: pd.DataFrame, keep_from: int) -> pd.DataFrame:
+    if df.empty:
+        return df
+    return df[df["ts"] >= keep_from].reset_index(drop=True)
+
+
+def _part_path(out_dir: str, name: str, k: int) -> str:
+    return os.path.join(out_dir, "parts", f"{name}-{k:05d}.npy")
+
+
+def _concat_parts(out_dir: str, names: List[str], n_parts: int) -> Dict[str, Dict[str, Any]]:
+    # Disk-to-disk concatenation: one part is in memory at a time.
+    info: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        parts = [np.load(_part_path(out_dir, name, k), mmap_mode="r") for k in range(n_parts)]
+        rows = sum(p.shape[0] for p in parts)
+        shape = (rows,) + tuple(parts[0].shape[1:])
+        dst = np.lib.format.open_memmap(
+            os.path.join(out_dir, f"{name}.npy"), mode="w+", dtype=parts[0].dtype, shape=shape
+        )
+        pos = 0
+        for p in parts:
+            dst[pos : pos + p.shape[0]] = p
+            pos += p.shape[0]
+        dst.flush()
+        del dst
+        info[name] = {"dtype": str(parts[0].dtype), "shape": list(shape)}
+        del parts
+    return info
+
+
+def build_shards(
+    db_path: str,
+    out_dir: str,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+    chunk_ms: int = 6 * 60 * 60_000,
+    feature_engine: str = "pandas",
+    compact: bool = False,
+    group_targets: Optional[List[str]] = None,
+    target_cache: Optional[str] = None,
+    workers: int = 1,
+    overwrite: bool = False,
+) -> Dict[str, Any]:
+    """Build feature/label arrays for [start_ts, end_ts] chunk by chunk.
+
+    Returns the manifest that is also written to out_dir/manifest.json.
+    Rolling features only see RETAIN_MS of history at a chunk start, the same
+    trade-off as the incremental feature state in predict.py. An existing
+    out_dir is replaced only when it is empty or an earlier shard build,
+    unless overwrite is set.
+    """
+
+    group_targets = list(group_targets or GROUP_TARGET_COLS)
+    ts_range = _data_ts_range(db_path)
+    if ts_range is None:
+        raise ValueError(f"no rows in {db_path}")
+    lo, hi = ts_range
+    if isinstance(start_ts, int):
+        lo = max(lo, start_ts)
+    if isinstance(end_ts, int):
+        hi = min(hi, end_ts)
+    if lo > hi:
+        raise ValueError("empty ts window")
+
+    _prepare_out_dir(out_dir, overwrite)
+
+    lookahead_ms = max(HORIZONS_MS.values())
+    x_dtype = np.float32 if compact else np.float64
+    station_df = pd.DataFrame()
+    group_df = pd.DataFrame()
+    alarm_occurrences = pd.DataFrame()
+    read_upto = lo - 1
+    station_feature_cols: List[str] = []
+    group_feature_cols: List[str] = []
+    names: List[str] = []
+    chunks: List[Dict[str, Any]] = []
+    n_parts = 0
+
+    for core_start in range(lo, hi + 1, chunk_ms):
+        core_end = min(core_start + chunk_ms, hi + 1)
+        read_end = min(core_end - 1 + lookahead_ms, hi)
+        if read_end > read_upto:
+            loaded = load_data(
+                db_path, start_ts=read_upto + 1, end_ts=read_end, compact=compact, target_cache=target_cache
+            )
+            station_df = _append_rows(station_df, loaded.station_df)
+            group_df = _append_rows(group_df, loaded.group_df)
+            # Each read returns alarms up to its end + lookahead_ms; keep only
+            # the part the previous read did not already cover.
+            new_alarms = loaded.alarm_occurrences
+            if not alarm_occurrences.empty and not new_alarms.empty:
+                new_alarms = new_alarms[new_alarms["ts"] > read_upto + lookahead_ms]
+            alarm_occurrences = _append_rows(alarm_occurrences, new_alarms)
+            read_upto = read_end
+
+        keep_from = core_end - RETAIN_MS
+        has_core = (group_df["ts"] >= core_start).any() if not group_df.empty else False
+        if station_df.empty or not has_core:
+            # Gap in the data: nothing to emit for this core.
+            station_df, group_df = _trim(station_df, keep_from), _trim(group_df, keep_from)
+            alarm_occurrences = _trim(alarm_occurrences, keep_from)
+            continue
+
+        station_feat_df, s_cols = build_station_features(station_df, group_df, compact=compact)
+        group_feat_df, g_cols = build_group_features(
+            station_feat_df, group_df, engine=feature_engine, compact=compact, workers=workers
+        )
+        if not station_feature_cols:
+            station_feature_cols, group_feature_cols = s_cols, g_cols
+        elif (s_cols, g_cols) != (station_feature_cols, group_feature_cols):
+            raise RuntimeError("feature columns changed between chunks")
+
+        station_all, group_all = label_frames(
+            station_feat_df, group_feat_df, alarm_occurrences, group_targets, STATION_TARGET_COLS
+        )
+        station_all = station_all[(station_all["ts"] >= core_start) & (station_all["ts"] < core_end)]
+        group_all = group_all[(group_all["ts"] >= core_start) & (group_all["ts"] < core_end)]
+        arrays = training_arrays(
+            station_all, group_all, station_feature_cols, group_feature_cols, group_targets, x_dtype=x_dtype
+        )
+        names = list(arrays.keys())
+        for name, arr in arrays.items():
+            np.save(_part_path(out_dir, name, n_parts), arr)
+        n_parts += 1
+        chunks.append(
+            {
+                "ts_from": core_start,
+                "ts_to": core_end - 1,
+                "station_rows": int(len(station_all)),
+                "group_rows": int(len(group_all)),
+            }
+        )
+
+        station_df, group_df = _trim(station_df, keep_from), _trim(group_df, keep_from)
+        alarm_occurrences = _trim(alarm_occurrences, keep_from)
+
+    if n_parts == 0:
+        raise ValueError("no group rows in the ts window")
+    array_info = _concat_parts(out_dir, names, n_parts)
+    shutil.rmtree(os.path.join(out_dir, "parts"))
+
+    manifest: Dict[str, Any] = {
+        "version": SHARDS_VERSION,
+        "built_at_ms": int(time.time() * 1000),
+        "db_path": db_path,
+        "start_ts": lo,
+        "end_ts": hi,
+        "chunk_ms": chunk_ms,
+        "horizons_ms": HORIZONS_MS,
+        "compact": compact,
+        "feature_engine": feature_engine,
+        "group_targets": group_targets,
+        "station_feature_cols": station_feature_cols,
+        "group_feature_cols": group_feature_cols,
+        "arrays": array_info,
+        "chunks": chunks,
+    }
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_shards(shard_dir: str) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Manifest plus read-only memory-mapped arrays, keyed like train.py's arrays."""
+
+    with open(os.path.join(shard_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SHARDS_VERSION:
+        raise ValueError(f"unsupported shard version in {shard_dir}")
+    if manifest.get("horizons_ms") != HORIZONS_MS:
+        raise ValueError(f"shards in {shard_dir} were built for other horizons")
+    arrays = {
+        name: np.load(os.path.join(shard_dir, f"{name}.npy"), mmap_mode="r") for name in manifest["arrays"].keys()
+    }
+    return manifest, arrays
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
+    ap.add_argument("--out", default=os.path.join("train", "artifacts", "shards"))
+    ap.add_argument("--window-hours", type=float, default=12.0)
+    ap.add_argument("--chunk-hours", type=float, default=6.0)
+    ap.add_argument("--feature-engine", choices=["pandas", "numpy"], default="pandas")
+    ap.add_argument("--compact", action="store_true", help="Store features as float32")
+    ap.add_argument("--workers", type=int, default=1, help="Processes for the per-group rolling features")
+    ap.add_argument("--target-cache", default=None, help="SQLite file caching stationTargetPowerKw per ts; filled incrementally from the coordination snapshots")
+    ap.add_argument("--overwrite", action="store_true", help="Replace --out even when it is not an earlier shard build")
+    args = ap.parse_args()
+
+    start_ts = None
+    if args.window_hours and args.window_hours > 0:
+        start_ts = int(time.time() * 1000) - int(args.window_hours * 60 * 60 * 1000)
+    chunk_ms = max(int(args.chunk_hours * 60 * 60 * 1000), RETAIN_MS)
+
+    t0 = time.perf_counter()
+    manifest = build_shards(
+        args.db,
+        args.out,
+        start_ts=start_ts,
+        chunk_ms=chunk_ms,
+        feature_engine=args.feature_engine,
+        compact=args.compact,
+        target_cache=args.target_cache,
+        workers=args.workers,
+        overwrite=args.overwrite,
+    )
+    print(
+        json.dumps(
+            {
+                "ok": True,
+                "out": args.out,
+                "chunks": len(manifest["chunks"]),
+                "group_rows": manifest["arrays"]["group_x"]["shape"][0],
+                "station_rows": manifest["arrays"]["station_x"]["shape"][0],
+                "seconds": time.perf_counter() - t0,
+            },
+            ensure_ascii=False,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,312 @@
+"""Streaming predictor: a forecast for every new snapshot, pushed over SSE.
+
+An asyncio loop polls the newest battery_groups_snapshots / telemetry ts. When
+both tables have moved past the last watermark, one prediction pass runs in a
+worker thread: advance_feature_state (kept in memory) loads only the rows past
+(or just before) the watermark, the latest-row features are computed over
+the retained tail, and the batched models from predict.py run on that row. The
+result is the same JSON predict.py writes, plus a "stream" block with its
+latency.
+
+Backpressure: the tailer hands watermarks to the predictor through a queue of
+size 1 that keeps only the newest, so a slow pass coalesces the snapshots that
+arrived meanwhile instead of queueing them. Each subscriber has its own bounded
+queue; when it is full the oldest forecast is dropped (and counted), so a slow
+client never stalls the predictor or the other clients.
+
+Endpoints: GET /stream (text/event-stream), GET /latest, GET /health.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from common import connect_readonly, latest_window_start
+from feature_store import FeatureState, advance_feature_state
+from predict import ModelCache, predict_from_frames, write_output
+
+
+HEARTBEAT_S = 15.0
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _put_latest(q: "asyncio.Queue[Any]", item: Any) -> bool:
+    # Enqueue without blocking; on a full queue drop the oldest item. True if one was dropped.
+    dropped = False
+    if q.full():
+        q.get_nowait()
+        dropped = True
+    q.put_nowait(item)
+    return dropped
+
+
+class Broadcaster:
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.subscribers: Set["asyncio.Queue[Dict[str, Any]]"] = set()
+        self.published = 0
+        self.dropped = 0
+        self.latest: Optional[Dict[str, Any]] = None
+
+    def subscribe(self) -> "asyncio.Queue[Dict[str, Any]]":
+        q: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: "asyncio.Queue[Dict[str, Any]]") -> None:
+        self.subscribers.discard(q)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        self.latest = event
+        self.published += 1
+        for q in self.subscribers:
+            if _put_latest(q, event):
+                self.dropped += 1
+
+
+class LatencyStats:
+    """Rolling window of per-forecast latencies (ms)."""
+
+    def __init__(self, size: int) -> None:
+        self.records: Deque[Tuple[float, float, float]] = deque(maxlen=size)
+
+    def add(self, latency_ms: float, detect_ms: float, compute_ms: float) -> None:
+        self.records.append((latency_ms, detect_ms, compute_ms))
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.records:
+            return {"n": 0}
+        arr = np.array(self.records, dtype=float)
+        out: Dict[str, Any] = {"n": int(len(arr))}
+        for j, name in enumerate(["latencyMs", "detectMs", "computeMs"]):
+            col = arr[:, j]
+            out[name] = {
+                "p50": float(np.percentile(col, 50)),
+                "p95": float(np.percentile(col, 95)),
+                "max": float(col.max()),
+            }
+        return out
+
+
+class StreamPredictor:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.models = ModelCache(args.model)
+        self.broadcaster = Broadcaster(args.queue_size)
+        self.latency = LatencyStats(args.latency_window)
+        self.state: Optional[FeatureState] = None
+        self.seen_ts = -1
+        self.first_watermark: Optional[int] = None
+        self.published_ts = -1
+        self.coalesced = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def _db_watermark(self) -> Optional[int]:
+        # Newest ts both tables have; the feature state stops there as well.
+        conn = connect_readonly(self.args.db)
+        try:
+            groups_ts, telemetry_ts = conn.execute(
+                "SELECT (SELECT MAX(ts) FROM battery_groups_snapshots), (SELECT MAX(ts) FROM telemetry)"
+            ).fetchone()
+        finally:
+            conn.close()
+        if groups_ts is None or telemetry_ts is None:
+            return None
+        return int(min(groups_ts, telemetry_ts))
+
+    def _predict_once(self) -> Dict[str, Any]:
+        start_ts = None
+        if self.state is None:
+            start_ts = latest_window_start(self.args.db)
+        self.state, station_df, group_df = advance_feature_state(
+            self.state,
+            self.args.db,
+            start_ts=start_ts,
+            target_cache=self.args.target_cache,
+            group_ring=self.args.group_ring,
+        )
+        out = predict_from_frames(
+            self.models.get(), self.models.path, station_df, group_df, feature_path="latest"
+        )
+        if self.args.out and out.get("ts") is not None and out["ts"] != self.published_ts:
+            write_output(self.args.out, out)
+        return out
+
+    async def tail(self, pending: "asyncio.Queue[Tuple[int, int]]") -> None:
+        while True:
+            try:
+                watermark = await asyncio.to_thread(self._db_watermark)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"watermark: {e}"
+                watermark = None
+            if watermark is not None and watermark > self.seen_ts:
+                if self.first_watermark is None:
+                    self.first_watermark = watermark
+                self.seen_ts = watermark
+                if _put_latest(pending, (watermark, _now_ms())):
+                    self.coalesced += 1
+            await asyncio.sleep(self.args.poll_ms / 1000.0)
+
+    async def predict_loop(self, pending: "asyncio.Queue[Tuple[int, int]]") -> None:
+        while True:
+            watermark, detected_ms = await pending.get()
+            # The first pass catches up on rows that were already there; its
+            # "latency" is the age of the DB, not of the pipeline.
+            catch_up = self.published_ts < 0 and watermark == self.first_watermark
+            t0 = time.perf_counter()
+            try:
+                out = await asyncio.to_thread(self._predict_once)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                continue
+            compute_ms = 1000.0 * (time.perf_counter() - t0)
+            ts = out.get("ts")
+            if ts is None or ts == self.published_ts:
+                continue
+            self.published_ts = int(ts)
+            published_ms = _now_ms()
+            latency_ms = float(published_ms - ts)
+            detect_ms = float(detected_ms - ts)
+            out["stream"] = {
+                "snapshotTs": ts,
+                "detectedAtMs": detected_ms,
+                "publishedAtMs": published_ms,
+                "latencyMs": latency_ms,
+                "detectMs": detect_ms,
+                "computeMs": compute_ms,
+                "catchUp": catch_up,
+            }
+            if not catch_up:
+                self.latency.add(latency_ms, detect_ms, compute_ms)
+            self.broadcaster.publish(out)
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "ok": True,
+            "modelPath": os.path.abspath(self.models.path),
+            "modelLoadedAtMs": self.models.loaded_at_ms,
+            "watermarkTs": self.seen_ts if self.seen_ts >= 0 else None,
+            "publishedTs": self.published_ts if self.published_ts >= 0 else None,
+            "published": self.broadcaster.published,
+            "subscribers": len(self.broadcaster.subscribers),
+            "droppedForSlowSubscribers": self.broadcaster.dropped,
+            "coalescedSnapshots": self.coalesced,
+            "errors": self.errors,
+            "lastError": self.last_error,
+            "latency": self.latency.summary(),
+        }
+
+
+def _http_head(status: str, content_type: str, extra: str = "") -> bytes:
+    return (
+        f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nCache-Control: no-cache\r\n{extra}\r\n"
+    ).encode("ascii")
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: str, payload: Any) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        _http_head(status, "application/json; charset=utf-8", f"Content-Length: {len(body)}\r\nConnection: close\r\n")
+        + body
+    )
+    await writer.drain()
+
+
+async def _serve_stream(predictor: StreamPredictor, writer: asyncio.StreamWriter) -> None:
+    q = predictor.broadcaster.subscribe()
+    try:
+        writer.write(_http_head("200 OK", "text/event-stream; charset=utf-8", "Connection: keep-alive\r\n"))
+        if predictor.broadcaster.latest is not None:
+            _put_latest(q, predictor.broadcaster.latest)
+        while True:
+            try:
+                event = await asyncio.wait_for(q.get(), timeout=HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                writer.write(b": keep-alive\n\n")
+            else:
+                data = json.dumps(event, ensure_ascii=False)
+                writer.write(f"id: {event['ts']}\nevent: prediction\ndata: {data}\n\n".encode("utf-8"))
+            # Waits while the client's socket buffer is full; the bounded
+            # queue above absorbs (and drops) what arrives meanwhile.
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        predictor.broadcaster.unsubscribe(q)
+
+
+def make_handler(predictor: StreamPredictor):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+            if len(parts) < 2 or parts[0] != "GET":
+                await _send_json(writer, "405 Method Not Allowed", {"ok": False, "error": "GET only"})
+            elif path == "/stream":
+                await _serve_stream(predictor, writer)
+            elif path == "/latest":
+                latest = predictor.broadcaster.latest
+                if latest is None:
+                    await _send_json(writer, "503 Service Unavailable", {"ok": False, "error": "no prediction yet"})
+                else:
+                    await _send_json(writer, "200 OK", latest)
+            elif path == "/health":
+                await _send_json(writer, "200 OK", predictor.health())
+            else:
+                await _send_json(writer, "404 Not Found", {"ok": False, "error": "not found"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def run(args: argparse.Namespace) -> None:
+    predictor = StreamPredictor(args)
+    await asyncio.to_thread(predictor.models.get)
+    pending: "asyncio.Queue[Tuple[int, int]]" = asyncio.Queue(maxsize=1)
+    server = await asyncio.start_server(make_handler(predictor), args.host, args.port)
+    port = server.sockets[0].getsockname()[1]
+    print(json.dumps({"ok": True, "streaming": f"http://{args.host}:{port}/stream"}), flush=True)
+    async with server:
+        await asyncio.gather(server.serve_forever(), predictor.tail(pending), predictor.predict_loop(pending))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
+    ap.add_argument("--model", default=os.path.join("train", "artifacts", "model.joblib"))
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8767)
+    ap.add_argument("--poll-ms", type=float, default=250.0, help="How often to check the DB for new snapshots")
+    ap.add_argument("--queue-size", type=int, default=8, help="Forecasts buffered per subscriber before the oldest is dropped")
+    ap.add_argument("--latency-window", type=int, default=1000, help="Forecasts kept for the /health latency percentiles")
+    ap.add_argument("--out", default=None, help="Also write every forecast to this prediction JSON file")
+    ap.add_argument("--target-cache", default=None, help="SQLite file caching stationTargetPowerKw per ts")
+    ap.add_argument("--group-ring", default=None, help="Ring file kept warm by ingest_sink.py (SQLite when cold)")
+    args = ap.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,279 @@
+"""Synthetic energy-monitor.db generator for benchmarks.
+
+Writes the tables the train/ pipeline reads, with the same columns and ts
+indexes as server/db.ts. Group telemetry follows bounded random walks. Alarms
+come from the same insulation / cell-delta / cell-temperature thresholds as
+server/generator.ts, plus random ones at --alarm-rate. The BMS warning/fault
+counters track the active alarms, so every label type has positives.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+  ts INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS system_status (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL REFERENCES snapshots(ts) ON DELETE CASCADE,
+  status TEXT NOT NULL,
+  load INTEGER NOT NULL,
+  totalPower INTEGER NOT NULL,
+  runTime TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_system_status_ts ON system_status(ts);
+CREATE TABLE IF NOT EXISTS telemetry (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL REFERENCES snapshots(ts) ON DELETE CASCADE,
+  currentTime TEXT NOT NULL,
+  averageVoltage REAL NOT NULL,
+  totalCurrent REAL NOT NULL,
+  averageTemperature INTEGER NOT NULL,
+  systemSOC INTEGER NOT NULL,
+  systemSOH INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_telemetry_ts ON telemetry(ts);
+CREATE TABLE IF NOT EXISTS alarm_snapshots (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL REFERENCES snapshots(ts) ON DELETE CASCADE,
+  totalAlarms INTEGER NOT NULL,
+  criticalAlarms INTEGER NOT NULL,
+  warningAlarms INTEGER NOT NULL,
+  infoAlarms INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alarm_snapshots_ts ON alarm_snapshots(ts);
+CREATE TABLE IF NOT EXISTS alarm_occurrences (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL,
+  groupId INTEGER,
+  source TEXT NOT NULL,
+  device TEXT NOT NULL,
+  type TEXT NOT NULL,
+  level TEXT NOT NULL,
+  description TEXT NOT NULL,
+  status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alarm_occurrences_ts ON alarm_occurrences(ts DESC);
+CREATE INDEX IF NOT EXISTS idx_alarm_occurrences_group_ts ON alarm_occurrences(groupId, ts DESC);
+CREATE TABLE IF NOT EXISTS battery_groups_snapshots (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL REFERENCES snapshots(ts) ON DELETE CASCADE,
+  json TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_battery_groups_snapshots_ts ON battery_groups_snapshots(ts);
+CREATE TABLE IF NOT EXISTS coordination_units_snapshots (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL REFERENCES snapshots(ts) ON DELETE CASCADE,
+  json TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_coordination_units_snapshots_ts ON coordination_units_snapshots(ts);
+"""
+
+# Snapshots written per transaction.
+BATCH_SNAPSHOTS = 500
+
+# server/generator.ts emits at most one alarm per group every 20 s.
+ALARM_MIN_GAP_MS = 20_000
+
+
+def _group_alarms(
+    insulation: np.ndarray,
+    delta: np.ndarray,
+    cell_temp: np.ndarray,
+    random_hit: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, List[Tuple[int, str, str]]]:
+    """Warning/fault counts per group and one (type, level) candidate per group.
+
+    Thresholds and types follow server/generator.ts; a critical candidate wins
+    over a warning one.
+    """
+
+    checks = [
+        ("绝缘异常", insulation <= 150, "绝缘异常", insulation <= 260),
+        ("单体压差异常", delta >= 65, "单体压差异常", delta >= 45),
+        ("热失控", cell_temp >= 60, "温度异常", cell_temp >= 52),
+    ]
+    fault = np.zeros(len(insulation), dtype=np.int64)
+    warn = random_hit.astype(np.int64)
+    for _crit_type, is_crit, _warn_type, is_warn in checks:
+        fault += is_crit
+        warn += is_warn & ~is_crit
+
+    candidates: List[Tuple[int, str, str]] = []
+    for i in np.flatnonzero((fault > 0) | (warn > 0)):
+        picked = next(((t, "critical") for t, c, _w, _m in checks if c[i]), None)
+        if picked is None:
+            picked = next(((t, "warning") for _c, _m, t, w in checks if w[i]), ("通讯异常", "warning"))
+        candidates.append((int(i), picked[0], picked[1]))
+    return warn, fault, candidates
+
+
+def generate_db(
+    path: str,
+    groups: int = 16,
+    hours: float = 1.0,
+    step_ms: int = 1000,
+    alarm_rate: float = 0.0005,
+    end_ts: Optional[int] = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Create (or replace) a synthetic DB at path; returns row counts."""
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    end_ts = int(end_ts if end_ts is not None else time.time() * 1000) // step_ms * step_ms
+    n_snapshots = max(1, int(hours * 3600 * 1000) // step_ms)
+    tss = end_ts - (n_snapshots - 1) * step_ms + np.arange(n_snapshots, dtype=np.int64) * step_ms
+
+    soc = rng.uniform(30, 80, groups)
+    temp = rng.uniform(24, 30, groups)
+    insulation = rng.uniform(500, 900, groups)
+    delta = rng.uniform(15, 30, groups)
+    last_emit = np.full(groups, np.iinfo(np.int64).min // 2, dtype=np.int64)
+    dt_h = step_ms / 3_600_000.0
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(SCHEMA)
+
+    counts = {"snapshots": 0, "group_rows": 0, "alarm_occurrences": 0}
+    for batch_start in range(0, n_snapshots, BATCH_SNAPSHOTS):
+        snap_rows, tel_rows, status_rows, alarm_snap_rows = [], [], [], []
+        group_rows, coord_rows, occ_rows = [], [], []
+        for ts in tss[batch_start : batch_start + BATCH_SNAPSHOTS].tolist():
+            # Slow random walks; insulation and cell delta occasionally degrade
+            # into the alarm ranges and recover.
+            target_kw = float(np.clip(rng.normal(0, 60), -180, 180))
+            setpoint = np.full(groups, target_kw / max(1, groups) * 4)
+            actual = setpoint + rng.normal(0, 3, groups)
+            soc = np.clip(soc - actual * dt_h * 0.5 + rng.normal(0, 0.02, groups), 0, 100)
+            temp = np.clip(temp + 0.02 * (27 + np.abs(actual) / 20 - temp) + rng.normal(0, 0.05, groups), 10, 70)
+            insulation = np.clip(insulation + 0.001 * (750 - insulation) + rng.normal(0, 4, groups), 50, 1200)
+            delta = np.clip(delta + 0.001 * (22 - delta) + rng.normal(0, 0.4, groups), 5, 90)
+            cell_temp = temp + 4 + rng.normal(0, 0.3, groups)
+
+            warn, fault, events = _group_alarms(insulation, delta, cell_temp, rng.random(groups) < alarm_rate)
+            for i, alarm_type, level in events:
+                if ts - last_emit[i] < ALARM_MIN_GAP_MS:
+                    continue
+                last_emit[i] = ts
+                gid = i + 1
+                occ_rows.append((ts, gid, f"BMS-{gid}", f"BMS {gid}", alarm_type, level, "", "active"))
+
+            items = []
+            for i in range(groups):
+                items.append(
+                    {
+                        "id": i + 1,
+                        "bms": {
+                            "socPct": round(float(soc[i]), 2),
+                            "temperatureC": round(float(temp[i]), 2),
+                            "insulationResistanceKohm": round(float(insulation[i]), 1),
+                            "deltaCellVoltageMv": round(float(delta[i]), 1),
+                            "maxCellTempC": round(float(cell_temp[i]), 2),
+                            "warningCount": int(warn[i]),
+                            "faultCount": int(fault[i]),
+                        },
+                        "pcs": {
+                            "setpointKw": round(float(setpoint[i]), 2),
+                            "actualKw": round(float(actual[i]), 2),
+                            "temperature": int(round(float(temp[i]) + 10)),
+                            "dcVoltageV": round(float(690 + soc[i] * 0.4), 1),
+                            "dcCurrentA": round(float(actual[i] * 1000 / 700), 2),
+                            "efficiencyPct": round(float(97 + rng.normal(0, 0.3)), 2),
+                        },
+                    }
+                )
+
+            n_crit = int(fault.sum())
+            n_warn = int(warn.sum())
+            snap_rows.append((ts,))
+            tel_rows.append(
+                (
+                    ts,
+                    "",
+                    float(np.mean(690 + soc * 0.4)),
+                    float(np.sum(actual) * 1000 / 700),
+                    int(round(float(np.mean(temp)))),
+                    int(round(float(np.mean(soc)))),
+                    98,
+                )
+            )
+            status_rows.append((ts, "normal" if n_crit == 0 else "fault", int(abs(target_kw) / 1.8), int(np.sum(actual)), ""))
+            alarm_snap_rows.append((ts, n_crit + n_warn, n_crit, n_warn, 0))
+            group_rows.append((ts, json.dumps(items, ensure_ascii=False, separators=(",", ":"))))
+            coord_rows.append((ts, json.dumps([{"unitId": 1, "inputs": {"upper": {"targetPowerKw": round(target_kw, 1)}}}])))
+
+        with conn:
+            conn.executemany("INSERT INTO snapshots(ts) VALUES (?)", snap_rows)
+            conn.executemany(
+                "INSERT INTO telemetry(ts, currentTime, averageVoltage, totalCurrent, averageTemperature, systemSOC, systemSOH) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                tel_rows,
+            )
+            conn.executemany(
+                "INSERT INTO system_status(ts, status, load, totalPower, runTime) VALUES (?, ?, ?, ?, ?)", status_rows
+            )
+            conn.executemany(
+                "INSERT INTO alarm_snapshots(ts, totalAlarms, criticalAlarms, warningAlarms, infoAlarms) VALUES (?, ?, ?, ?, ?)",
+                alarm_snap_rows,
+            )
+            conn.executemany("INSERT INTO battery_groups_snapshots(ts, json) VALUES (?, ?)", group_rows)
+            conn.executemany("INSERT INTO coordination_units_snapshots(ts, json) VALUES (?, ?)", coord_rows)
+            conn.executemany(
+                "INSERT INTO alarm_occurrences(ts, groupId, source, device, type, level, description, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                occ_rows,
+            )
+        counts["snapshots"] += len(snap_rows)
+        counts["group_rows"] += len(snap_rows) * groups
+        counts["alarm_occurrences"] += len(occ_rows)
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    counts["start_ts"] = int(tss[0])
+    counts["end_ts"] = int(tss[-1])
+    counts["bytes"] = os.path.getsize(path)
+    return counts
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--groups", type=int, default=16)
+    ap.add_argument("--hours", type=float, default=1.0)
+    ap.add_argument("--step-ms", type=int, default=1000)
+    ap.add_argument("--alarm-rate", type=float, default=0.0005, help="Extra random warnings per group and snapshot")
+    ap.add_argument("--end-ts", type=int, default=None, help="Last snapshot ts (default: now)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    counts = generate_db(
+        args.out,
+        groups=args.groups,
+        hours=args.hours,
+        step_ms=args.step_ms,
+        alarm_rate=args.alarm_rate,
+        end_ts=args.end_ts,
+        seed=args.seed,
+    )
+    print(json.dumps({"ok": True, "path": args.out, **counts, "seconds": time.perf_counter() - t0}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+from argparse import Namespace
+from typing import Any, Callable
+
+import pytest
+
+# The train/ modules import each other by bare name, as when run as scripts.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synth_db import generate_db  # noqa: E402
+
+
+# Fixed so every run sees the same rows.
+END_TS = 1_700_000_000_000
+
+
+@pytest.fixture(scope="session")
+def synth_db_session(tmp_path_factory: pytest.TempPathFactory) -> str:
+    path = str(tmp_path_factory.mktemp("db") / "synth.db")
+    generate_db(path, groups=4, hours=2.0, step_ms=10_000, end_ts=END_TS, seed=0)
+    return path
+
+
+@pytest.fixture
+def synth_db(synth_db_session: str, tmp_path: Any) -> str:
+    """A private copy of a 2 h, 4-group synthetic DB (one snapshot per 10 s)."""
+
+    path = str(tmp_path / "synth.db")
+    shutil.copy(synth_db_session, path)
+    return path
+
+
+@pytest.fixture
+def train_args() -> Callable[..., Namespace]:
+    """Factory for the train.py options build_training_arrays and friends read."""
+
+    def make(db: str, **overrides: Any) -> Namespace:
+        args = {
+            "db": db,
+            "out": None,
+            "compact": False,
+            "target_cache": None,
+            "group_ring": None,
+            "feature_engine": "pandas",
+            "workers": 1,
+            "full_refit": False,
+            "full_refit_every": 24,
+        }
+        args.update(overrides)
+        return Namespace(**args)
+
+    return make
@@ -0,0 +1,35 @@
+import os
+from typing import Any, Dict
+
+import numpy as np
+
+from array_pool import WORKER_ARRAYS, array_pool
+
+
+def _column_sums(name: str) -> Any:
+    arr = WORKER_ARRAYS[name]
+    return type(arr).__name__, np.asarray(arr).sum(axis=0).tolist()
+
+
+def _arrays() -> Dict[str, np.ndarray]:
+    return {"x": np.arange(12.0).reshape(4, 3), "y": np.arange(4)}
+
+
+def test_in_process_arrays_are_cleared_afterwards() -> None:
+    arrays = _arrays()
+    with array_pool(arrays, jobs=1) as pool:
+        assert pool is None
+        assert WORKER_ARRAYS["x"] is arrays["x"]
+    assert WORKER_ARRAYS == {}
+
+
+def test_workers_map_spilled_and_existing_files(tmp_path: Any) -> None:
+    arrays = _arrays()
+    existing = str(tmp_path / "y.npy")
+    np.save(existing, arrays["y"])
+    with array_pool(arrays, jobs=2, array_paths={"y": existing}) as pool:
+        assert pool is not None
+        results = list(pool.map(_column_sums, ["x", "y"]))
+    assert results == [("memmap", [18.0, 22.0, 26.0]), ("memmap", 6)]
+    assert os.path.exists(existing)
+    assert WORKER_ARRAYS == {}
@@ -0,0 +1,75 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pytest
+
+import backtest
+from common import GROUP_TARGET_COLS, HORIZONS_MS
+from profiling import StageRecorder
+from train import build_training_arrays
+
+
+def test_fold_bounds_tile_the_range() -> None:
+    bounds = backtest.fold_bounds(1_000, 10_999, 4)
+    assert bounds[0][0] == 3_000
+    assert bounds[-1][1] == 11_000
+    for (_, end), (start, _) in zip(bounds, bounds[1:]):
+        assert end == start
+    assert [end - start for start, end in bounds] == [2_000] * 4
+
+
+@pytest.fixture
+def fit_calls(monkeypatch: pytest.MonkeyPatch) -> List[Tuple[List[Tuple[Any, ...]], Dict[str, np.ndarray]]]:
+    """Records what _fit_fold hands to the fitter instead of fitting."""
+
+    calls: List[Tuple[List[Tuple[Any, ...]], Dict[str, np.ndarray]]] = []
+
+    def record(tasks: List[Tuple[Any, ...]], arrays: Dict[str, np.ndarray], jobs: int = 1) -> List[Any]:
+        calls.append((tasks, arrays))
+        return []
+
+    monkeypatch.setattr(backtest, "run_fit_tasks", record)
+    monkeypatch.setattr(backtest, "collect_fit_results", lambda artifacts, tasks, results: None)
+    return calls
+
+
+@pytest.fixture
+def arrays(synth_db: str, train_args: Callable[..., Any]) -> Dict[str, np.ndarray]:
+    return build_training_arrays(train_args(synth_db), StageRecorder(), None, None, list(GROUP_TARGET_COLS))[2]
+
+
+def _last_test_start(arrays: Dict[str, np.ndarray]) -> int:
+    # The 2 h DB has 1 h labels only in its first hour; the last of three
+    # folds leaves 30 min of rows before its test block for every horizon.
+    return backtest.fold_bounds(int(arrays["group_ts"].min()), int(arrays["group_ts"].max()), 3)[-1][0]
+
+
+def test_per_target_fits_are_purged_by_their_horizon(arrays: Dict[str, np.ndarray], fit_calls: List[Any]) -> None:
+    test_start = _last_test_start(arrays)
+    backtest._fit_fold(arrays, test_start, "per-target", jobs=1)
+
+    assert len(fit_calls) == len(HORIZONS_MS)
+    for (tasks, train_arrays), (h_key, h_ms) in zip(fit_calls, HORIZONS_MS.items()):
+        assert tasks and all(task[1] == h_key for task in tasks)
+        for prefix in ("station", "group"):
+            ts = train_arrays[f"{prefix}_ts"]
+            assert ts.max() + h_ms < test_start
+            # Nothing else is dropped: every row whose label ends before the
+            # test block is kept.
+            assert len(ts) == int((arrays[f"{prefix}_ts"] + h_ms < test_start).sum())
+        for name, arr in train_arrays.items():
+            rows = len(train_arrays["station_ts" if backtest._is_station_key(name) else "group_ts"])
+            assert len(arr) == rows, name
+
+
+def test_multi_output_is_purged_by_the_longest_horizon(arrays: Dict[str, np.ndarray], fit_calls: List[Any]) -> None:
+    test_start = _last_test_start(arrays)
+    backtest._fit_fold(arrays, test_start, "multi-output", jobs=1)
+
+    longest = max(HORIZONS_MS.values())
+    assert len(fit_calls) == 1
+    tasks, train_arrays = fit_calls[0]
+    assert any(task[0] == "group_multi" for task in tasks)
+    assert train_arrays["group_ts"].max() + longest < test_start
+    assert train_arrays["station_ts"].max() + longest < test_start
+    assert len(train_arrays["multi_y"]) == len(train_arrays["group_ts"])
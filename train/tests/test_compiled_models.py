@@ -0,0 +1,84 @@
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pytest
+from sklearn.ensemble import HistGradientBoostingClassifier, HistGradientBoostingRegressor
+
+from compiled_models import _expit, compare_models, load_compiled, write_compiled
+from group_models import MultiOutputGroupRegressor
+
+
+def _data(n: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(n, 6))
+    y = x[:, 0] * 3.0 - x[:, 1] ** 2 + np.where(x[:, 2] > 0.5, 10.0, 0.0) + rng.normal(scale=0.1, size=n)
+    # Missing values in training and at predict time exercise NaN routing.
+    x[rng.random(size=x.shape) < 0.1] = np.nan
+    return x, y
+
+
+@pytest.fixture(scope="module")
+def artifacts() -> Dict[str, Any]:
+    x, y = _data(600, seed=0)
+    outputs = [("60s", "socPct"), ("60s", "temperatureC"), ("5m", "socPct")]
+    y_multi = np.column_stack([y, -2.0 * y + 5.0, y * 1e3])
+    return {
+        "trained_at_ms": 1,
+        "db_path": "synth.db",
+        "horizons_ms": {"60s": 60_000, "5m": 300_000},
+        "station_feature_cols": [f"s{i}" for i in range(6)],
+        "group_feature_cols": [f"g{i}" for i in range(6)],
+        "metrics": {},
+        "models": {
+            "station": {"60s": HistGradientBoostingRegressor(max_iter=40, random_state=0).fit(x, y)},
+            "group": {"60s": {"socPct": HistGradientBoostingRegressor(max_iter=25, random_state=1).fit(x, -y)}},
+            "fault": {"60s": HistGradientBoostingClassifier(max_iter=30, random_state=0).fit(x, y > 1.0)},
+            "warning": {"60s": None},
+            "group_multi": MultiOutputGroupRegressor(outputs).fit(x, y_multi),
+        },
+    }
+
+
+@pytest.fixture(scope="module")
+def compiled(artifacts: Dict[str, Any], tmp_path_factory: pytest.TempPathFactory) -> Dict[str, Any]:
+    path = str(tmp_path_factory.mktemp("compiled") / "model.npz")
+    write_compiled(path, artifacts)
+    return load_compiled(path)
+
+
+def test_compiled_predictions_equal_sklearn(artifacts: Dict[str, Any], compiled: Dict[str, Any]) -> None:
+    x, _ = _data(500, seed=1)
+    x[:, 3] = np.nan
+    models, other = artifacts["models"], compiled["models"]
+
+    np.testing.assert_array_equal(other["station"]["60s"].predict(x), models["station"]["60s"].predict(x))
+    np.testing.assert_array_equal(
+        other["group"]["60s"]["socPct"].predict(x), models["group"]["60s"]["socPct"].predict(x)
+    )
+    np.testing.assert_array_equal(other["fault"]["60s"].predict_proba(x), models["fault"]["60s"].predict_proba(x))
+    np.testing.assert_array_equal(other["group_multi"].predict(x), models["group_multi"].predict(x))
+    assert other["group_multi"].outputs == models["group_multi"].outputs
+    assert other["warning"].get("60s") is None
+
+    report = compare_models(artifacts, compiled, x, x)
+    assert report["models"] == 4
+    assert report["ok"] and report["max_abs_diff"] == 0.0
+
+
+def test_compare_models_flags_a_mismatch(artifacts: Dict[str, Any], compiled: Dict[str, Any]) -> None:
+    x, _ = _data(50, seed=2)
+    station = compiled["models"]["station"]["60s"]
+    baseline = station.baseline
+    try:
+        station.baseline = baseline + 1e-6
+        report = compare_models(artifacts, compiled, x, x)
+    finally:
+        station.baseline = baseline
+    assert not report["ok"]
+    assert report["max_rel_diff"] > 1e-9
+
+
+def test_expit_saturates_without_overflow() -> None:
+    assert _expit(-1e4) == 0.0
+    assert _expit(1e4) == 1.0
+    assert _expit(0.0) == 0.5
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import (
+    GROUP_DF_COLUMNS,
+    _decode_battery_groups_python,
+    _read_battery_groups_json,
+    _read_battery_groups_sql,
+)
+from ingest_sink import decode_group_snapshot
+
+_GROUP = {
+    "id": 7,
+    "bms": {"socPct": 50.5, "temperatureC": 25, "warningCount": 0, "faultCount": 1},
+    "pcs": {"setpointKw": -10.0, "actualKw": -9.5, "efficiencyPct": 97.1},
+}
+
+# Each payload replaces one snapshot; the valid group next to the bad ones
+# must survive.
+MALFORMED: List[str] = [
+    "[]",
+    "not json",
+    json.dumps({"id": 1}),
+    json.dumps(5),
+    json.dumps([5, "group", None, [1, 2], _GROUP]),
+    json.dumps([{**_GROUP, "id": "2"}, {**_GROUP, "id": 2.5}, {**_GROUP, "id": None}, _GROUP]),
+    json.dumps([{k: v for k, v in _GROUP.items() if k != "id"}, _GROUP]),
+    json.dumps([{"id": 1, "pcs": _GROUP["pcs"]}, {"id": 2, "bms": _GROUP["bms"]}, {"id": 3}]),
+    json.dumps([{"id": 1, "bms": None, "pcs": {}}, {"id": 2, "bms": 5, "pcs": [1.0]}, {"id": 3, "bms": "x"}]),
+    json.dumps([{**_GROUP, "id": True}, {**_GROUP, "id": False}, {**_GROUP, "id": 8}]),
+    json.dumps(
+        [
+            {
+                "id": 1,
+                "bms": {"socPct": "12.5", "temperatureC": " 30 ", "faultCount": "abc", "warningCount": "NaN"},
+                "pcs": {"actualKw": "-1e3", "setpointKw": "Infinity", "dcVoltageV": True, "dcCurrentA": {"a": 1}},
+            },
+            {"id": 2, "bms": {"socPct": [1]}, "pcs": {"actualKw": ""}},
+        ]
+    ),
+]
+
+
+def _replace_snapshots(db_path: str, payloads: List[str]) -> None:
+    conn = sqlite3.connect(db_path)
+    ts = [r[0] for r in conn.execute("SELECT ts FROM battery_groups_snapshots ORDER BY ts")]
+    for t, payload in zip(ts[10::7], payloads):
+        conn.execute("UPDATE battery_groups_snapshots SET json = ? WHERE ts = ?", (payload, t))
+    conn.commit()
+    conn.close()
+
+
+def _both(db_path: str) -> pd.DataFrame:
+    conn = sqlite3.connect(db_path)
+    try:
+        expected = _decode_battery_groups_python(_read_battery_groups_json(conn, "", []))
+        got = _read_battery_groups_sql(conn, None, None)
+    finally:
+        conn.close()
+    pd.testing.assert_frame_equal(got, expected)
+    return got
+
+
+def test_sql_decode_equals_python_decode(synth_db: str) -> None:
+    assert len(_both(synth_db)) == 2880
+
+
+def test_sql_decode_equals_python_decode_on_malformed_payloads(synth_db: str) -> None:
+    _replace_snapshots(synth_db, MALFORMED)
+    out = _both(synth_db)
+    assert (out["groupId"] == 7).sum() == 3
+    assert (out["groupId"] == 8).sum() == 1
+    strings = out[(out["groupId"] == 1) & out["bms_socPct"].eq(12.5)]
+    assert len(strings) == 1
+    row = strings.iloc[0]
+    assert row["bms_temperatureC"] == 30.0 and row["pcs_actualKw"] == -1000.0 and row["pcs_dcVoltageV"] == 1.0
+    assert row[["bms_faultCount", "bms_warningCount", "pcs_setpointKw", "pcs_dcCurrentA"]].isna().all()
+
+
+@pytest.mark.parametrize("payload", ["[]", "not json"])
+def test_sql_decode_of_only_unusable_snapshots(synth_db: str, payload: str) -> None:
+    conn = sqlite3.connect(synth_db)
+    conn.execute("UPDATE battery_groups_snapshots SET json = ?", (payload,))
+    conn.commit()
+    conn.close()
+    assert _both(synth_db).empty
+
+
+# The socket handler drops lines that are not JSON before decoding.
+@pytest.mark.parametrize("payload", [p for p in MALFORMED if p != "not json"])
+def test_ring_decoder_follows_the_same_rules(payload: str) -> None:
+    expected = _decode_battery_groups_python(pd.DataFrame({"ts": [0], "json": [payload]}))
+    gids, values = decode_group_snapshot(json.loads(payload))
+    np.testing.assert_array_equal(gids, expected["groupId"].to_numpy(dtype=np.int64))
+    np.testing.assert_array_equal(values, expected[GROUP_DF_COLUMNS[2:]].to_numpy(dtype=float))
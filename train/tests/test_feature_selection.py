@@ -0,0 +1,74 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import build_group_features, build_station_features, latest_features_direct, load_data
+from feature_selection import keep_by_importance, select_feature_columns
+
+
+def _every_third(cols: List[str]) -> List[str]:
+    return cols[::3]
+
+
+@pytest.mark.parametrize("engine", ["pandas", "numpy"])
+def test_restricted_build_equals_selecting_from_the_full_build(synth_db: str, engine: str) -> None:
+    loaded = load_data(synth_db)
+    station_full, station_cols = build_station_features(loaded.station_df, loaded.group_df)
+    group_full, group_cols = build_group_features(station_full, loaded.group_df, engine=engine)
+
+    keep_station, keep_group = _every_third(station_cols), _every_third(group_cols)
+    station_part, station_part_cols = build_station_features(
+        loaded.station_df, loaded.group_df, feature_cols=keep_station
+    )
+    group_part, group_part_cols = build_group_features(
+        station_part, loaded.group_df, engine=engine, feature_cols=keep_group
+    )
+
+    assert station_part_cols == keep_station
+    assert group_part_cols == keep_group
+    assert len(group_part.columns) < len(group_full.columns)
+    pd.testing.assert_frame_equal(station_part[["ts"] + keep_station], station_full[["ts"] + keep_station])
+    pd.testing.assert_frame_equal(
+        group_part[["ts", "groupId"] + keep_group], group_full[["ts", "groupId"] + keep_group]
+    )
+
+
+def test_restricted_latest_rows_equal_the_full_latest_rows(synth_db: str) -> None:
+    loaded = load_data(synth_db)
+    station_all, group_all, ts_all = latest_features_direct(loaded.station_df, loaded.group_df)
+    keep_station = _every_third([c for c in station_all.columns if c != "ts"])
+    keep_group = _every_third([c for c in group_all.columns if c not in ("ts", "groupId")])
+
+    station_part, group_part, ts_part = latest_features_direct(
+        loaded.station_df, loaded.group_df, keep_station, keep_group
+    )
+    assert ts_part == ts_all
+    assert len(station_part) == 1 and len(group_part) == 4
+    pd.testing.assert_frame_equal(station_part[keep_station], station_all[keep_station])
+    pd.testing.assert_frame_equal(group_part[["groupId"] + keep_group], group_all[["groupId"] + keep_group])
+
+
+def test_keep_by_importance_keeps_the_smallest_covering_set() -> None:
+    cols = ["a", "b", "c", "d", "e"]
+    importance = np.array([0.05, 0.5, 0.0, 0.3, 0.15])
+    assert keep_by_importance(cols, importance, 0.8) == ["b", "d"]
+    assert keep_by_importance(cols, importance, 0.9) == ["b", "d", "e"]
+    assert keep_by_importance(cols, importance, 1.0) == ["a", "b", "d", "e"]
+    # Nothing to rank by: keep everything.
+    assert keep_by_importance(cols, np.zeros(5), 0.5) == cols
+
+
+def test_select_feature_columns_reorders_and_validates() -> None:
+    arrays = {
+        "station_x": np.arange(6.0).reshape(2, 3),
+        "group_x": np.arange(8.0).reshape(2, 4),
+        "y_station_60s": np.array([1.0, 2.0]),
+    }
+    out = select_feature_columns(arrays, ["a", "b", "c"], ["p", "q", "r", "s"], ["c", "a"], ["p", "q", "r", "s"])
+    np.testing.assert_array_equal(out["station_x"], [[2.0, 0.0], [5.0, 3.0]])
+    assert out["group_x"] is arrays["group_x"]
+    assert out["y_station_60s"] is arrays["y_station_60s"]
+    with pytest.raises(ValueError):
+        select_feature_columns(arrays, ["a", "b", "c"], ["p", "q", "r", "s"], ["z"], ["p"])
@@ -0,0 +1,47 @@
+import sqlite3
+
+import pandas as pd
+
+from common import load_data
+from feature_store import RETAIN_MS, advance_feature_state
+
+
+def test_late_row_below_watermark_is_picked_up(synth_db: str) -> None:
+    conn = sqlite3.connect(synth_db)
+    late_ts = conn.execute("SELECT ts FROM battery_groups_snapshots ORDER BY ts DESC LIMIT 1 OFFSET 3").fetchone()[0]
+    row = conn.execute("SELECT ts, json FROM battery_groups_snapshots WHERE ts = ?", (late_ts,)).fetchone()
+    conn.execute("DELETE FROM battery_groups_snapshots WHERE ts = ?", (late_ts,))
+    conn.commit()
+
+    state, _station_df, group_df = advance_feature_state(None, synth_db)
+    assert state.watermark_ts >= late_ts
+    assert not (group_df["ts"] == late_ts).any()
+
+    # The snapshot's group rows are committed after the run that moved the
+    # watermark past them.
+    conn.execute("INSERT INTO battery_groups_snapshots(ts, json) VALUES (?, ?)", row)
+    conn.commit()
+    conn.close()
+
+    state, station_df, group_df = advance_feature_state(state, synth_db)
+    fresh = load_data(synth_db)
+    keep_from = state.watermark_ts - RETAIN_MS
+    expected_group = fresh.group_df[fresh.group_df["ts"] > keep_from].sort_values(["groupId", "ts"])
+    expected_station = fresh.station_df[fresh.station_df["ts"] > keep_from].sort_values("ts")
+    pd.testing.assert_frame_equal(group_df, expected_group.reset_index(drop=True))
+    pd.testing.assert_frame_equal(station_df, expected_station.reset_index(drop=True))
+
+
+def test_state_tail_matches_full_load_after_several_runs(synth_db: str) -> None:
+    conn = sqlite3.connect(synth_db)
+    (newest,) = conn.execute("SELECT MAX(ts) FROM battery_groups_snapshots").fetchone()
+    conn.close()
+
+    state = None
+    for end_ts in (newest - 20 * 60_000, newest - 10 * 60_000, newest):
+        state, station_df, group_df = advance_feature_state(state, synth_db, end_ts=end_ts)
+
+    fresh = load_data(synth_db)
+    keep_from = state.watermark_ts - RETAIN_MS
+    expected = fresh.group_df[fresh.group_df["ts"] > keep_from].sort_values(["groupId", "ts"])
+    pd.testing.assert_frame_equal(group_df, expected.reset_index(drop=True))
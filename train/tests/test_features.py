@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import _rolling_features_numpy, build_group_features, build_station_features, load_data
+
+
+def test_numpy_engine_matches_pandas(synth_db: str) -> None:
+    loaded = load_data(synth_db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    a, cols = build_group_features(station_feat_df, loaded.group_df, engine="pandas")
+    b, cols_np = build_group_features(station_feat_df, loaded.group_df, engine="numpy")
+
+    assert cols_np == cols
+    assert list(b.columns) == list(a.columns)
+    for c in cols:
+        x = a[c].to_numpy(dtype=float)
+        y = b[c].to_numpy(dtype=float)
+        np.testing.assert_array_equal(np.isnan(x), np.isnan(y), err_msg=c)
+        np.testing.assert_allclose(y, x, rtol=1e-9, atol=1e-9, err_msg=c)
+        if "_std" in c:
+            np.testing.assert_array_equal(y == 0, x == 0, err_msg=c)
+
+
+def _single_group(values: np.ndarray) -> dict:
+    ts = np.arange(len(values), dtype=np.int64) * 1000
+    return _rolling_features_numpy(np.zeros(len(values), dtype=np.int64), ts, values[:, None], ["x"])
+
+
+def test_constant_windows_have_zero_std() -> None:
+    values = np.concatenate([np.full(100, 0.1), [np.nan], np.full(100, 0.1), np.linspace(0.0, 1.0, 50)])
+    out = _single_group(values)
+    # Windows over rows 1..200 only hold the value 0.1 (the NaN is skipped).
+    assert (out["x_std60s"][1:201] == 0.0).all()
+    assert (out["x_std60s"][205:] > 0.0).all()
+
+
+def test_small_variance_late_in_a_long_series() -> None:
+    rng = np.random.default_rng(0)
+    n = 50_000
+    head = rng.normal(0.0, 100.0, n - 500) + np.linspace(0.0, 5000.0, n - 500)
+    values = np.concatenate([head, 5000.0 + rng.normal(0.0, 1e-4, 500)])
+    out = _single_group(values)["x_std60s"][-400:]
+    exact = np.array([values[i - 59 : i + 1].std(ddof=1) for i in range(n - 400, n)])
+    np.testing.assert_allclose(out, exact, rtol=1e-9)
+
+
+def test_windows_do_not_cross_groups() -> None:
+    ts = np.tile(np.arange(10, dtype=np.int64) * 1000, 2)
+    gids = np.repeat([1, 2], 10)
+    values = np.concatenate([np.zeros(10), np.full(10, 5.0)])[:, None]
+    out = _rolling_features_numpy(gids, ts, values, ["x"])
+    assert np.isnan(out["x_diff1"][10])
+    np.testing.assert_array_equal(out["x_mean60s"], values[:, 0])
+    expected = pd.Series(values[:, 0]).groupby(gids).transform(lambda s: s.expanding().std()).to_numpy()
+    np.testing.assert_array_equal(np.nan_to_num(out["x_std60s"], nan=-1.0), np.nan_to_num(expected, nan=-1.0))
+
+
+@pytest.mark.parametrize("workers, compact", [(2, False), (2, True), (3, False)])
+def test_parallel_rolling_equals_the_serial_loop(synth_db: str, workers: int, compact: bool) -> None:
+    loaded = load_data(synth_db, compact=compact)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    serial, cols = build_group_features(station_feat_df, loaded.group_df, compact=compact, workers=1)
+    parallel, cols_par = build_group_features(station_feat_df, loaded.group_df, compact=compact, workers=workers)
+
+    assert cols_par == cols
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+def test_parallel_rolling_with_a_feature_subset(synth_db: str) -> None:
+    loaded = load_data(synth_db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    _, all_cols = build_group_features(station_feat_df, loaded.group_df)
+    keep = all_cols[::4]
+    serial, cols = build_group_features(station_feat_df, loaded.group_df, workers=1, feature_cols=keep)
+    parallel, cols_par = build_group_features(station_feat_df, loaded.group_df, workers=2, feature_cols=keep)
+
+    assert cols_par == cols
+    pd.testing.assert_frame_equal(parallel, serial)
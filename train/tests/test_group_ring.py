@@ -0,0 +1,150 @@
+import json
+import multiprocessing
+import sqlite3
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common import GROUP_VALUE_FIELDS, _read_battery_groups_sql, read_group_ring
+from group_ring import GroupRing
+from ingest_sink import DEFAULT_CAPACITY, IngestSink, decode_group_snapshot
+
+
+def _snapshots(db_path: str) -> List[Tuple[int, str]]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT ts, json FROM battery_groups_snapshots ORDER BY ts").fetchall()
+    finally:
+        conn.close()
+
+
+def _empty_one_snapshot(db_path: str) -> int:
+    """Makes a snapshot in the middle of the DB decode to no groups; returns its ts."""
+
+    rows = _snapshots(db_path)
+    ts = rows[len(rows) // 2][0]
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE battery_groups_snapshots SET json = '[]' WHERE ts = ?", (ts,))
+    conn.commit()
+    conn.close()
+    return ts
+
+
+def _sink(tmp_path: Any, capacity: int = DEFAULT_CAPACITY) -> IngestSink:
+    return IngestSink(GroupRing.create(str(tmp_path / "groups.ring"), capacity, len(GROUP_VALUE_FIELDS)))
+
+
+def _feed(sink: IngestSink, rows: List[Tuple[int, str]], skip: Optional[int] = None) -> None:
+    # What the socket handler does with each JSON line.
+    for ts, payload in rows:
+        if ts != skip:
+            sink.append_snapshot(ts, *decode_group_snapshot(json.loads(payload)))
+
+
+def _assert_ring_matches_sql(db_path: str, ring_path: str, windows: List[Tuple[Any, Any]]) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        for start_ts, end_ts in windows:
+            for compact in (False, True):
+                got = read_group_ring(conn, ring_path, start_ts, end_ts, compact=compact)
+                assert got is not None, (start_ts, end_ts)
+                pd.testing.assert_frame_equal(got, _read_battery_groups_sql(conn, start_ts, end_ts, compact=compact))
+    finally:
+        conn.close()
+
+
+def _windows(rows: List[Tuple[int, str]]) -> List[Tuple[Any, Any]]:
+    mid = rows[len(rows) // 2][0]
+    return [(None, None), (rows[10][0], rows[-10][0]), (mid - 30_000, mid + 30_000), (mid, mid)]
+
+
+def test_backfilled_ring_equals_sqlite(synth_db: str, tmp_path: Any) -> None:
+    _empty_one_snapshot(synth_db)
+    sink = _sink(tmp_path)
+    sink.backfill(synth_db, None)
+    rows = _snapshots(synth_db)
+    assert sink.snapshots == len(rows)
+    _assert_ring_matches_sql(synth_db, sink.ring.path, _windows(rows))
+
+
+def test_socket_fed_ring_equals_sqlite(synth_db: str, tmp_path: Any) -> None:
+    _empty_one_snapshot(synth_db)
+    sink = _sink(tmp_path)
+    rows = _snapshots(synth_db)
+    _feed(sink, rows)
+    _assert_ring_matches_sql(synth_db, sink.ring.path, _windows(rows))
+
+
+def test_missed_snapshot_falls_back_to_sqlite(synth_db: str, tmp_path: Any) -> None:
+    sink = _sink(tmp_path)
+    rows = _snapshots(synth_db)
+    missed = rows[len(rows) // 2][0]
+    _feed(sink, rows, skip=missed)
+
+    conn = sqlite3.connect(synth_db)
+    try:
+        assert read_group_ring(conn, sink.ring.path, None, None) is None
+        assert read_group_ring(conn, sink.ring.path, missed - 60_000, missed + 60_000) is None
+    finally:
+        conn.close()
+    _assert_ring_matches_sql(synth_db, sink.ring.path, [(missed + 1, None), (None, missed - 1)])
+
+
+def test_wrapped_ring_covers_only_its_newest_rows(synth_db: str, tmp_path: Any) -> None:
+    rows = _snapshots(synth_db)
+    groups = len(json.loads(rows[0][1]))
+    # Room for 100 snapshots and a half: the oldest kept snapshot is partly
+    # overwritten after the wrap.
+    sink = _sink(tmp_path, capacity=100 * groups + groups // 2)
+    _feed(sink, rows)
+
+    ring = sink.ring
+    assert ring.rows == ring.capacity
+    assert ring.covered_from_ts == rows[-101][0] + 1
+    conn = sqlite3.connect(synth_db)
+    try:
+        assert read_group_ring(conn, ring.path, rows[-101][0], None) is None
+    finally:
+        conn.close()
+    _assert_ring_matches_sql(synth_db, ring.path, [(rows[-100][0], None), (rows[-50][0], rows[-20][0])])
+
+
+def _write_forever(path: str, stop: Any) -> None:
+    # Each append is one snapshot of 5 groups whose values encode its ts, so
+    # a window mixing two appends is detectable.
+    ring = GroupRing(path, writable=True)
+    ts = 0
+    while not stop.is_set():
+        ts += 1
+        ring.append(np.full(5, ts, dtype=np.int64), np.arange(5, dtype=np.int64), np.full((5, 2), float(ts)))
+
+
+def test_concurrent_reads_never_see_a_torn_window(tmp_path: Any) -> None:
+    path = str(tmp_path / "groups.ring")
+    GroupRing.create(path, 64, 2)
+    ctx = multiprocessing.get_context("fork")
+    stop = ctx.Event()
+    writer = ctx.Process(target=_write_forever, args=(path, stop))
+    writer.start()
+    try:
+        reader = GroupRing(path, writable=False)
+        seen = 0
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            newest = reader.newest_ts
+            # 6 of the 12 snapshots the ring holds, so the writer keeps
+            # wrapping over the rows being copied.
+            window = reader.window(newest - 5, newest) if newest > 5 else None
+            if window is None:
+                continue
+            ts, gids, values, snapshot_ts = window
+            np.testing.assert_array_equal(values, np.column_stack([ts, ts]).astype(float))
+            np.testing.assert_array_equal(ts, np.repeat(snapshot_ts, 5))
+            np.testing.assert_array_equal(gids, np.tile(np.arange(5), len(snapshot_ts)))
+            seen += 1
+    finally:
+        stop.set()
+        writer.join()
+    assert seen > 0
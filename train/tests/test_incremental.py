@@ -0,0 +1,102 @@
+import shutil
+import sqlite3
+from typing import Any, Callable, Dict
+
+import numpy as np
+import pytest
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+from common import GROUP_TARGET_COLS
+from conftest import END_TS
+from incremental import final_label_ts, rows_in_range
+from profiling import StageRecorder
+from shards import _RANGE_TABLES
+from train import _continue_boosting, build_training_arrays, incremental_training_arrays, warm_start_supported
+
+
+def _truncate(db_path: str, upto_ts: int) -> None:
+    conn = sqlite3.connect(db_path)
+    for table in _RANGE_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE ts > ?", (upto_ts,))
+    conn.commit()
+    conn.close()
+
+
+def _by_ts(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # The cached rows come before the new ones rather than group by group; a
+    # stable sort on ts puts both layouts in (ts, groupId) order.
+    station = np.argsort(arrays["station_ts"], kind="stable")
+    group = np.argsort(arrays["group_ts"], kind="stable")
+    return {
+        name: arr[station if name.startswith(("station_", "y_station_")) else group] for name, arr in arrays.items()
+    }
+
+
+def test_cached_rows_plus_new_rows_equal_a_full_build(
+    synth_db: str, tmp_path: Any, train_args: Callable[..., Any]
+) -> None:
+    full_copy = str(tmp_path / "full.db")
+    shutil.copy(synth_db, full_copy)
+    _truncate(synth_db, END_TS - 30 * 60_000)
+    args = train_args(synth_db, out=str(tmp_path / "out"))
+    targets = list(GROUP_TARGET_COLS)
+
+    _, _, first, info = incremental_training_arrays(args, StageRecorder(), None, targets)
+    assert info["full_refit"] and info["reason"] == "no cache"
+    final_ts = final_label_ts(first)
+    assert final_ts is not None
+
+    # Same path, now with the newer rows.
+    shutil.copy(full_copy, synth_db)
+    station_cols, group_cols, arrays, info = incremental_training_arrays(args, StageRecorder(), None, targets)
+    assert not info["full_refit"]
+    assert info["cached_rows"] > 0 and info["new_rows"] > 0
+
+    full_station_cols, full_group_cols, full = build_training_arrays(args, StageRecorder(), None, None, targets)
+    assert (station_cols, group_cols) == (full_station_cols, full_group_cols)
+    assert sorted(arrays) == sorted(full)
+    # The cached (final) rows are exactly what a full build gives.
+    cached = rows_in_range(arrays, upto_ts=final_ts)
+    for name, arr in rows_in_range(full, upto_ts=final_ts).items():
+        np.testing.assert_array_equal(cached[name], arr, err_msg=name)
+
+    arrays, full = _by_ts(arrays), _by_ts(full)
+    for name, arr in full.items():
+        assert arrays[name].dtype == arr.dtype, name
+        if name.endswith("_x"):
+            # Rolling sums over the new rows restart RETAIN_MS before them,
+            # which only changes the rounding.
+            np.testing.assert_array_equal(np.isnan(arrays[name]), np.isnan(arr), err_msg=name)
+            np.testing.assert_allclose(arrays[name], arr, rtol=1e-8, atol=1e-9, err_msg=name)
+        else:
+            np.testing.assert_array_equal(arrays[name], arr, err_msg=name)
+
+
+def test_cache_is_rebuilt_every_n_runs(synth_db: str, tmp_path: Any, train_args: Callable[..., Any]) -> None:
+    args = train_args(synth_db, out=str(tmp_path / "out"), full_refit_every=2)
+    targets = list(GROUP_TARGET_COLS)
+    reasons = [incremental_training_arrays(args, StageRecorder(), None, targets)[3].get("reason") for _ in range(4)]
+    assert reasons == ["no cache", None, "every 2 runs", None]
+
+
+@pytest.mark.skipif(not warm_start_supported(), reason="no warm start on this scikit-learn")
+def test_continued_boosting_keeps_the_existing_trees() -> None:
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(800, 4))
+    y = x[:, 0] - 2.0 * x[:, 1] + rng.normal(scale=0.1, size=800)
+    model = HistGradientBoostingRegressor(max_iter=20, early_stopping=False, random_state=0).fit(x[:500], y[:500])
+    before = list(model.staged_predict(x))
+    mapper = model._bin_mapper
+
+    # The new rows extend the range, so a refitted mapper would bin differently.
+    x_new = np.vstack([x, x[:100] * 3.0])
+    y_new = np.concatenate([y, y[:100] * 3.0])
+    _continue_boosting(model, x_new, y_new, extra_iter=10)
+
+    assert model.n_iter_ == 30
+    assert model._bin_mapper is mapper
+    after = list(model.staged_predict(x))
+    for a, b in zip(before, after[:20]):
+        np.testing.assert_array_equal(a, b)
+    assert not model.warm_start
+    assert "_bin_data" not in vars(model)
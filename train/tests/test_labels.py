@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import GROUP_TARGET_COLS, HORIZONS_MS, build_group_features, build_labels, build_station_features, load_data
+from label_reference import (
+    add_fault_labels_by_horizon,
+    add_future_targets_by_horizon,
+    add_warning_labels_by_horizon,
+    merge_risk_labels_from_future_counts,
+)
+
+
+def _reference(group_feat_df: pd.DataFrame, occ: pd.DataFrame) -> pd.DataFrame:
+    out = add_future_targets_by_horizon(group_feat_df, HORIZONS_MS, GROUP_TARGET_COLS)
+    out = add_fault_labels_by_horizon(out, occ, HORIZONS_MS)
+    out = add_warning_labels_by_horizon(out, occ, HORIZONS_MS)
+    return merge_risk_labels_from_future_counts(out, HORIZONS_MS)
+
+
+def _more_alarms(occ: pd.DataFrame, ts: np.ndarray) -> pd.DataFrame:
+    # synth_db has a single warning; add faults, a latched warning, an event
+    # exactly one horizon ahead, one without a group and one of an unknown group.
+    extra = pd.DataFrame(
+        {
+            "ts": [ts[100], ts[200], ts[300] + 1, ts[40] + HORIZONS_MS["5m"], ts[500], ts[600]],
+            "groupId": [1, 2, 1, 0, None, 99],
+            "type": ["过温", "锁存", "通讯异常", "通讯异常", "过温", "过温"],
+            "level": ["critical", "warning", "warning", "warning", "critical", "critical"],
+        }
+    )
+    return pd.concat([occ, extra], ignore_index=True)
+
+
+@pytest.fixture
+def group_features(synth_db: str) -> pd.DataFrame:
+    loaded = load_data(synth_db)
+    station_feat_df, _ = build_station_features(loaded.station_df, loaded.group_df)
+    group_feat_df, _ = build_group_features(station_feat_df, loaded.group_df, engine="numpy")
+    return group_feat_df
+
+
+def test_build_labels_equals_the_per_group_functions(synth_db: str, group_features: pd.DataFrame) -> None:
+    occ = load_data(synth_db).alarm_occurrences
+    ts = np.unique(group_features["ts"].to_numpy())
+    df = group_features.copy()
+    # Counters seen in a few future rows.
+    df.loc[df.index[::97], "bms_warningCount"] = 2.0
+    df.loc[df.index[::131], "bms_faultCount"] = 1.0
+    df.loc[df.index[::53], "bms_faultCount"] = np.nan
+
+    for alarms in (occ, _more_alarms(occ, ts), occ.iloc[:0]):
+        expected = _reference(df, alarms)
+        got = build_labels(df, alarms, HORIZONS_MS, GROUP_TARGET_COLS)
+        pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+    with_alarms = build_labels(df, _more_alarms(occ, ts), HORIZONS_MS, GROUP_TARGET_COLS)
+    for h_key in HORIZONS_MS:
+        assert with_alarms[f"y_fault_{h_key}"].any() and with_alarms[f"y_warning_{h_key}"].any()
+
+
+def test_build_labels_sorts_its_input(synth_db: str, group_features: pd.DataFrame) -> None:
+    occ = load_data(synth_db).alarm_occurrences
+    shuffled = group_features.sample(frac=1.0, random_state=0)
+    pd.testing.assert_frame_equal(
+        build_labels(shuffled, occ, HORIZONS_MS, GROUP_TARGET_COLS),
+        _reference(shuffled, occ),
+        check_dtype=False,
+    )
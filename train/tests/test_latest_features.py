@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common import (
+    build_group_features,
+    build_station_features,
+    latest_features_direct,
+    latest_features_for_inference,
+    load_data,
+)
+
+
+def _assert_values_close(got: pd.DataFrame, expected: pd.DataFrame) -> None:
+    assert list(got.columns) == list(expected.columns)
+    assert len(got) == len(expected)
+    for c in expected.columns:
+        x = expected[c].to_numpy(dtype=float)
+        y = got[c].to_numpy(dtype=float)
+        np.testing.assert_array_equal(np.isnan(y), np.isnan(x), err_msg=c)
+        np.testing.assert_allclose(y, x, rtol=1e-9, atol=1e-9, err_msg=c)
+
+
+def _compare(station_df: pd.DataFrame, group_df: pd.DataFrame) -> pd.DataFrame:
+    station_feat_df, station_cols = build_station_features(station_df, group_df)
+    group_feat_df, group_cols = build_group_features(station_feat_df, group_df)
+    station_x, group_x, latest_ts = latest_features_for_inference(
+        station_feat_df, group_feat_df, station_cols, group_cols
+    )
+    direct_station, direct_group, direct_ts = latest_features_direct(station_df, group_df)
+
+    assert direct_ts == latest_ts
+    _assert_values_close(direct_station[["ts"] + station_cols], station_x.reset_index(drop=True))
+    _assert_values_close(direct_group, group_x.reset_index(drop=True))
+    return direct_group
+
+
+def test_direct_rows_equal_the_full_build_at_latest_ts(synth_db: str) -> None:
+    loaded = load_data(synth_db)
+    group_x = _compare(loaded.station_df, loaded.group_df)
+    assert group_x["groupId"].tolist() == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("case", ["first_sample_only", "missing_at_latest"])
+def test_direct_rows_with_groups_coming_and_going(synth_db: str, case: str) -> None:
+    loaded = load_data(synth_db)
+    group_df = loaded.group_df
+    latest_ts = int(group_df["ts"].max())
+    if case == "first_sample_only":
+        # Group 3 has no previous sample: its only row is the latest one.
+        group_df = group_df[(group_df["groupId"] != 3) | (group_df["ts"] == latest_ts)]
+        expected_groups = [1, 2, 3, 4]
+    else:
+        # Group 2 stopped reporting before the latest snapshot.
+        group_df = group_df[(group_df["groupId"] != 2) | (group_df["ts"] < latest_ts - 60_000)]
+        expected_groups = [1, 3, 4]
+    group_df = group_df.reset_index(drop=True)
+
+    group_x = _compare(loaded.station_df, group_df)
+    assert group_x["groupId"].tolist() == expected_groups
+    if case == "first_sample_only":
+        row = group_x[group_x["groupId"] == 3].iloc[0]
+        diff_cols = [c for c in group_x.columns if c.endswith("_diff1")]
+        assert diff_cols and row[diff_cols].isna().all()
@@ -0,0 +1,113 @@
+import json
+import struct
+from typing import Any, Dict
+
+import numpy as np
+import pytest
+
+from prediction_io import (
+    BMS_TARGETS,
+    MAGIC,
+    encode_prediction_bin,
+    read_prediction,
+    read_prediction_arrays,
+    write_prediction_bin,
+    write_prediction_json,
+)
+
+
+HORIZONS = ["1m", "5m", "15m"]
+
+
+def _prediction(include_features: bool) -> Dict[str, Any]:
+    """An output dict shaped like predict.py's, with a few missing predictions."""
+
+    rng = np.random.default_rng(0)
+    bms: Dict[str, Any] = {}
+    for gid in ("3", "7", "12"):
+        bms[gid] = {t: {"pred": {h: float(rng.normal()) for h in HORIZONS}} for t in BMS_TARGETS}
+    bms["7"]["pcsActualKw"]["pred"]["5m"] = None
+    out: Dict[str, Any] = {
+        "ts": 1_700_000_000_000,
+        "horizons": HORIZONS,
+        "station": {"targetPowerKw": {"now": 812.5, "pred": {"1m": 800.0, "5m": None, "15m": 790.25}}},
+        "bms": bms,
+        "macro": {
+            "probAnyFault": {h: 0.1 for h in HORIZONS},
+            "expectedFaultedGroups": {h: 0.3 for h in HORIZONS},
+            "probAnyWarning": {h: None for h in HORIZONS},
+            "expectedWarnedGroups": {h: None for h in HORIZONS},
+        },
+        "features": {"station": {}, "groups": {}},
+        "modelInfo": {
+            "trainedAtMs": 1_699_999_000_000,
+            "dbPath": "/data/energy.db",
+            "modelPath": "/models/model.joblib",
+            "stationFeatureCols": ["a", "b"],
+            "groupFeatureCols": ["c", "d", "e"],
+            "metrics": {"station": {}},
+        },
+    }
+    if include_features:
+        out["features"]["station"] = {"a": 1.5, "b": None}
+        out["features"]["groups"] = {gid: {"c": 0.25, "d": float(i), "e": None} for i, gid in enumerate(bms)}
+    return out
+
+
+@pytest.mark.parametrize("include_features", [False, True])
+def test_bin_reads_back_as_the_json(tmp_path: Any, include_features: bool) -> None:
+    out = _prediction(include_features)
+    json_path = str(tmp_path / "prediction.json")
+    bin_path = str(tmp_path / "prediction.bin")
+    write_prediction_json(json_path, out)
+    write_prediction_bin(bin_path, out)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["prediction.bin", "prediction.json"]
+
+    from_json = read_prediction(json_path)
+    from_bin = read_prediction(bin_path)
+    # The binary header keeps only the scalar model info.
+    model_info = from_json.pop("modelInfo")
+    assert from_bin.pop("modelInfo") == {k: model_info[k] for k in ("trainedAtMs", "dbPath", "modelPath")}
+    assert from_bin == from_json
+    assert json.dumps(from_bin) == json.dumps(from_json)
+
+
+def test_arrays_are_aligned_and_little_endian(tmp_path: Any) -> None:
+    path = str(tmp_path / "prediction.bin")
+    write_prediction_bin(path, _prediction(include_features=True))
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[: len(MAGIC)] == MAGIC
+    (header_len,) = struct.unpack_from("<Q", data, len(MAGIC))
+    base = len(MAGIC) + 8 + header_len
+    assert base % 8 == 0
+
+    header, arrays = read_prediction_arrays(path)
+    assert list(arrays) == ["groupIds", "bms", "station", "groupFeatures", "stationFeatures"]
+    for name, spec in header["arrays"].items():
+        assert spec["offset"] % 8 == 0, name
+        assert spec["dtype"] in ("<i8", "<f8"), name
+    assert arrays["bms"].shape == (3, len(HORIZONS), len(BMS_TARGETS))
+    assert np.isnan(arrays["bms"][1, 1, BMS_TARGETS.index("pcsActualKw")])
+    np.testing.assert_array_equal(arrays["groupIds"], [3, 7, 12])
+
+
+def test_empty_prediction_round_trips(tmp_path: Any) -> None:
+    out = _prediction(include_features=False)
+    out["bms"] = {}
+    path = str(tmp_path / "prediction.bin")
+    write_prediction_bin(path, out)
+    assert read_prediction(path)["bms"] == {}
+    assert len(encode_prediction_bin(out)) % 8 == 0
+
+
+def test_rejects_other_files(tmp_path: Any) -> None:
+    wrong_version = tmp_path / "prediction.bin"
+    wrong_version.write_bytes(MAGIC + struct.pack("<Q", 8) + b'{"v": 9}')
+    with pytest.raises(ValueError):
+        read_prediction_arrays(str(wrong_version))
+
+    json_path = tmp_path / "prediction.json"
+    json_path.write_text("{}")
+    with pytest.raises(ValueError):
+        read_prediction_arrays(str(json_path))
@@ -0,0 +1,111 @@
+import shutil
+import sqlite3
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from common import GROUP_TARGET_COLS, HORIZONS_MS, add_station_targets_by_horizon, build_labels, load_data
+from conftest import END_TS
+from prediction_io import BMS_TARGETS
+from prediction_log import (
+    LABEL_PREFIXES,
+    STATION_GROUP_ID,
+    STATION_TARGET,
+    append_predictions,
+    read_prediction_log,
+    realized_vs_predicted,
+)
+from shards import _RANGE_TABLES
+
+# Snapshot ts of the forecast, and how far the truncated DB reaches.
+PRED_TS = END_TS - 100 * 60_000
+DATA_END = END_TS - 90 * 60_000
+
+
+def _output(ts: int, offset: float = 0.0) -> Dict[str, Any]:
+    # predict.py's output dict; one forecast per group, target and horizon.
+    preds = {h_key: 10.0 * i + offset for i, h_key in enumerate(HORIZONS_MS)}
+    bms = {str(gid): {target: {"pred": dict(preds)} for target in BMS_TARGETS} for gid in (1, 2, 3, 4)}
+    # A missing forecast is not logged.
+    bms["4"]["socPct"]["pred"]["1h"] = None
+    return {"ts": ts, "bms": bms, "station": {STATION_TARGET: {"pred": dict(preds)}}}
+
+
+def _truncate(db_path: str, upto_ts: int) -> None:
+    conn = sqlite3.connect(db_path)
+    for table in _RANGE_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE ts > ?", (upto_ts,))
+    conn.commit()
+    conn.close()
+
+
+def _labels(db_path: str) -> Dict[str, pd.DataFrame]:
+    loaded = load_data(db_path)
+    group = build_labels(loaded.group_df, loaded.alarm_occurrences, HORIZONS_MS, GROUP_TARGET_COLS)
+    station = add_station_targets_by_horizon(loaded.station_df, HORIZONS_MS, [LABEL_PREFIXES[STATION_TARGET]])
+    return {"group": group.set_index(["groupId", "ts"]), "station": station.set_index("ts")}
+
+
+def _expected_actual(row: Any, labels: Dict[str, pd.DataFrame]) -> float:
+    col = f"y_{LABEL_PREFIXES[row.target]}_{row.horizon}"
+    if row.groupId == STATION_GROUP_ID:
+        return float(labels["station"].loc[row.ts, col])
+    return float(labels["group"].loc[(row.groupId, row.ts), col])
+
+
+def test_round_trip_and_realized_values(synth_db: str, tmp_path: Any) -> None:
+    log_path = str(tmp_path / "log" / "predictions.db")
+    # Every group, target and horizon but one, plus the station's horizons.
+    n_rows = 4 * len(BMS_TARGETS) * len(HORIZONS_MS) - 1 + len(HORIZONS_MS)
+    assert append_predictions(log_path, _output(PRED_TS)) == n_rows
+    # Logging the same run again keeps the first values.
+    assert append_predictions(log_path, _output(PRED_TS, offset=1.0)) == 0
+    assert append_predictions(log_path, {"ts": None}) == 0
+
+    log = read_prediction_log(log_path)
+    assert len(log) == n_rows
+    assert (log["ts"] == PRED_TS).all()
+    station = log[log["groupId"] == STATION_GROUP_ID]
+    assert sorted(station["pred"]) == [0.0, 10.0, 20.0]
+    assert set(station["target"]) == {STATION_TARGET}
+    assert not ((log["groupId"] == 4) & (log["target"] == "socPct") & (log["horizon"] == "1h")).any()
+    soc = log[(log["groupId"] == 2) & (log["target"] == "socPct")].set_index("horizon")["pred"]
+    assert soc.to_dict() == {"60s": 0.0, "5m": 10.0, "1h": 20.0}
+    assert read_prediction_log(log_path, start_ts=PRED_TS + 1).empty
+    assert len(read_prediction_log(log_path, targets=[STATION_TARGET])) == 3
+
+    full_copy = str(tmp_path / "full.db")
+    shutil.copy(synth_db, full_copy)
+    _truncate(synth_db, DATA_END)
+    partial = realized_vs_predicted(log_path, synth_db)
+    labels = _labels(full_copy)
+    for row in partial.itertuples(index=False):
+        if PRED_TS + HORIZONS_MS[row.horizon] > DATA_END:
+            # ts + h is not in the DB yet.
+            assert np.isnan(row.actual), row
+        else:
+            assert row.actual == _expected_actual(row, labels), row
+    assert partial["horizon"][partial["actual"].isna()].eq("1h").all()
+    assert partial["actual"].notna().sum() == n_rows - (4 * len(BMS_TARGETS) - 1 + 1)
+
+    shutil.copy(full_copy, synth_db)
+    full = realized_vs_predicted(log_path, synth_db)
+    assert full["actual"].notna().all()
+    for row in full.itertuples(index=False):
+        assert row.actual == _expected_actual(row, labels), row
+    np.testing.assert_array_equal(full["error"], full["pred"] - full["actual"])
+    # Rows covered before keep their value once more data arrives.
+    covered = partial["actual"].notna().to_numpy()
+    np.testing.assert_array_equal(full["actual"].to_numpy()[covered], partial["actual"].to_numpy()[covered])
+
+
+def test_forecasts_past_the_newest_data_stay_open(synth_db: str, tmp_path: Any) -> None:
+    log_path = str(tmp_path / "predictions.db")
+    append_predictions(log_path, _output(END_TS - 30_000))
+    out = realized_vs_predicted(log_path, synth_db, targets=["faultProbability", STATION_TARGET])
+    assert set(out["target"]) == {"faultProbability", STATION_TARGET}
+    # Fault labels would read 0 here; no horizon has elapsed.
+    assert out["actual"].isna().all() and out["error"].isna().all()
+
+    assert realized_vs_predicted(log_path, synth_db, start_ts=END_TS).empty
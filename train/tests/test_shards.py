@@ -0,0 +1,65 @@
+import os
+import sqlite3
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+
+from common import GROUP_TARGET_COLS
+from profiling import StageRecorder
+from shards import build_shards, load_shards
+from train import build_training_arrays
+
+
+def test_shards_equal_in_memory_arrays(synth_db: str, tmp_path: Any, train_args: Callable[..., Any]) -> None:
+    out_dir = str(tmp_path / "shards")
+    build_shards(synth_db, out_dir, chunk_ms=30 * 60_000)
+    manifest, shard_arrays = load_shards(out_dir)
+    assert len(manifest["chunks"]) == 4
+
+    station_cols, group_cols, arrays = build_training_arrays(
+        train_args(synth_db), StageRecorder(), None, None, list(GROUP_TARGET_COLS)
+    )
+    assert manifest["station_feature_cols"] == station_cols
+    assert manifest["group_feature_cols"] == group_cols
+    assert sorted(shard_arrays) == sorted(arrays)
+    # Shards hold group rows chunk by chunk, the in-memory build group by
+    # group; a stable sort on ts puts both in (ts, groupId) order.
+    order = np.argsort(arrays["group_ts"], kind="stable")
+    shard_order = np.argsort(np.asarray(shard_arrays["group_ts"]), kind="stable")
+    for name, arr in arrays.items():
+        got = np.asarray(shard_arrays[name])
+        if not name.startswith(("station_", "y_station_")):
+            arr, got = arr[order], got[shard_order]
+        assert got.dtype == arr.dtype, name
+        if arr.dtype.kind == "f":
+            np.testing.assert_array_equal(np.isnan(got), np.isnan(arr), err_msg=name)
+            np.testing.assert_allclose(got, arr, rtol=1e-6, atol=1e-9, err_msg=name)
+        else:
+            np.testing.assert_array_equal(got, arr, err_msg=name)
+
+
+def test_rebuild_replaces_an_earlier_build(synth_db: str, tmp_path: Any) -> None:
+    out_dir = str(tmp_path / "shards")
+    build_shards(synth_db, out_dir, chunk_ms=60 * 60_000)
+    build_shards(synth_db, out_dir, chunk_ms=60 * 60_000)
+    assert load_shards(out_dir)[0]["chunk_ms"] == 60 * 60_000
+
+
+def test_refuses_to_delete_other_directories(synth_db: str, tmp_path: Any) -> None:
+    out_dir = tmp_path / "data"
+    out_dir.mkdir()
+    (out_dir / "notes.txt").write_text("keep me")
+    with pytest.raises(ValueError):
+        build_shards(synth_db, str(out_dir))
+    assert (out_dir / "notes.txt").read_text() == "keep me"
+
+    build_shards(synth_db, str(out_dir), overwrite=True)
+    assert not (out_dir / "notes.txt").exists()
+
+
+def test_missing_db_is_not_created(tmp_path: Any) -> None:
+    db_path = str(tmp_path / "missing.db")
+    with pytest.raises(sqlite3.OperationalError):
+        build_shards(db_path, str(tmp_path / "shards"))
+    assert not os.path.exists(db_path)
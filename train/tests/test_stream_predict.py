@@ -0,0 +1,78 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+
+from stream_predict import Broadcaster, _serve_stream
+
+
+class _Writer:
+    """Collects what _serve_stream writes; drain() can be made to fail."""
+
+    def __init__(self, fail_drain_after: int = -1) -> None:
+        self.chunks: List[bytes] = []
+        self.fail_drain_after = fail_drain_after
+        self.drains = 0
+
+    def write(self, data: bytes) -> None:
+        self.chunks.append(data)
+
+    async def drain(self) -> None:
+        self.drains += 1
+        if self.drains == self.fail_drain_after:
+            raise ConnectionResetError()
+
+    def events(self) -> List[Any]:
+        return [
+            json.loads(line[len("data: ") :])
+            for line in b"".join(self.chunks).decode("utf-8").splitlines()
+            if line.startswith("data: ")
+        ]
+
+
+def test_cancel_propagates_and_unsubscribes() -> None:
+    async def scenario() -> _Writer:
+        predictor = SimpleNamespace(broadcaster=Broadcaster(queue_size=4))
+        writer = _Writer()
+        task = asyncio.ensure_future(_serve_stream(predictor, writer))  # type: ignore[arg-type]
+        await asyncio.sleep(0)
+        assert len(predictor.broadcaster.subscribers) == 1
+        predictor.broadcaster.publish({"ts": 1})
+        predictor.broadcaster.publish({"ts": 2})
+        await asyncio.sleep(0.01)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert predictor.broadcaster.subscribers == set()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert writer.chunks[0].startswith(b"HTTP/1.1 200 OK")
+    assert writer.events() == [{"ts": 1}, {"ts": 2}]
+
+
+def test_client_disconnect_ends_the_stream() -> None:
+    async def scenario() -> Broadcaster:
+        broadcaster = Broadcaster(queue_size=4)
+        broadcaster.publish({"ts": 1})
+        # The latest forecast is sent on connect; its drain fails.
+        await asyncio.wait_for(_serve_stream(SimpleNamespace(broadcaster=broadcaster), _Writer(1)), 1.0)  # type: ignore[arg-type]
+        return broadcaster
+
+    assert asyncio.run(scenario()).subscribers == set()
+
+
+def test_slow_subscriber_keeps_the_newest_forecasts() -> None:
+    async def scenario() -> None:
+        broadcaster = Broadcaster(queue_size=2)
+        q = broadcaster.subscribe()
+        for ts in range(5):
+            broadcaster.publish({"ts": ts})
+        assert broadcaster.dropped == 3
+        assert [q.get_nowait()["ts"], q.get_nowait()["ts"]] == [3, 4]
+        assert broadcaster.latest == {"ts": 4}
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+from typing import Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import common
+from common import load_data, read_station_targets, refresh_target_cache
+from conftest import END_TS
+
+
+def _hold_back(db_path: str, after_ts: int) -> List[Tuple[int, str]]:
+    """Deletes the coordination snapshots after after_ts and returns them."""
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT ts, json FROM coordination_units_snapshots WHERE ts > ? ORDER BY ts", (after_ts,)
+    ).fetchall()
+    conn.execute("DELETE FROM coordination_units_snapshots WHERE ts > ?", (after_ts,))
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def _append(db_path: str, rows: List[Tuple[int, str]]) -> None:
+    # Some of the newer snapshots carry no usable target.
+    payloads = {0: json.dumps([{"unitId": 1, "inputs": {"upper": {"targetPowerKw": None}}}]), 1: "[]", 2: "not json"}
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO coordination_units_snapshots(ts, json) VALUES (?, ?)",
+        [(ts, payloads.get(i % 10, payload)) for i, (ts, payload) in enumerate(rows)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _cached_ts(cache_path: str) -> List[int]:
+    cache = sqlite3.connect(cache_path)
+    try:
+        return [r[0] for r in cache.execute("SELECT ts FROM station_target_cache ORDER BY ts")]
+    finally:
+        cache.close()
+
+
+def _db_ts(db_path: str) -> List[int]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return [r[0] for r in conn.execute("SELECT ts FROM coordination_units_snapshots ORDER BY ts")]
+    finally:
+        conn.close()
+
+
+def _assert_same_station_df(db_path: str, cache_path: str, **window: Any) -> None:
+    cached = load_data(db_path, target_cache=cache_path, **window).station_df
+    assert _cached_ts(cache_path) == _db_ts(db_path)
+    plain = load_data(db_path, **window).station_df
+    pd.testing.assert_series_equal(cached["stationTargetPowerKw"], plain["stationTargetPowerKw"])
+    pd.testing.assert_frame_equal(cached, plain)
+
+
+def test_refreshed_cache_equals_decoding_the_db(synth_db: str, tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache_path = str(tmp_path / "cache" / "targets.db")
+    held = _hold_back(synth_db, END_TS - 30 * 60_000)
+    assert held
+
+    conn = sqlite3.connect(synth_db)
+    try:
+        first_upto = refresh_target_cache(cache_path, conn)
+    finally:
+        conn.close()
+    assert first_upto == END_TS - 30 * 60_000
+    _assert_same_station_df(synth_db, cache_path)
+
+    _append(synth_db, held)
+    conn = sqlite3.connect(synth_db)
+    try:
+        expected = read_station_targets(conn, None, None)
+        # Snapshots committed after the refresh come from the DB.
+        with monkeypatch.context() as m:
+            m.setattr(common, "refresh_target_cache", lambda _path, _conn: first_upto)
+            pd.testing.assert_frame_equal(read_station_targets(conn, None, None, cache_path), expected)
+        assert _cached_ts(cache_path)[-1] == first_upto
+        targets = read_station_targets(conn, None, None, cache_path)
+    finally:
+        conn.close()
+    assert _cached_ts(cache_path)[-1] == held[-1][0]
+    pd.testing.assert_frame_equal(targets, expected)
+    assert np.isnan(targets["stationTargetPowerKw"].to_numpy()).any()
+
+    _assert_same_station_df(synth_db, cache_path)
+    _assert_same_station_df(synth_db, cache_path, start_ts=END_TS - 45 * 60_000, end_ts=END_TS - 10 * 60_000)
+
+
+def test_cache_drops_rows_the_db_no_longer_has(synth_db: str, tmp_path: Any) -> None:
+    cache_path = str(tmp_path / "targets.db")
+    _assert_same_station_df(synth_db, cache_path)
+
+    # Retention removed the oldest snapshots.
+    conn = sqlite3.connect(synth_db)
+    conn.execute("DELETE FROM coordination_units_snapshots WHERE ts < ?", (END_TS - 60 * 60_000,))
+    conn.commit()
+    conn.close()
+    _assert_same_station_df(synth_db, cache_path)
+
+    # The newest cached snapshot is gone too: the cache is rebuilt.
+    _hold_back(synth_db, END_TS - 20 * 60_000)
+    _assert_same_station_df(synth_db, cache_path)
+
+
+def test_unwritable_cache_decodes_the_db(synth_db: str, tmp_path: Any) -> None:
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    cache_path = str(blocker / "targets.db")
+    cached = load_data(synth_db, target_cache=cache_path).station_df
+    pd.testing.assert_frame_equal(cached, load_data(synth_db).station_df)
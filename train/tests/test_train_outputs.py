@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Any
+
+import joblib
+
+TRAIN_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "train.py")
+
+
+def test_saved_metrics_equal_metrics_json(synth_db: str, tmp_path: Any) -> None:
+    out_dir = str(tmp_path / "out")
+    subprocess.run(
+        [sys.executable, TRAIN_PY, "--db", synth_db, "--out", out_dir, "--window-hours", "0", "--memory-report"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(os.path.join(out_dir, "metrics.json"), encoding="utf-8") as f:
+        written = json.load(f)
+    saved = joblib.load(os.path.join(out_dir, "model.joblib"))["metrics"]
+
+    assert written["fit"]["tasks"] > 0
+    assert written["compiled"]["ok"] and os.path.exists(os.path.join(out_dir, "model.npz"))
+    assert written["model_family"]["artifact_bytes"] == os.path.getsize(os.path.join(out_dir, "model.joblib"))
+    # Only what depends on the saved file itself is missing from model.joblib.
+    del written["model_family"]["artifact_bytes"], written["memory"]
+    assert json.loads(json.dumps(saved, ensure_ascii=False)) == written
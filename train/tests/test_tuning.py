@@ -0,0 +1,101 @@
+from typing import Dict
+
+import numpy as np
+import pytest
+
+import tuning
+from tuning import DEFAULT_PARAMS, MIN_ITER, MIN_TRAIN_ROWS, SEARCH_SPACE, candidate_params, time_split, tune_fit_tasks
+
+
+def test_candidates_start_with_the_defaults() -> None:
+    cands = candidate_params(27)
+    assert cands[0] == DEFAULT_PARAMS
+    assert len(cands) == 27
+    assert len({tuple(sorted(c.items())) for c in cands}) == 27
+    for c in cands:
+        assert all(c[k] in SEARCH_SPACE[k] for k in SEARCH_SPACE)
+    assert candidate_params(1) == [DEFAULT_PARAMS]
+
+
+def test_time_split_purges_labels_reaching_the_validation_slice() -> None:
+    ts = np.repeat(np.arange(1000, dtype=np.int64) * 1000, 3)
+    mask = np.ones(len(ts), dtype=bool)
+    mask[::7] = False
+    split = time_split(ts, mask, 60_000, 0.2)
+    assert split is not None
+    train, val = split
+    cutoff = ts[val].min()
+    assert cutoff == 800_000
+    assert (ts[train] + 60_000 < cutoff).all()
+    assert mask[train].all() and mask[val].all()
+    assert (np.diff(ts[train]) >= 0).all()
+    # Everything usable on either side of the gap is used.
+    assert len(train) + len(val) == int((mask & ((ts + 60_000 < cutoff) | (ts >= cutoff))).sum())
+
+    assert time_split(ts[:3 * MIN_TRAIN_ROWS], mask[:3 * MIN_TRAIN_ROWS], 60 * 60_000, 0.2) is None
+    assert time_split(ts, np.zeros(len(ts), dtype=bool), 60_000, 0.2) is None
+
+
+def _arrays(n_ts: int = 400, groups: int = 5) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    station_ts = np.arange(n_ts, dtype=np.int64) * 10_000
+    group_ts = np.repeat(station_ts, groups)
+    station_x = rng.normal(size=(n_ts, 4))
+    group_x = rng.normal(size=(len(group_ts), 4))
+    return {
+        "station_ts": station_ts,
+        "station_x": station_x,
+        "y_station_60s": station_x[:, 0] * 2.0 + rng.normal(scale=0.5, size=n_ts),
+        "group_ts": group_ts,
+        "group_x": group_x,
+        "y_socPct_60s": group_x[:, 1] + rng.normal(scale=0.5, size=len(group_ts)),
+        # Only the first rows are labeled: too few before the validation slice.
+        "y_temperatureC_60s": np.where(np.arange(len(group_ts)) < 100, group_x[:, 2], np.nan),
+        "y_fault_60s": (group_x[:, 0] + rng.normal(scale=0.5, size=len(group_ts)) > 1.0).astype(int),
+        "group_mask_all": np.ones(len(group_ts), dtype=bool),
+    }
+
+
+def test_tuned_settings_are_floored_and_fallbacks_reported() -> None:
+    tasks = [("station", "60s"), ("group", "60s", "socPct"), ("group", "60s", "temperatureC"), ("fault", "60s")]
+    hyperparams, report = tune_fit_tasks(tasks, _arrays(), n_candidates=3, latency_budget_ms=1e-6)
+
+    for params in (hyperparams["station"]["60s"], hyperparams["group"]["60s"]["socPct"], hyperparams["fault"]["60s"]):
+        assert params["max_iter"] >= MIN_ITER
+        assert params["early_stopping"] is False
+    for name in ("station/60s", "group/60s/socPct", "fault/60s"):
+        entry = report["tasks"][name]
+        # No model fits a 1 ns budget, and the floor keeps at least MIN_ITER trees.
+        assert entry["within_budget"] is False
+        assert "fallback" not in entry
+
+    assert "temperatureC" not in hyperparams["group"]["60s"]
+    assert report["skipped"] == ["group/60s/temperatureC"]
+    fallback = report["tasks"]["group/60s/temperatureC"]
+    assert fallback["params"] == DEFAULT_PARAMS
+    assert fallback["usable_rows"] == 100
+    assert "training rows" in fallback["fallback"]
+
+
+def test_single_class_classifier_falls_back_to_the_defaults() -> None:
+    arrays = _arrays()
+    arrays["y_fault_60s"] = np.zeros(len(arrays["group_ts"]), dtype=int)
+    arrays["y_fault_60s"][-50:] = 1
+    hyperparams, report = tune_fit_tasks([("fault", "60s")], arrays, n_candidates=3)
+
+    assert hyperparams == {}
+    assert report["skipped"] == ["fault/60s"]
+    assert report["tasks"]["fault/60s"]["fallback"] == "no finite validation score"
+    assert report["tasks"]["fault/60s"]["params"] == DEFAULT_PARAMS
+
+
+def test_staged_search_without_fit_validation(monkeypatch: pytest.MonkeyPatch) -> None:
+    # The scikit-learn < 1.6 path, whatever version runs the tests.
+    monkeypatch.setattr(tuning, "FIT_TAKES_VAL", False)
+    tasks = [("station", "60s"), ("fault", "60s")]
+    hyperparams, report = tune_fit_tasks(tasks, _arrays(), n_candidates=3)
+
+    for params, name in ((hyperparams["station"]["60s"], "station/60s"), (hyperparams["fault"]["60s"], "fault/60s")):
+        assert MIN_ITER <= params["max_iter"] <= max(SEARCH_SPACE["max_iter"])
+        assert params["early_stopping"] is False
+        assert np.isfinite(report["tasks"][name]["val_score"])
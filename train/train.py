@@ -1,24 +1,39 @@
 import argparse
+import inspect
+import io
 import json
 import os
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import joblib
 import numpy as np
+import sklearn
 from sklearn.ensemble import HistGradientBoostingClassifier, HistGradientBoostingRegressor
 from sklearn.metrics import mean_absolute_error, roc_auc_score
 
+from array_pool import WORKER_ARRAYS, array_pool
 from common import (
+    GROUP_TARGET_COLS,
     HORIZONS_MS,
-    add_fault_labels_by_horizon,
-    add_warning_labels_by_horizon,
-    merge_risk_labels_from_future_counts,
-    add_future_targets_by_horizon,
+    STATION_TARGET_COLS,
     build_group_features,
     build_station_features,
     load_data,
 )
+from compiled_models import compare_models, load_compiled, write_compiled
+from feature_selection import prune_features, select_feature_columns
+from feature_store import RETAIN_MS
+from group_models import MultiOutputGroupRegressor
+from incremental import concat_arrays, final_label_ts, load_cache, rows_in_range, save_cache
+from profiling import StageRecorder, cprofile_to, recording, write_profile
+from shards import label_frames, load_shards, training_arrays
+from tuning import task_params, tune_fit_tasks
+
+
+GROUP_REGRESSOR_MIN_ROWS = 200
+STATION_REGRESSOR_MIN_ROWS = 50
+COMPILE_CHECK_ROWS = 2000
 
 
 def _safe_auc(y_true: np.ndarray, y_prob: np.ndarray) -> float:
@@ -30,13 +45,569 @@ def _safe_auc(y_true: np.ndarray, y_prob: np.ndarray) -> float:
         return float("nan")
 
 
+# Parameters (after self) of the private BaseHistGradientBoosting._bin_data
+# that _continue_boosting replaces: scikit-learn 1.4-1.5 and 1.6+.
+_BIN_DATA_PARAMS = (("X", "is_training_data"), ("X", "sample_weight", "is_training_data"))
+
+
+def warm_start_supported() -> bool:
+    """Whether _continue_boosting can patch this scikit-learn's binning."""
+
+    bin_data = getattr(HistGradientBoostingRegressor, "_bin_data", None)
+    if bin_data is None:
+        return False
+    try:
+        params = tuple(inspect.signature(bin_data).parameters)[1:]
+    except (TypeError, ValueError):
+        return False
+    return params in _BIN_DATA_PARAMS
+
+
+def _continue_boosting(model: Any, x: np.ndarray, y: np.ndarray, extra_iter: int) -> None:
+    """Add extra_iter boosting iterations to a fitted HistGradientBoosting model.
+
+    fit() with warm_start refits the bin mapper on the new data, but the
+    existing trees' bin thresholds refer to the old bins, so the raw
+    predictions boosting continues from would be computed with the wrong
+    bins. Keep the old mapper for the added trees instead. Only call this
+    when warm_start_supported().
+    """
+
+    mapper = model._bin_mapper
+
+    def bin_data(x_in: np.ndarray, *args: Any, is_training_data: bool) -> np.ndarray:
+        # args: sample_weight on scikit-learn 1.6+, nothing before.
+        model._bin_mapper = mapper
+        binned = mapper.transform(x_in)
+        return np.asfortranarray(binned) if is_training_data else np.ascontiguousarray(binned)
+
+    model.set_params(warm_start=True, max_iter=model.n_iter_ + extra_iter)
+    model._bin_data = bin_data
+    try:
+        model.fit(x, y)
+    finally:
+        del model._bin_data
+        model.set_params(warm_start=False)
+
+
+def _fit_hgb(
+    cls: Any,
+    x: np.ndarray,
+    y: np.ndarray,
+    prev: Any = None,
+    extra_iter: int = 0,
+    params: Optional[Dict[str, Any]] = None,
+) -> Any:
+    if prev is not None and isinstance(prev, cls) and extra_iter > 0:
+        _continue_boosting(prev, x, y, extra_iter)
+        return prev
+    model = cls(**{"max_depth": 6, **(params or {})}, random_state=0)
+    model.fit(x, y)
+    return model
+
+
+def _run_fit_task(
+    task: Tuple[Any, ...],
+    prev: Any = None,
+    extra_iter: int = 0,
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[Any, Dict[str, Any], float]:
+    # prev: the model of the same task from the previous run, continued for
+    # extra_iter iterations instead of fitting from scratch (--incremental).
+    # params: HistGradientBoosting settings from --tune.
+    t0 = time.perf_counter()
+    kind = task[0]
+    if kind == "station":
+        h_key = task[1]
+        x = WORKER_ARRAYS["station_x"]
+        y = np.asarray(WORKER_ARRAYS[f"y_station_{h_key}"])
+        mask = np.isfinite(y)
+        model = _fit_hgb(HistGradientBoostingRegressor, x[mask], y[mask], prev, extra_iter, params)
+        pred = model.predict(x[mask])
+        metrics = {"mae": float(mean_absolute_error(y[mask], pred)), "n": int(mask.sum())}
+    elif kind == "group":
+        h_key, col = task[1], task[2]
+        x = WORKER_ARRAYS["group_x"]
+        y = np.asarray(WORKER_ARRAYS[f"y_{col}_{h_key}"])
+        mask = np.isfinite(y)
+        model = _fit_hgb(HistGradientBoostingRegressor, x[mask], y[mask], prev, extra_iter, params)
+        pred = model.predict(x[mask])
+        metrics = {"mae": float(mean_absolute_error(y[mask], pred)), "n": int(mask.sum())}
+    elif kind == "group_multi":
+        outputs = task[1]
+        x = WORKER_ARRAYS["group_x"]
+        mask = np.asarray(WORKER_ARRAYS["multi_mask"])
+        y = np.asarray(WORKER_ARRAYS["multi_y"])[mask]
+        model = MultiOutputGroupRegressor(outputs, random_state=0)
+        model.fit(x[mask], y)
+        pred = model.predict(x[mask])
+        metrics = {
+            f"{h_key}/{col}": {"mae": float(mean_absolute_error(y[:, j], pred[:, j])), "n": int(mask.sum())}
+            for j, (h_key, col) in enumerate(outputs)
+        }
+    else:
+        # "fault" / "warning" classifiers
+        h_key = task[1]
+        x = WORKER_ARRAYS["group_x"]
+        mask = np.asarray(WORKER_ARRAYS["group_mask_all"])
+        y = np.asarray(WORKER_ARRAYS[f"y_{kind}_{h_key}"])
+        model = _fit_hgb(HistGradientBoostingClassifier, x[mask], y[mask], prev, extra_iter, params)
+        prob = model.predict_proba(x[mask])[:, 1]
+        metrics = {"auc": _safe_auc(y[mask], prob), "n": int(mask.sum())}
+    return model, metrics, time.perf_counter() - t0
+
+
+def _multi_output_plan(
+    arrays: Dict[str, np.ndarray],
+    group_targets: List[str],
+) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+    # A row is usable only when every output is known, so add horizons from the
+    # shortest up while enough fully-labelled rows remain.
+    outputs: List[Tuple[str, str]] = []
+    mask = np.ones(len(arrays["group_x"]), dtype=bool)
+    for h_key in HORIZONS_MS.keys():
+        cand_mask = mask.copy()
+        for col in group_targets:
+            cand_mask &= np.isfinite(arrays[f"y_{col}_{h_key}"])
+        if cand_mask.sum() < GROUP_REGRESSOR_MIN_ROWS:
+            break
+        outputs.extend((h_key, col) for col in group_targets)
+        mask = cand_mask
+    return outputs, mask
+
+
+def plan_fit_tasks(
+    arrays: Dict[str, np.ndarray],
+    group_targets: List[str],
+    model_family: str,
+) -> List[Tuple[Any, ...]]:
+    """List the independent fits in the order the artifacts are assembled.
+
+    Adds the multi-output label matrix to `arrays` when that family is used.
+    """
+
+    tasks: List[Tuple[Any, ...]] = []
+    for h_key in HORIZONS_MS.keys():
+        if np.isfinite(arrays[f"y_station_{h_key}"]).sum() >= STATION_REGRESSOR_MIN_ROWS:
+            tasks.append(("station", h_key))
+
+    if model_family == "per-target":
+        for h_key in HORIZONS_MS.keys():
+            for col in group_targets:
+                if np.isfinite(arrays[f"y_{col}_{h_key}"]).sum() >= GROUP_REGRESSOR_MIN_ROWS:
+                    tasks.append(("group", h_key, col))
+    elif model_family == "multi-output":
+        outputs, mask = _multi_output_plan(arrays, group_targets)
+        if outputs:
+            arrays["multi_mask"] = mask
+            arrays["multi_y"] = np.column_stack([arrays[f"y_{col}_{h_key}"] for h_key, col in outputs])
+            tasks.append(("group_multi", outputs))
+
+    mask_all = arrays["group_mask_all"]
+    if mask_all.sum() >= GROUP_REGRESSOR_MIN_ROWS:
+        for h_key in HORIZONS_MS.keys():
+            for kind in ("fault", "warning"):
+                if len(np.unique(arrays[f"y_{kind}_{h_key}"][mask_all])) >= 2:
+                    tasks.append((kind, h_key))
+    return tasks
+
+
+def run_fit_tasks(
+    tasks: List[Tuple[Any, ...]],
+    arrays: Dict[str, np.ndarray],
+    jobs: int = 1,
+    array_paths: Optional[Dict[str, str]] = None,
+    prev_models: Optional[List[Any]] = None,
+    extra_iter: int = 0,
+    fit_params: Optional[List[Optional[Dict[str, Any]]]] = None,
+) -> List[Tuple[Any, Dict[str, Any], float]]:
+    """Fit every task, in a process pool when jobs > 1.
+
+    array_paths lists arrays that already exist as .npy files (e.g. shards);
+    workers map those directly instead of getting a private copy. prev_models
+    (one entry per task, None to fit from scratch) are warm-started with
+    extra_iter more boosting iterations. fit_params (one entry per task, None
+    for the defaults) are the tuned HistGradientBoosting settings.
+    """
+
+    prevs = prev_models if prev_models is not None else [None] * len(tasks)
+    iters = [extra_iter] * len(tasks)
+    params = fit_params if fit_params is not None else [None] * len(tasks)
+    jobs = min(jobs, len(tasks))
+    with array_pool(arrays, jobs, array_paths) as pool:
+        if pool is None:
+            return [_run_fit_task(t, p, extra_iter, tp) for t, p, tp in zip(tasks, prevs, params)]
+        return list(pool.map(_run_fit_task, tasks, prevs, iters, params))
+
+
+def collect_fit_results(
+    artifacts: Dict[str, Any],
+    tasks: List[Tuple[Any, ...]],
+    results: List[Tuple[Any, Dict[str, Any], float]],
+) -> float:
+    """Store fitted models and metrics in artifacts; returns the group fit seconds."""
+
+    for h_key in HORIZONS_MS.keys():
+        artifacts["models"]["group"].setdefault(h_key, {})
+        artifacts["metrics"]["group"].setdefault(h_key, {})
+
+    group_fit_s = 0.0
+    for task, (model, metrics, seconds) in zip(tasks, results):
+        kind = task[0]
+        if kind == "station":
+            artifacts["models"]["station"][task[1]] = model
+            artifacts["metrics"]["station"][task[1]] = metrics
+        elif kind == "group":
+            artifacts["models"]["group"][task[1]][task[2]] = model
+            artifacts["metrics"]["group"][task[1]][task[2]] = metrics
+            group_fit_s += seconds
+        elif kind == "group_multi":
+            artifacts["models"]["group_multi"] = model
+            for h_key, col in task[1]:
+                artifacts["metrics"]["group"][h_key][col] = metrics[f"{h_key}/{col}"]
+            group_fit_s += seconds
+        else:
+            artifacts["models"][kind][task[1]] = model
+            artifacts["metrics"][kind][task[1]] = metrics
+    return group_fit_s
+
+
+def _pickled_bytes(obj: Any) -> int:
+    buf = io.BytesIO()
+    joblib.dump(obj, buf)
+    return buf.tell()
+
+
+def per_target_baseline(
+    arrays: Dict[str, np.ndarray],
+    group_targets: List[str],
+    jobs: int = 1,
+    array_paths: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Fit the per-target group regressors only to report them next to multi-output.
+
+    The models are not kept; the result has the same keys as
+    metrics["model_family"] plus the per-(horizon, target) metrics.
+    """
+
+    tasks = [t for t in plan_fit_tasks(arrays, group_targets, "per-target") if t[0] == "group"]
+    results = run_fit_tasks(tasks, arrays, jobs=jobs, array_paths=array_paths)
+    models: Dict[str, Dict[str, Any]] = {}
+    metrics: Dict[str, Dict[str, Any]] = {}
+    for task, (model, task_metrics, _) in zip(tasks, results):
+        models.setdefault(task[1], {})[task[2]] = model
+        metrics.setdefault(task[1], {})[task[2]] = task_metrics
+    return {
+        "name": "per-target",
+        "group_regressors": len(tasks),
+        "group_fit_s": float(sum(seconds for _, _, seconds in results)),
+        "group_model_bytes": _pickled_bytes(models),
+        "group": metrics,
+    }
+
+
+def _sample_rows(x: np.ndarray, n: int) -> np.ndarray:
+    if len(x) <= n:
+        return np.asarray(x)
+    return np.asarray(x[np.linspace(0, len(x) - 1, n).astype(np.int64)])
+
+
+def build_training_arrays(
+    args: argparse.Namespace,
+    recorder: StageRecorder,
+    start_ts: Optional[int],
+    end_ts: Optional[int],
+    group_targets: List[str],
+    station_cols: Optional[List[str]] = None,
+    group_cols: Optional[List[str]] = None,
+) -> Tuple[List[str], List[str], Dict[str, np.ndarray]]:
+    # station_cols/group_cols: only build these features (--features-from).
+    with recorder.stage("load_data") as rec:
+        loaded = load_data(
+            args.db,
+            start_ts=start_ts,
+            end_ts=end_ts,
+            compact=args.compact,
+            target_cache=args.target_cache,
+            group_ring=args.group_ring,
+        )
+        rec["rows"] = int(len(loaded.group_df))
+
+    with recorder.stage("station_features") as rec:
+        station_feat_df, station_feature_cols = build_station_features(
+            loaded.station_df, loaded.group_df, compact=args.compact, feature_cols=station_cols
+        )
+        rec["rows"] = int(len(station_feat_df))
+    with recorder.stage("group_features") as rec:
+        group_feat_df, group_feature_cols = build_group_features(
+            station_feat_df,
+            loaded.group_df,
+            engine=args.feature_engine,
+            compact=args.compact,
+            workers=args.workers,
+            feature_cols=group_cols,
+        )
+        rec["rows"] = int(len(group_feat_df))
+        rec["frame_mb"] = round(group_feat_df.memory_usage(deep=False).sum() / (1024.0 * 1024.0), 1)
+
+    with recorder.stage("labels") as rec:
+        station_all, group_all = label_frames(
+            station_feat_df, group_feat_df, loaded.alarm_occurrences, group_targets, STATION_TARGET_COLS
+        )
+        rec["rows"] = int(len(group_all))
+        del group_feat_df
+
+    with recorder.stage("arrays") as rec:
+        arrays = training_arrays(
+            station_all,
+            group_all,
+            station_feature_cols,
+            group_feature_cols,
+            group_targets,
+            x_dtype=np.float32 if args.compact else np.float64,
+        )
+        rec["rows"] = int(len(arrays["group_x"]))
+        rec["group_x_mb"] = round(arrays["group_x"].nbytes / (1024.0 * 1024.0), 1)
+    return station_feature_cols, group_feature_cols, arrays
+
+
+def incremental_training_arrays(
+    args: argparse.Namespace,
+    recorder: StageRecorder,
+    start_ts: Optional[int],
+    group_targets: List[str],
+    station_cols: Optional[List[str]] = None,
+    group_cols: Optional[List[str]] = None,
+) -> Tuple[List[str], List[str], Dict[str, np.ndarray], Dict[str, Any]]:
+    """build_training_arrays for --incremental: cached final rows plus the newer rows.
+
+    Also returns a summary; its "full_refit" is True when the models should be
+    fitted from scratch (no usable cache, --full-refit, or every
+    --full-refit-every runs).
+    """
+
+    cache_dir = os.path.join(args.out, "train_cache")
+    settings = {
+        "db_path": os.path.abspath(args.db),
+        "horizons_ms": HORIZONS_MS,
+        "compact": bool(args.compact),
+        "feature_engine": args.feature_engine,
+        "group_targets": group_targets,
+        "feature_cols": [station_cols, group_cols],
+    }
+    info: Dict[str, Any] = {"cached_rows": 0, "new_rows": 0}
+    cached = None
+    with recorder.stage("load_cache"):
+        if not args.full_refit:
+            cached = load_cache(cache_dir, settings)
+
+    arrays = None
+    runs_since_full = 0
+    if cached is not None:
+        manifest, cache_arrays = cached
+        since = int(manifest["final_ts"])
+        station_feature_cols, group_feature_cols, fresh = build_training_arrays(
+            args, recorder, since + 1 - RETAIN_MS, None, group_targets, station_cols, group_cols
+        )
+        if [station_feature_cols, group_feature_cols] == [
+            manifest["station_feature_cols"],
+            manifest["group_feature_cols"],
+        ]:
+            fresh = rows_in_range(fresh, after_ts=since)
+            arrays = concat_arrays(cache_arrays, fresh)
+            info["cached_rows"] = int(len(cache_arrays["group_x"]))
+            info["new_rows"] = int(len(fresh["group_x"]))
+            runs_since_full = int(manifest.get("runs_since_full", 0)) + 1
+            if runs_since_full >= args.full_refit_every:
+                info["reason"] = f"every {args.full_refit_every} runs"
+        else:
+            info["reason"] = "feature columns changed"
+    else:
+        info["reason"] = "--full-refit" if args.full_refit else "no cache"
+
+    if arrays is None:
+        station_feature_cols, group_feature_cols, arrays = build_training_arrays(
+            args, recorder, start_ts, None, group_targets, station_cols, group_cols
+        )
+        info["new_rows"] = int(len(arrays["group_x"]))
+    elif start_ts is not None:
+        arrays = rows_in_range(arrays, after_ts=start_ts - 1)
+
+    info["full_refit"] = "reason" in info
+    if info["full_refit"]:
+        runs_since_full = 0
+    final_ts = final_label_ts(arrays)
+    if final_ts is not None:
+        with recorder.stage("save_cache") as rec:
+            final = rows_in_range(arrays, upto_ts=final_ts)
+            save_cache(
+                cache_dir,
+                {
+                    "settings": settings,
+                    "final_ts": final_ts,
+                    "station_feature_cols": station_feature_cols,
+                    "group_feature_cols": group_feature_cols,
+                    "runs_since_full": runs_since_full,
+                },
+                final,
+            )
+            rec["rows"] = int(len(final["group_x"]))
+    info["runs_since_full"] = runs_since_full
+    return station_feature_cols, group_feature_cols, arrays, info
+
+
+def _previous_models(
+    model_path: str,
+    tasks: List[Tuple[Any, ...]],
+    station_feature_cols: List[str],
+    group_feature_cols: List[str],
+) -> Optional[List[Any]]:
+    # Models of the last run to warm-start, one per task (None: fit from
+    # scratch). The multi-output ExtraTrees model has no boosting to continue.
+    if not os.path.exists(model_path):
+        return None
+    prev = joblib.load(model_path)
+    if prev.get("station_feature_cols") != station_feature_cols or prev.get("group_feature_cols") != group_feature_cols:
+        return None
+    models = prev["models"]
+    out: List[Any] = []
+    for task in tasks:
+        kind = task[0]
+        if kind == "station":
+            out.append(models["station"].get(task[1]))
+        elif kind == "group":
+            out.append(models["group"].get(task[1], {}).get(task[2]))
+        elif kind in ("fault", "warning"):
+            out.append(models[kind].get(task[1]))
+        else:
+            out.append(None)
+    return out
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default=os.path.join("server", "data", "energy-monitor.db"))
     ap.add_argument("--out", default=os.path.join("train", "artifacts"))
     ap.add_argument("--window-hours", type=float, default=12.0)
+    ap.add_argument(
+        "--model-family",
+        choices=["per-target", "multi-output"],
+        default="per-target",
+        help="per-target: one regressor per (horizon, target); multi-output: one model for all group targets (faster to fit, much less accurate)",
+    )
+    ap.add_argument(
+        "--compare-per-target",
+        action="store_true",
+        help="With --model-family multi-output, also fit (and discard) the per-target group regressors and report them in metrics.json",
+    )
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes for the independent model fits")
+    ap.add_argument(
+        "--feature-engine",
+        choices=["pandas", "numpy"],
+        default="pandas",
+        help="Group rolling features: per-group pandas rolling or the vectorized NumPy engine",
+    )
+    ap.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep telemetry, features and model inputs as float32 (groupId int32, ts int64)",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes for the pandas engine's per-group rolling features (same output as 1)",
+    )
+    ap.add_argument("--memory-report", action="store_true", help="Report wall time and peak RSS per pipeline stage")
+    ap.add_argument("--shards", default=None, help="Train from a shards.py output directory instead of --db")
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the training rows cached in <out>/train_cache, build only newer rows and warm-start the previous models",
+    )
+    ap.add_argument("--warm-iter", type=int, default=20, help="Boosting iterations added per model by an --incremental run")
+    ap.add_argument(
+        "--full-refit-every",
+        type=int,
+        default=24,
+        help="With --incremental, fit from scratch every N runs instead of warm-starting",
+    )
+    ap.add_argument("--full-refit", action="store_true", help="With --incremental, rebuild the cache and fit from scratch")
+    ap.add_argument(
+        "--tune",
+        action="store_true",
+        help="Successive-halving search of per-target tree count, depth, learning rate and max_bins before the final fits",
+    )
+    ap.add_argument("--tune-candidates", type=int, default=27, help="Settings tried per target in the first --tune rung")
+    ap.add_argument(
+        "--tune-val-fraction",
+        type=float,
+        default=0.2,
+        help="Newest fraction of timestamps used as the --tune early-stopping/validation slice",
+    )
+    ap.add_argument(
+        "--latency-budget-ms",
+        type=float,
+        default=None,
+        help="With --tune, only pick settings whose compiled model predicts one snapshot within this time",
+    )
+    ap.add_argument(
+        "--prune-features",
+        action="store_true",
+        help="Drop the station/group features with the least split gain and refit; predict.py then builds only the kept ones",
+    )
+    ap.add_argument(
+        "--prune-keep-importance",
+        type=float,
+        default=0.99,
+        help="Share of the total split gain the features kept by --prune-features must carry",
+    )
+    ap.add_argument(
+        "--features-from",
+        default=None,
+        help="Build only the feature columns of this model.joblib (e.g. one trained with --prune-features)",
+    )
+    ap.add_argument(
+        "--tuned-params",
+        default=None,
+        help="Fit with the settings stored in this model.joblib by an earlier --tune run",
+    )
+    ap.add_argument("--target-cache", default=None, help="SQLite file caching stationTargetPowerKw per ts; filled incrementally from the coordination snapshots")
+    ap.add_argument(
+        "--group-ring",
+        default=None,
+        help="Ring file kept warm by ingest_sink.py; group rows are read from it instead of SQLite when it covers the window",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store_true",
+        help="Add wall/CPU time, rows and peak RSS of every stage and sub-stage to the output",
+    )
+    ap.add_argument("--profile-out", default=None, help="Write the stage profile JSON to this file")
+    ap.add_argument("--cprofile-out", default=None, help="Dump cProfile stats of the whole run to this file")
     args = ap.parse_args()
+    if args.incremental and args.shards:
+        ap.error("--incremental builds its rows from --db; it cannot be combined with --shards")
+    if args.incremental and args.prune_features:
+        ap.error("--incremental needs fixed feature columns; prune once, then pass that model as --features-from")
+
+    recorder = StageRecorder(enabled=bool(args.memory_report or args.profile or args.profile_out))
+    with recording(recorder), cprofile_to(args.cprofile_out):
+        result = run_training(args, recorder)
+    if args.memory_report:
+        result["memory"] = recorder.report()
+    if args.profile or args.profile_out:
+        profile = recorder.profile()
+        if args.profile_out:
+            write_profile(args.profile_out, profile)
+            result["profile_path"] = args.profile_out
+        if args.profile:
+            result["profile"] = profile
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
 
+def run_training(args: argparse.Namespace, recorder: StageRecorder) -> Dict[str, Any]:
     db_path = args.db
     out_dir = args.out
     os.makedirs(out_dir, exist_ok=True)
@@ -47,36 +618,69 @@ def main() -> int:
         end_ts = None
         start_ts = int(time.time() * 1000) - int(args.window_hours * 60 * 60 * 1000)
 
-    loaded = load_data(db_path, start_ts=start_ts, end_ts=end_ts)
-
-    station_feat_df, station_feature_cols = build_station_features(loaded.station_df, loaded.group_df)
-    group_feat_df, group_feature_cols = build_group_features(station_feat_df, loaded.group_df)
-
-    group_targets = [
-        "bms_socPct",
-        "bms_temperatureC",
-        "bms_insulationResistanceKohm",
-        "bms_deltaCellVoltageMv",
-        "pcs_actualKw",
-    ]
-
-    station_targets = ["stationTargetPowerKw"]
-
-    group_all = add_future_targets_by_horizon(group_feat_df, HORIZONS_MS, group_targets)
-    group_all = add_fault_labels_by_horizon(group_all, loaded.alarm_occurrences, HORIZONS_MS)
-    group_all = add_warning_labels_by_horizon(group_all, loaded.alarm_occurrences, HORIZONS_MS)
-    group_all = merge_risk_labels_from_future_counts(group_all, HORIZONS_MS)
-
-    station_all = station_feat_df.copy().sort_values("ts").reset_index(drop=True)
-    for h_key, h_ms in HORIZONS_MS.items():
-        for col in station_targets:
-            y = np.full(len(station_all), np.nan)
-            ts = station_all["ts"].to_numpy(dtype=np.int64)
-            idx = np.searchsorted(ts, ts + np.int64(h_ms), side="left")
-            valid = idx < len(ts)
-            vals = station_all[col].to_numpy(dtype=float)
-            y[valid] = vals[idx[valid]]
-            station_all[f"y_{col}_{h_key}"] = y
+    group_targets = list(GROUP_TARGET_COLS)
+    wanted_station = wanted_group = None
+    if args.features_from:
+        source = joblib.load(args.features_from)
+        wanted_station = list(source["station_feature_cols"])
+        wanted_group = list(source["group_feature_cols"])
+
+    array_paths: Dict[str, str] = {}
+    if args.shards:
+        with recorder.stage("load_shards") as rec:
+            manifest, arrays = load_shards(args.shards)
+            group_targets = list(manifest["group_targets"])
+            station_feature_cols = list(manifest["station_feature_cols"])
+            group_feature_cols = list(manifest["group_feature_cols"])
+            db_path = str(manifest["db_path"])
+            array_paths = {name: os.path.join(args.shards, f"{name}.npy") for name in arrays.keys()}
+            rec["rows"] = int(len(arrays["group_x"]))
+        if wanted_station is not None and wanted_group is not None:
+            arrays = select_feature_columns(
+                arrays, station_feature_cols, group_feature_cols, wanted_station, wanted_group
+            )
+            array_paths = {k: v for k, v in array_paths.items() if k not in ("station_x", "group_x")}
+            station_feature_cols, group_feature_cols = wanted_station, wanted_group
+    elif args.incremental:
+        station_feature_cols, group_feature_cols, arrays, incremental = incremental_training_arrays(
+            args, recorder, start_ts, group_targets, wanted_station, wanted_group
+        )
+    else:
+        station_feature_cols, group_feature_cols, arrays = build_training_arrays(
+            args, recorder, start_ts, end_ts, group_targets, wanted_station, wanted_group
+        )
+
+    model_path = os.path.join(out_dir, "model.joblib")
+    tasks = plan_fit_tasks(arrays, group_targets, args.model_family)
+    metrics: Dict[str, Any] = {"station": {}, "group": {}, "fault": {}, "warning": {}}
+
+    hyperparams: Dict[str, Any] = {}
+    if not args.tune and (args.tuned_params or (args.incremental and os.path.exists(model_path))):
+        # --incremental keeps the settings of the model it replaces.
+        hyperparams = joblib.load(args.tuned_params or model_path).get("hyperparams") or {}
+
+    if args.prune_features:
+        # Fit once on every column, then keep the columns carrying
+        # --prune-keep-importance of the split gain and fit again below.
+        with recorder.stage("prune_features") as rec:
+            prune_t0 = time.perf_counter()
+            results = run_fit_tasks(
+                tasks,
+                arrays,
+                jobs=args.jobs,
+                array_paths=array_paths,
+                fit_params=[task_params(hyperparams, t) for t in tasks],
+            )
+            keep_station, keep_group, pruning = prune_features(
+                tasks, [r[0] for r in results], station_feature_cols, group_feature_cols, args.prune_keep_importance
+            )
+            del results
+            arrays = select_feature_columns(arrays, station_feature_cols, group_feature_cols, keep_station, keep_group)
+            array_paths = {k: v for k, v in array_paths.items() if k not in ("station_x", "group_x")}
+            station_feature_cols, group_feature_cols = keep_station, keep_group
+            pruning["full_fit_wall_s"] = time.perf_counter() - prune_t0
+            rec["kept"] = len(keep_station) + len(keep_group)
+        metrics["feature_pruning"] = pruning
 
     artifacts: Dict[str, Any] = {
         "trained_at_ms": int(time.time() * 1000),
@@ -85,73 +689,127 @@ def main() -> int:
         "station_feature_cols": station_feature_cols,
         "group_feature_cols": group_feature_cols,
         "models": {"station": {}, "group": {}, "fault": {}, "warning": {}},
-        "metrics": {"station": {}, "group": {}, "fault": {}, "warning": {}},
+        "metrics": metrics,
     }
 
-    station_x = station_all[station_feature_cols].to_numpy(dtype=float)
+    if args.tune:
+        with recorder.stage("tune") as rec:
+            hyperparams, tuning = tune_fit_tasks(
+                tasks,
+                arrays,
+                jobs=args.jobs,
+                array_paths=array_paths,
+                n_candidates=args.tune_candidates,
+                val_fraction=args.tune_val_fraction,
+                latency_budget_ms=args.latency_budget_ms,
+            )
+            rec["trials"] = tuning["trials"]
+        artifacts["metrics"]["tuning"] = tuning
+        if args.incremental and not incremental["full_refit"]:
+            incremental.update(full_refit=True, reason="--tune", runs_since_full=0)
+    artifacts["hyperparams"] = hyperparams
 
-    for h_key in HORIZONS_MS.keys():
-        y_col = f"y_stationTargetPowerKw_{h_key}"
-        y = station_all[y_col].to_numpy(dtype=float)
-        mask = np.isfinite(y)
-        if mask.sum() < 50:
-            continue
-        model = HistGradientBoostingRegressor(max_depth=6, random_state=0)
-        model.fit(station_x[mask], y[mask])
-        pred = model.predict(station_x[mask])
-        mae = float(mean_absolute_error(y[mask], pred))
-        artifacts["models"]["station"][h_key] = model
-        artifacts["metrics"]["station"][h_key] = {"mae": mae, "n": int(mask.sum())}
+    prev_models = None
+    if args.incremental and not incremental["full_refit"] and not warm_start_supported():
+        incremental.update(
+            full_refit=True, reason=f"no warm start on scikit-learn {sklearn.__version__}", runs_since_full=0
+        )
+    if args.incremental and not incremental["full_refit"]:
+        prev_models = _previous_models(model_path, tasks, station_feature_cols, group_feature_cols)
+        if prev_models is None:
+            incremental.update(full_refit=True, reason="no previous model", runs_since_full=0)
+    with recorder.stage("fit") as rec:
+        rec["rows"] = int(len(arrays["group_x"]))
+        rec["tasks"] = len(tasks)
+        fit_t0 = time.perf_counter()
+        results = run_fit_tasks(
+            tasks,
+            arrays,
+            jobs=args.jobs,
+            array_paths=array_paths,
+            prev_models=prev_models,
+            extra_iter=args.warm_iter,
+            fit_params=[task_params(hyperparams, t) for t in tasks],
+        )
+        fit_wall_s = time.perf_counter() - fit_t0
 
-    group_x = group_all[group_feature_cols].to_numpy(dtype=float)
+    group_fit_s = collect_fit_results(artifacts, tasks, results)
 
-    for h_key in HORIZONS_MS.keys():
-        artifacts["models"]["group"][h_key] = {}
-        artifacts["metrics"]["group"][h_key] = {}
-        for col in group_targets:
-            y_col = f"y_{col}_{h_key}"
-            y = group_all[y_col].to_numpy(dtype=float)
-            mask = np.isfinite(y)
-            if mask.sum() < 200:
-                continue
-            model = HistGradientBoostingRegressor(max_depth=6, random_state=0)
-            model.fit(group_x[mask], y[mask])
-            pred = model.predict(group_x[mask])
-            mae = float(mean_absolute_error(y[mask], pred))
-            artifacts["models"]["group"][h_key][col] = model
-            artifacts["metrics"]["group"][h_key][col] = {"mae": mae, "n": int(mask.sum())}
-
-        mask_all = np.isfinite(group_x).all(axis=1)
-        if mask_all.sum() < 200:
-            continue
-
-        y_fault = group_all[f"y_fault_{h_key}"].to_numpy(dtype=int)
-        if len(np.unique(y_fault[mask_all])) >= 2:
-            clf_fault = HistGradientBoostingClassifier(max_depth=6, random_state=0)
-            clf_fault.fit(group_x[mask_all], y_fault[mask_all])
-            prob_fault = clf_fault.predict_proba(group_x[mask_all])[:, 1]
-            auc_fault = _safe_auc(y_fault[mask_all], prob_fault)
-            artifacts["models"]["fault"][h_key] = clf_fault
-            artifacts["metrics"]["fault"][h_key] = {"auc": auc_fault, "n": int(mask_all.sum())}
-
-        y_warn = group_all[f"y_warning_{h_key}"].to_numpy(dtype=int)
-        if len(np.unique(y_warn[mask_all])) >= 2:
-            clf_warn = HistGradientBoostingClassifier(max_depth=6, random_state=0)
-            clf_warn.fit(group_x[mask_all], y_warn[mask_all])
-            prob_warn = clf_warn.predict_proba(group_x[mask_all])[:, 1]
-            auc_warn = _safe_auc(y_warn[mask_all], prob_warn)
-            artifacts["models"]["warning"][h_key] = clf_warn
-            artifacts["metrics"]["warning"][h_key] = {"auc": auc_warn, "n": int(mask_all.sum())}
+    n_group_regressors = sum(len(v) for v in artifacts["models"]["group"].values())
+    if artifacts["models"].get("group_multi") is not None:
+        n_group_regressors += 1
+    artifacts["metrics"]["model_family"] = {
+        "name": args.model_family,
+        "group_regressors": n_group_regressors,
+        "group_fit_s": group_fit_s,
+        "group_model_bytes": _pickled_bytes(
+            {"group": artifacts["models"]["group"], "group_multi": artifacts["models"].get("group_multi")}
+        ),
+    }
+    if args.model_family == "multi-output" and args.compare_per_target:
+        # The layout multi-output replaces, fitted on the same arrays so the
+        # fit time, size and metrics["group"] MAE can be compared directly.
+        # Opt-in: it costs the whole per-target group fit again.
+        with recorder.stage("per_target_baseline") as rec:
+            baseline = per_target_baseline(arrays, group_targets, jobs=args.jobs, array_paths=array_paths)
+            rec["tasks"] = baseline["group_regressors"]
+        artifacts["metrics"]["model_family"]["per_target_baseline"] = baseline
+    artifacts["metrics"]["fit"] = {"jobs": args.jobs, "tasks": len(tasks), "wall_s": fit_wall_s}
 
-    model_path = os.path.join(out_dir, "model.joblib")
-    joblib.dump(artifacts, model_path)
+    artifacts["metrics"]["compact"] = bool(args.compact)
+    if args.incremental:
+        incremental["mode"] = "full" if prev_models is None else "warm"
+        if prev_models is not None:
+            incremental["warm_started"] = sum(p is not None for p in prev_models)
+            incremental["warm_iter"] = args.warm_iter
+        incremental["fit_wall_s"] = fit_wall_s
+        artifacts["metrics"]["incremental"] = incremental
+
+    # NumPy-only copy of the models for fast predict.py startup, checked
+    # against the fitted models on a sample of the training rows. It only
+    # replaces model.npz when the check passes; otherwise any older
+    # model.npz is removed so it is not loaded next to the new model.joblib.
+    compiled_path = os.path.join(out_dir, "model.npz")
+    check_path = os.path.join(out_dir, "model.npz.check")
+    with recorder.stage("compile"):
+        write_compiled(check_path, artifacts)
+        compiled_bytes = os.path.getsize(check_path)
+        sample_station = _sample_rows(arrays["station_x"], COMPILE_CHECK_ROWS)
+        sample_group = _sample_rows(arrays["group_x"], COMPILE_CHECK_ROWS)
+        check = compare_models(artifacts, load_compiled(check_path), sample_station, sample_group)
+    artifacts["metrics"]["compiled"] = {
+        "path": compiled_path if check["ok"] else None,
+        "bytes": compiled_bytes,
+        "check_rows": int(len(sample_station) + len(sample_group)),
+        **check,
+    }
+
+    # The compile check runs first so that "compiled" is part of the metrics
+    # saved in model.joblib; model.npz is still only replaced after it.
+    with recorder.stage("save"):
+        joblib.dump(artifacts, model_path)
+        if check["ok"]:
+            os.replace(check_path, compiled_path)
+        else:
+            os.remove(check_path)
+            if os.path.exists(compiled_path):
+                os.remove(compiled_path)
+    # Known only once model.joblib is written, so these two are in
+    # metrics.json but not in the metrics saved inside model.joblib.
+    artifacts["metrics"]["model_family"]["artifact_bytes"] = os.path.getsize(model_path)
+    if args.memory_report:
+        artifacts["metrics"]["memory"] = recorder.report()
 
     meta_path = os.path.join(out_dir, "metrics.json")
     with open(meta_path, "w", encoding="utf-8") as f:
         json.dump(artifacts["metrics"], f, ensure_ascii=False, indent=2)
 
-    print(json.dumps({"ok": True, "model_path": model_path, "metrics_path": meta_path}, ensure_ascii=False))
-    return 0
+    return {
+        "ok": True,
+        "model_path": model_path,
+        "compiled_path": compiled_path if check["ok"] else None,
+        "metrics_path": meta_path,
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+"""Successive-halving search over HistGradientBoosting settings (train.py --tune).
+
+Every HistGradientBoosting task of plan_fit_tasks gets its own search. Trials
+are fitted on the rows before a time-ordered validation slice, the newest
+val_fraction of the task's timestamps. Training rows whose label horizon
+reaches into that slice are left out. Trials early-stop on the validation
+loss (before scikit-learn 1.6, which has no fit(X_val=...), they fit every
+iteration and keep the count with the lowest loss). Rung k fits the surviving candidates on the newest n_k training rows
+and keeps the best 1/ETA; n_k grows by ETA per rung until the last rung
+uses every training row.
+
+A trial's latency is the compiled model's predict time for one snapshot of
+rows (see compiled_models.py). Candidates over the latency budget are
+dropped while any candidate is within it. The chosen settings fix max_iter
+to the iterations early stopping kept, but never below MIN_ITER, and
+train.py fits the final models on all rows with them. Tasks that cannot be
+searched keep DEFAULT_PARAMS; the report says which and why.
+"""
+
+import inspect
+import itertools
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingClassifier, HistGradientBoostingRegressor
+from sklearn.metrics import log_loss, mean_absolute_error
+
+from array_pool import WORKER_ARRAYS, array_pool
+from common import HORIZONS_MS
+from compiled_models import CompiledHGBRegressor, _compile_hgb
+
+
+SEARCH_SPACE: Dict[str, List[Any]] = {
+    "max_iter": [50, 100, 200, 400],
+    "max_depth": [3, 4, 6, 8],
+    "learning_rate": [0.05, 0.1, 0.2],
+    "max_bins": [63, 127, 255],
+}
+# What train.py fits without tuning; always one of the candidates.
+DEFAULT_PARAMS: Dict[str, Any] = {"max_iter": 100, "max_depth": 6, "learning_rate": 0.1, "max_bins": 255}
+
+ETA = 3
+N_ITER_NO_CHANGE = 10
+# Floor for the chosen max_iter: early stopping on a noisy validation slice
+# can stop after a few iterations, which leaves a nearly constant model.
+MIN_ITER = min(SEARCH_SPACE["max_iter"])
+MIN_TRAIN_ROWS = 200
+LATENCY_REPEATS = 5
+
+TUNED_KINDS = ("station", "group", "fault", "warning")
+
+# fit(X_val=, y_val=) arrived in scikit-learn 1.6; older versions hold out a
+# random split for early stopping, which would leak future rows.
+FIT_TAKES_VAL = "X_val" in inspect.signature(HistGradientBoostingRegressor.fit).parameters
+
+
+def candidate_params(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """DEFAULT_PARAMS plus n - 1 other distinct points of SEARCH_SPACE."""
+
+    keys = list(SEARCH_SPACE.keys())
+    grid = [dict(zip(keys, combo)) for combo in itertools.product(*(SEARCH_SPACE[k] for k in keys))]
+    others = [p for p in grid if p != DEFAULT_PARAMS]
+    rng = np.random.default_rng(seed)
+    picked = rng.permutation(len(others))[: max(0, n - 1)]
+    return [dict(DEFAULT_PARAMS)] + [others[i] for i in sorted(picked)]
+
+
+def task_params(hyperparams: Dict[str, Any], task: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+    if task[0] == "group":
+        return hyperparams.get("group", {}).get(task[1], {}).get(task[2])
+    if task[0] in TUNED_KINDS:
+        return hyperparams.get(task[0], {}).get(task[1])
+    return None
+
+
+def set_task_params(hyperparams: Dict[str, Any], task: Tuple[Any, ...], params: Dict[str, Any]) -> None:
+    if task[0] == "group":
+        hyperparams.setdefault("group", {}).setdefault(task[1], {})[task[2]] = params
+    else:
+        hyperparams.setdefault(task[0], {})[task[1]] = params
+
+
+def _task_data(
+    arrays: Dict[str, np.ndarray], task: Tuple[Any, ...]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (x, ts, y, usable-row mask) the same way train.py's _run_fit_task picks them.
+    kind = task[0]
+    if kind == "station":
+        y = np.asarray(arrays[f"y_station_{task[1]}"])
+        return arrays["station_x"], np.asarray(arrays["station_ts"]), y, np.isfinite(y)
+    if kind == "group":
+        y = np.asarray(arrays[f"y_{task[2]}_{task[1]}"])
+        return arrays["group_x"], np.asarray(arrays["group_ts"]), y, np.isfinite(y)
+    y = np.asarray(arrays[f"y_{kind}_{task[1]}"])
+    return arrays["group_x"], np.asarray(arrays["group_ts"]), y, np.asarray(arrays["group_mask_all"])
+
+
+def time_split(
+    ts: np.ndarray, mask: np.ndarray, horizon_ms: int, val_fraction: float
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(train rows oldest first, validation rows); None when either side is too small."""
+
+    rows = np.flatnonzero(mask)
+    if len(rows) == 0:
+        return None
+    uniq = np.unique(ts[rows])
+    cutoff = uniq[min(len(uniq) - 1, int(len(uniq) * (1.0 - val_fraction)))]
+    val = rows[ts[rows] >= cutoff]
+    train = rows[ts[rows] + horizon_ms < cutoff]
+    train = train[np.argsort(ts[train], kind="stable")]
+    if len(train) < MIN_TRAIN_ROWS or len(val) == 0:
+        return None
+    return train, val
+
+
+def _snapshot_latency_ms(model: Any, x: np.ndarray) -> float:
+    trees, baseline = _compile_hgb(model)
+    compiled = CompiledHGBRegressor(trees, baseline)
+    best = float("inf")
+    for _ in range(LATENCY_REPEATS):
+        t0 = time.perf_counter()
+        compiled.predict(x)
+        best = min(best, time.perf_counter() - t0)
+    return 1000.0 * best
+
+
+def _val_loss(model: Any, x_val: np.ndarray, y_val: np.ndarray, classifier: bool) -> float:
+    if classifier:
+        return float(log_loss(y_val, model.predict_proba(x_val), labels=model.classes_))
+    return float(mean_absolute_error(y_val, model.predict(x_val)))
+
+
+def _staged_val_losses(model: Any, x_val: np.ndarray, y_val: np.ndarray, classifier: bool) -> np.ndarray:
+    # Validation loss after each iteration, for scikit-learn without X_val.
+    if classifier:
+        stages = model.staged_predict_proba(x_val)
+        return np.array([log_loss(y_val, p, labels=model.classes_) for p in stages])
+    return np.array([mean_absolute_error(y_val, p) for p in model.staged_predict(x_val)])
+
+
+def _run_trial(trial: Tuple[Any, ...]) -> Dict[str, Any]:
+    task, params, n_rows, val_fraction = trial
+    t0 = time.perf_counter()
+    x, ts, y, mask = _task_data(WORKER_ARRAYS, task)
+    split = time_split(ts, mask, HORIZONS_MS[task[1]], val_fraction)
+    assert split is not None
+    train, val = split
+    train = train[-n_rows:]
+    classifier = task[0] in ("fault", "warning")
+    cls = HistGradientBoostingClassifier if classifier else HistGradientBoostingRegressor
+    x_val = np.asarray(x[val])
+    y_train = y[train]
+    if classifier and len(np.unique(y_train)) < 2:
+        return {"score": float("inf"), "n_iter": 0, "trees": 0, "latency_ms": 0.0, "fit_s": 0.0}
+    if FIT_TAKES_VAL:
+        model = cls(**params, early_stopping=True, n_iter_no_change=N_ITER_NO_CHANGE, scoring="loss", random_state=0)
+        model.fit(np.asarray(x[train]), y_train, X_val=x_val, y_val=y[val])
+        score = _val_loss(model, x_val, y[val], classifier)
+        n_iter = int(model.n_iter_)
+        if n_iter < params["max_iter"]:
+            # Stopped early: the last N_ITER_NO_CHANGE iterations did not help.
+            n_iter = max(MIN_ITER, n_iter - N_ITER_NO_CHANGE)
+    else:
+        # fit() cannot take the validation slice before scikit-learn 1.6:
+        # fit every iteration and keep the count with the lowest loss on it.
+        model = cls(**params, early_stopping=False, random_state=0)
+        model.fit(np.asarray(x[train]), y_train)
+        losses = _staged_val_losses(model, x_val, y[val], classifier)
+        best = int(np.argmin(losses))
+        score = float(losses[best])
+        n_iter = max(MIN_ITER, best + 1)
+    # One snapshot: the validation rows of its newest ts.
+    snapshot = x_val[ts[val] == ts[val].max()]
+    return {
+        "score": score,
+        "n_iter": n_iter,
+        "trees": int(model.n_iter_),
+        "latency_ms": _snapshot_latency_ms(model, snapshot),
+        "fit_s": time.perf_counter() - t0,
+    }
+
+
+def _rung_rows(n_train: int, n_rungs: int) -> List[int]:
+    return [
+        min(n_train, max(MIN_TRAIN_ROWS, int(math.ceil(n_train / ETA ** (n_rungs - 1 - k))))) for k in range(n_rungs)
+    ]
+
+
+def _survivors(
+    cands: List[int], results: Dict[int, Dict[str, Any]], keep: int, latency_budget_ms: Optional[float]
+) -> List[int]:
+    within = cands
+    if latency_budget_ms is not None:
+        within = [c for c in cands if results[c]["latency_ms"] <= latency_budget_ms]
+        if not within:
+            # Nothing fits the budget: keep the fastest.
+            return sorted(cands, key=lambda c: results[c]["latency_ms"])[:keep]
+    return sorted(within, key=lambda c: (results[c]["score"], results[c]["latency_ms"]))[:keep]
+
+
+def tune_fit_tasks(
+    tasks: List[Tuple[Any, ...]],
+    arrays: Dict[str, np.ndarray],
+    jobs: int = 1,
+    array_paths: Optional[Dict[str, str]] = None,
+    n_candidates: int = 27,
+    val_fraction: float = 0.2,
+    latency_budget_ms: Optional[float] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Search settings for every HistGradientBoosting task.
+
+    Returns (hyperparams keyed like artifacts["models"], report). Tasks with
+    too few rows before the validation slice, or without a finite validation
+    score, keep the defaults: they are listed under "skipped" and their
+    report["tasks"] entry has "fallback" with the reason.
+    """
+
+    cands = candidate_params(n_candidates)
+    n_rungs = 1 + int(math.floor(math.log(len(cands), ETA) + 1e-9))
+    plans: Dict[int, List[int]] = {}
+    report: Dict[str, Any] = {
+        "candidates": len(cands),
+        "rungs": n_rungs,
+        "eta": ETA,
+        "val_fraction": val_fraction,
+        "latency_budget_ms": latency_budget_ms,
+        "tasks": {},
+        "skipped": [],
+    }
+    for i, task in enumerate(tasks):
+        if task[0] not in TUNED_KINDS:
+            continue
+        _x, ts, _y, mask = _task_data(arrays, task)
+        split = time_split(ts, mask, HORIZONS_MS[task[1]], val_fraction)
+        if split is None:
+            name = "/".join(str(p) for p in task)
+            report["skipped"].append(name)
+            report["tasks"][name] = {
+                "params": dict(DEFAULT_PARAMS),
+                "fallback": f"fewer than {MIN_TRAIN_ROWS} training rows before the validation slice",
+                "usable_rows": int(np.count_nonzero(mask)),
+            }
+            continue
+        plans[i] = _rung_rows(len(split[0]), n_rungs)
+
+    survivors = {i: list(range(len(cands))) for i in plans}
+    last: Dict[int, Dict[int, Dict[str, Any]]] = {}
+    trials_run = 0
+    t0 = time.perf_counter()
+    # One pool (and one copy of the arrays) for all rungs.
+    with array_pool(arrays, jobs, array_paths) as pool:
+        for k in range(n_rungs):
+            trials = [(i, c) for i in plans for c in survivors[i]]
+            args = [(tasks[i], cands[c], plans[i][k], val_fraction) for i, c in trials]
+            results = [_run_trial(t) for t in args] if pool is None else list(pool.map(_run_trial, args))
+            trials_run += len(trials)
+            by_task: Dict[int, Dict[int, Dict[str, Any]]] = {i: {} for i in plans}
+            for (i, c), res in zip(trials, results):
+                by_task[i][c] = res
+            for i in plans:
+                keep = max(1, len(survivors[i]) // ETA) if k < n_rungs - 1 else 1
+                survivors[i] = _survivors(survivors[i], by_task[i], keep, latency_budget_ms)
+            last = by_task
+
+    hyperparams: Dict[str, Any] = {}
+    for i in plans:
+        best = survivors[i][0]
+        res = last[i][best]
+        name = "/".join(str(p) for p in tasks[i])
+        if not math.isfinite(res["score"]):
+            # E.g. a classifier whose training rows hold one class only.
+            report["skipped"].append(name)
+            report["tasks"][name] = {
+                "params": dict(DEFAULT_PARAMS),
+                "fallback": "no finite validation score",
+                "train_rows": plans[i][-1],
+            }
+            continue
+        # Predict time is linear in the tree count; the trial's model also
+        # had the N_ITER_NO_CHANGE trees early stopping dropped.
+        ms_per_tree = res["latency_ms"] / max(1, res["trees"])
+        n_iter = res["n_iter"]
+        if latency_budget_ms is not None and n_iter * ms_per_tree > latency_budget_ms:
+            # The last rung's extra rows can grow more trees than the
+            # smaller rungs did.
+            n_iter = max(MIN_ITER, int(latency_budget_ms / ms_per_tree))
+        latency_ms = n_iter * ms_per_tree
+        params = dict(cands[best], max_iter=n_iter, early_stopping=False)
+        set_task_params(hyperparams, tasks[i], params)
+        report["tasks"][name] = {
+            "params": params,
+            "val_score": res["score"],
+            "latency_ms": latency_ms,
+            "capped_for_latency": n_iter < res["n_iter"],
+            "within_budget": latency_budget_ms is None or latency_ms <= latency_budget_ms,
+            "train_rows": plans[i][-1],
+        }
+    report["trials"] = trials_run
+    report["wall_s"] = time.perf_counter() - t0
+    return hyperparams, report